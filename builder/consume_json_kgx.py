@@ -1,9 +1,8 @@
 import time
 import json
 from greent.graph_components import KNode, LabeledID
-from greent.rosetta import Rosetta
-from greent.export_delegator import WriterDelegator
 from greent.service import Service
+from builder import kgx_ingest
 
 
 class KGX_JSON_File_parser(Service):
@@ -132,33 +131,8 @@ class KGX_JSON_File_parser(Service):
                     continue
 
     def run(self, nodes_file_name, edges_file_name, provided_by):
-        self.rosetta = Rosetta()
-        self.wdg = WriterDelegator(rosetta)
-        self.wdg.normalized = True
-
-        nodes = self.get_nodes_from_file(nodes_file_name)
-
-        counter = 0
-
-        for node in nodes:
-            print(node)
-            counter += 1
-            if counter > 10:
-                break
-            self.wdg.write_node(node, annotate=False)
-
-        edges = self.get_edges_from_file(edges_file_name, provided_by)
-
-        counter = 0
-
-        for edge in edges:
-            print(edge)
-            counter += 1
-            if counter > 10:
-                break
-            self.wdg.write_edge(edge)
-
-        self.wdg.flush()
+        """ Load the files with the parallel KGX ingest, see builder.kgx_ingest. """
+        return kgx_ingest.run(nodes_file_name, edges_file_name, provided_by)
 
 
 if __name__=='__main__':
@@ -172,7 +146,6 @@ if __name__=='__main__':
     parser.add_argument('-p', '--provided_by', help="provided by", required=True)
     args = parser.parse_args()
 
-    rosetta = Rosetta()
     kgx_loader = KGX_JSON_File_parser()
     if not args.nodes_file and not args.edges_file:
         print('Nothing to parse exiting')
@@ -1,8 +1,7 @@
 import csv
 from greent.graph_components import KNode, LabeledID
-from greent.rosetta import Rosetta
-from greent.export_delegator import WriterDelegator
 from greent.service import Service
+from builder import kgx_ingest
 import requests
 
 import traceback
@@ -103,16 +102,8 @@ class KGX_File_parser(Service):
                 yield edge
 
     def run(self, nodes_file_name, edges_file_name, provided_by, delimiter):
-        self.rosetta = Rosetta()
-        self.wdg = WriterDelegator(rosetta)
-        self.wdg.normalized = True
-
-        for node in self.get_nodes_from_file(nodes_file_name, delimiter):
-            self.wdg.write_node(node, annotate=False)
-
-        for edge in self.get_edges_from_file(edges_file_name, provided_by=provided_by, delimiter=delimiter):
-            self.wdg.write_edge(edge)
-        self.wdg.flush()
+        """ Load the files with the parallel KGX ingest, see builder.kgx_ingest. """
+        return kgx_ingest.run(nodes_file_name, edges_file_name, provided_by, delimiter=delimiter)
 
 
 
@@ -138,7 +129,6 @@ if __name__=='__main__':
         print('Invalid record column delimiter.')
         exit()
 
-    rosetta = Rosetta()
     kgx_loader =KGX_File_parser()
     if not args.nodes_file and not args.edges_file:
         print('Nothing to parse exiting')
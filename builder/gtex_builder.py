@@ -4,9 +4,8 @@ from greent.graph_components import KNode
 from greent.export_delegator import WriterDelegator
 from greent.util import LoggingUtil
 from greent.util import Text
-from builder.gtex_utils import GTExUtils
+from builder.gtex_utils import GTExUtils, read_processed_batches, pq
 from builder.question import LabeledID
-import csv
 import os
 
 # declare a logger and initialize it.
@@ -30,6 +29,7 @@ class GTExBuilder:
         self.rosetta = rosetta
         self.written_anatomical_entities = set()
         self.written_genes = set()
+        self.written_gene_anatomy_edges = set()
         self.max_nodes = 100_000
 
         # create static labels for the edge predicates
@@ -51,18 +51,20 @@ class GTExBuilder:
     # param process_for_graph: bool - flag to process the GTEx file and load the neo4j graph with it
     # param is_sqtl: bool - flag to indicate if we're talking about sqtl or eqtl, default to eqtl
     # param gtex_version: int - the version of gtex data to load
+    # param batch_mode: bool - write the graph a batch of rows at a time, see write_gtex_batch
     # returns: object, pass if it is None, otherwise an exception object to indicate what failed
     #####################
-    def load(self, data_directory: str, out_file_name: str = None, process_raw_data: bool = True, process_for_graph: bool = True, is_sqtl: bool = False, gtex_version: int = 8) -> object:
+    def load(self, data_directory: str, out_file_name: str = None, process_raw_data: bool = True, process_for_graph: bool = True, is_sqtl: bool = False, gtex_version: int = 8, batch_mode: bool = False) -> object:
         # init the return value
         ret_val = None
 
-        #set default output file names if not provided
+        #set default output file names if not provided. use the compact parquet format when pyarrow is installed
         if not out_file_name:
+            extension = 'csv' if pq is None else 'parquet'
             if is_sqtl:
-                out_file_name = 'sqtl_signif_pairs.csv'
+                out_file_name = f'sqtl_signif_pairs.{extension}'
             else:
-                out_file_name = 'eqtl_signif_pairs.csv'
+                out_file_name = f'eqtl_signif_pairs.{extension}'
 
 
         # does the output directory exist
@@ -85,7 +87,7 @@ class GTExBuilder:
                 if ret_val is None:
                     if process_for_graph is True:
                         # call the GTEx builder to load the cache and graph database
-                        ret_val: object = self.create_gtex_graph(data_directory, out_file_name, f'GTEx.v{gtex_version}', is_sqtl=is_sqtl)
+                        ret_val: object = self.create_gtex_graph(data_directory, out_file_name, f'GTEx.v{gtex_version}', is_sqtl=is_sqtl, batch_mode=batch_mode)
                     else:
                         logger.info("Graph node/edge processing not selected.")
                 else:
@@ -99,16 +101,18 @@ class GTExBuilder:
     # a wrapper function to load sqtl instead of eqtl
     def load_sqtl(self,
                   data_directory: str,
-                  out_file_name: str = 'sqtl_signif_pairs.csv',
+                  out_file_name: str = None,
                   process_raw_data: bool = True,
                   process_for_graph: bool = True,
-                  gtex_version: int = 8):
+                  gtex_version: int = 8,
+                  batch_mode: bool = False):
         return self.load(data_directory,
                          out_file_name,
                          process_raw_data=process_raw_data,
                          process_for_graph=process_for_graph,
                          is_sqtl=True,
-                         gtex_version=gtex_version)
+                         gtex_version=gtex_version,
+                         batch_mode=batch_mode)
 
     #######
     # create_gtex_graph - Parses the CSV file(s) and inserts the data into the graph DB
@@ -116,9 +120,10 @@ class GTExBuilder:
     # param data_directory: str - the name of the directory the file is in
     # param associated_file_names: list - list of file names to process
     # param namespace: str - the name of the data source
+    # param batch_mode: bool - write each batch of rows with write_gtex_batch instead of row by row
     # returns: object, pass if it is none, otherwise an exception object
     #######
-    def create_gtex_graph(self, data_directory: str, file_name: str, namespace: str, is_sqtl: bool=False) -> object:
+    def create_gtex_graph(self, data_directory: str, file_name: str, namespace: str, is_sqtl: bool=False, batch_mode: bool = False) -> object:
         # init the return value
         ret_val: object = None
 
@@ -138,35 +143,23 @@ class GTExBuilder:
                 curie_uberon = None
                 curie_ensembl = None
 
-                # open the file and start reading
-                with open(full_file_path, 'r') as inFH:
-                    # open up a csv reader
-                    csv_reader = csv.reader(inFH)
+                # read the processed file a batch of columns at a time
+                for batch in read_processed_batches(full_file_path):
+                    if batch_mode:
+                        line_counter += self.write_gtex_batch(graph_writer, batch, namespace, is_sqtl)
 
-                    # read the header
-                    header_line = next(csv_reader)
-
-                    # find relevant indices
-                    tissue_name_index = header_line.index('tissue_name')
-                    tissue_uberon_index = header_line.index('tissue_uberon')
-                    hgvs_index = header_line.index('HGVS')
-                    ensembl_id_index = header_line.index('gene_id')
-                    pval_nominal_index = header_line.index('pval_nominal')
-                    pval_slope_index = header_line.index('slope')
+                        # output some feedback for the user
+                        logger.info(f'Processed {line_counter} variants.')
+                        continue
 
                     try:
-                        # for the rest of the lines in the file
-                        for line in csv_reader:
+                        # for the rows in the batch
+                        for tissue_name, uberon, hgvs, ensembl, pval_nominal, slope in zip(batch['tissue_name'], batch['tissue_uberon'], batch['HGVS'], batch['gene_id'], batch['pval_nominal'], batch['slope']):
                             # increment the counter
                             line_counter += 1
 
                             # get the data elements
-                            tissue_name = line[tissue_name_index]
-                            uberon = line[tissue_uberon_index]
-                            hgvs = line[hgvs_index]
-                            ensembl = line[ensembl_id_index].split(".", 1)[0]
-                            pval_nominal = line[pval_nominal_index]
-                            slope = line[pval_slope_index]
+                            ensembl = ensembl.split(".", 1)[0]
 
                             # create curies for the various id values
                             curie_hgvs = f'HGVS:{hgvs}'
@@ -236,7 +229,7 @@ class GTExBuilder:
                             if len(self.written_genes) == self.max_nodes:
                                 self.written_genes = set()
                     except (KeyError, IndexError) as e:
-                        logger.error(f'Exception caught trying to process variant: {curie_hgvs}-{curie_uberon}-{curie_ensembl} at data line: {line_counter}. Exception: {e}, Line: {line}')
+                        logger.error(f'Exception caught trying to process variant: {curie_hgvs}-{curie_uberon}-{curie_ensembl} at data line: {line_counter}. Exception: {e}')
 
         except Exception as e:
             logger.error(f'Exception caught: Exception: {e}')
@@ -248,6 +241,106 @@ class GTExBuilder:
         # return to the caller
         return ret_val
 
+    #######
+    # write_gtex_batch - Writes the nodes and edges for a batch of processed GTEx rows.
+    #
+    # Rows are grouped by (variant, gene, tissue), the last row of a group winning as it would when
+    # written row by row. Every node is written once, genes and tissues once per load, and the edges go
+    # to the writer grouped by predicate. Repeated variant to tissue edges differ only in hyper edge id
+    # and merge into the same graph edge, so only the last one is written.
+    #
+    # param graph_writer: WriterDelegator - writer for the nodes and edges
+    # param batch: dict - columns of processed GTEx rows, see read_processed_batches
+    # param namespace: str - the name of the data source
+    # returns: int - the number of rows in the batch
+    #######
+    def write_gtex_batch(self, graph_writer: WriterDelegator, batch: dict, namespace: str, is_sqtl: bool = False) -> int:
+        # group the rows by (variant, gene, tissue)
+        rows: dict = {}
+        tissue_names: dict = {}
+
+        for tissue_name, uberon, hgvs, ensembl, pval_nominal, slope in zip(batch['tissue_name'], batch['tissue_uberon'], batch['HGVS'], batch['gene_id'], batch['pval_nominal'], batch['slope']):
+            ensembl = ensembl.split(".", 1)[0]
+
+            if is_sqtl:
+                # sqtl variant to gene always uses the same predicate
+                predicate = self.variant_gene_sqtl_predicate
+            else:
+                # for eqtl use the polarity of slope to get the direction of expression.
+                try:
+                    if float(slope) > 0.0:
+                        predicate = self.increases_expression_predicate
+                    else:
+                        predicate = self.decreases_expression_predicate
+                except ValueError as e:
+                    logger.error(f"Error casting slope to a float for {hgvs}-{uberon}-{ensembl} (slope - {slope}) {e}")
+                    continue
+
+            rows[(hgvs, ensembl, uberon)] = (pval_nominal, slope, predicate)
+            tissue_names[uberon] = tissue_name
+
+        keys: list = list(rows)
+
+        # get the MD5 hash ints of the composite hyper edge IDs
+        hyper_edge_ids: list = self.gtu.get_hyper_edge_ids([key[2] for key in keys], [key[1] for key in keys], [key[0] for key in keys])
+
+        # create each node once
+        variant_nodes: dict = {}
+        gene_nodes: dict = {}
+        gtex_nodes: dict = {}
+
+        for hgvs, ensembl, uberon in keys:
+            if hgvs not in variant_nodes:
+                variant_nodes[hgvs] = KNode(f'HGVS:{hgvs}', name=hgvs, type=node_types.SEQUENCE_VARIANT)
+                variant_nodes[hgvs].add_export_labels([node_types.SEQUENCE_VARIANT])
+
+            if ensembl not in gene_nodes:
+                gene_nodes[ensembl] = KNode(f'ENSEMBL:{ensembl}', name=ensembl, type=node_types.GENE)
+                gene_nodes[ensembl].add_export_labels([node_types.GENE])
+
+            if uberon not in gtex_nodes:
+                gtex_nodes[uberon] = KNode(f'UBERON:{uberon}', name=tissue_names[uberon], type=node_types.ANATOMICAL_ENTITY)
+
+        for variant_node in variant_nodes.values():
+            graph_writer.write_node(variant_node)
+
+        for gene_node in gene_nodes.values():
+            if gene_node.id not in self.written_genes:
+                graph_writer.write_node(gene_node)
+                self.written_genes.add(gene_node.id)
+
+        for gtex_node in gtex_nodes.values():
+            if gtex_node.id not in self.written_anatomical_entities:
+                graph_writer.write_node(gtex_node)
+                self.written_anatomical_entities.add(gtex_node.id)
+
+        # associate the sequence variant nodes with an edge to the gtex anatomy nodes
+        variant_anatomy_edges: dict = {(hgvs, uberon): hyper_edge_id for (hgvs, ensembl, uberon), hyper_edge_id in zip(keys, hyper_edge_ids)}
+
+        for (hgvs, uberon), hyper_edge_id in variant_anatomy_edges.items():
+            self.gtu.write_new_association(graph_writer, variant_nodes[hgvs], gtex_nodes[uberon], self.variant_anatomy_predicate, hyper_edge_id, None, True)
+
+        # associate the gene nodes with an edge to the gtex anatomy nodes, once per load
+        for ensembl, uberon in dict.fromkeys((ensembl, uberon) for hgvs, ensembl, uberon in keys):
+            if (ensembl, uberon) not in self.written_gene_anatomy_edges:
+                self.gtu.write_new_association(graph_writer, gene_nodes[ensembl], gtex_nodes[uberon], self.gene_anatomy_predicate, 0, None, False)
+                self.written_gene_anatomy_edges.add((ensembl, uberon))
+
+        # associate the sequence variant nodes with an edge to the gene nodes, a predicate at a time
+        by_predicate: dict = {}
+
+        for key, hyper_edge_id in zip(keys, hyper_edge_ids):
+            by_predicate.setdefault(rows[key][2].identifier, []).append((key, hyper_edge_id))
+
+        for predicate_rows in by_predicate.values():
+            for (hgvs, ensembl, uberon), hyper_edge_id in predicate_rows:
+                pval_nominal, slope, predicate = rows[(hgvs, ensembl, uberon)]
+
+                self.gtu.write_new_association(graph_writer, variant_nodes[hgvs], gene_nodes[ensembl], predicate, hyper_edge_id, [ensembl, pval_nominal, slope, namespace], True)
+
+        # return the number of rows to the caller
+        return len(batch['HGVS'])
+
 #######
 # Main - Stand alone entry point for testing
 #######
@@ -262,13 +355,14 @@ if __name__ == '__main__':
     rv = gtb.load(working_data_directory)
 
     # or use some optional parameters
-    # out_file_name specifies the name of the combined and processed gtex cvs (eqtl_signif_pairs.csv)
+    # out_file_name specifies the name of the combined and processed gtex file (eqtl_signif_pairs.parquet, or .csv without pyarrow)
     # process_raw_data creates that file - specify the existing file name and set to False if one exists
     # rv = gtb.load(working_data_directory,
     #              out_file_name='example_eqtl_output.csv',
     #              process_raw_data=True,
     #              process_for_graph=True,
-    #              gtex_version=8)
+    #              gtex_version=8,
+    #              batch_mode=True)
 
     # check the return, output error if found
     if rv is not None:
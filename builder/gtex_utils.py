@@ -14,11 +14,50 @@ import os
 from urllib import request
 import tarfile
 import gzip
+import io
+import shutil
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from itertools import islice
+from greent.services.clingen import DEFAULT_BATCH_WORKERS
+
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 # declare a logger and initialize it
 import logging
 logger = LoggingUtil.init_logging("robokop-interfaces.builder.GTExUtils", logging.INFO, format='medium', logFilePath=f'{os.environ["ROBOKOP_HOME"]}/logs/')
 
+# the number of HGVS expressions looked up in the cache at once
+CACHE_PROBE_SIZE: int = 10000
+
+# maps the HG version to the chromosome versions
+REFERENCE_CHROM_LABELS: dict = {
+    'b37': {
+        'p1': {
+            1: 'NC_000001.10', 2: 'NC_000002.11', 3: 'NC_000003.11', 4: 'NC_000004.11', 5: 'NC_000005.9',
+            6: 'NC_000006.11', 7: 'NC_000007.13', 8: 'NC_000008.10', 9: 'NC_000009.11', 10: 'NC_000010.10', 11: 'NC_000011.9',
+            12: 'NC_000012.11', 13: 'NC_000013.10', 14: 'NC_000014.8', 15: 'NC_000015.9', 16: 'NC_000016.9', 17: 'NC_000017.10',
+            18: 'NC_000018.9', 19: 'NC_000019.9', 20: 'NC_000020.10', 21: 'NC_000021.8', 22: 'NC_000022.10', 23: 'NC_000023.10',
+            24: 'NC_000024.9'
+        }
+    },
+    'b38': {
+        'p1': {
+            1: 'NC_000001.11', 2: 'NC_000002.12', 3: 'NC_000003.12', 4: 'NC_000004.12', 5: 'NC_000005.10',
+            6: 'NC_000006.12', 7: 'NC_000007.14', 8: 'NC_000008.11', 9: 'NC_000009.12', 10: 'NC_000010.11', 11: 'NC_000011.10',
+            12: 'NC_000012.12', 13: 'NC_000013.11', 14: 'NC_000014.9', 15: 'NC_000015.10', 16: 'NC_000016.10', 17: 'NC_000017.11',
+            18: 'NC_000018.10', 19: 'NC_000019.10', 20: 'NC_000020.11', 21: 'NC_000021.9', 22: 'NC_000022.11', 23: 'NC_000023.11',
+            24: 'NC_000024.10'
+        }
+    }
+}
+
 
 #############
 # Class: GTExUtils
@@ -108,144 +147,140 @@ class GTExUtils:
             "Whole_Blood": "0000178"}
 
         # maps the HG version to the chromosome versions
-        self.reference_chrom_labels: dict = {
-            'b37': {
-                'p1': {
-                    1: 'NC_000001.10', 2: 'NC_000002.11', 3: 'NC_000003.11', 4: 'NC_000004.11', 5: 'NC_000005.9',
-                    6: 'NC_000006.11', 7: 'NC_000007.13', 8: 'NC_000008.10', 9: 'NC_000009.11', 10: 'NC_000010.10', 11: 'NC_000011.9',
-                    12: 'NC_000012.11', 13: 'NC_000013.10', 14: 'NC_000014.8', 15: 'NC_000015.9', 16: 'NC_000016.9', 17: 'NC_000017.10',
-                    18: 'NC_000018.9', 19: 'NC_000019.9', 20: 'NC_000020.10', 21: 'NC_000021.8', 22: 'NC_000022.10', 23: 'NC_000023.10',
-                    24: 'NC_000024.9'
-                }
-            },
-            'b38': {
-                'p1': {
-                    1: 'NC_000001.11', 2: 'NC_000002.12', 3: 'NC_000003.12', 4: 'NC_000004.12', 5: 'NC_000005.10',
-                    6: 'NC_000006.12', 7: 'NC_000007.14', 8: 'NC_000008.11', 9: 'NC_000009.12', 10: 'NC_000010.11', 11: 'NC_000011.10',
-                    12: 'NC_000012.12', 13: 'NC_000013.11', 14: 'NC_000014.9', 15: 'NC_000015.10', 16: 'NC_000016.10', 17: 'NC_000017.11',
-                    18: 'NC_000018.10', 19: 'NC_000019.10', 20: 'NC_000020.11', 21: 'NC_000021.9', 22: 'NC_000022.11', 23: 'NC_000023.11',
-                    24: 'NC_000024.10'
-                }
-            }
-        }
+        self.reference_chrom_labels: dict = REFERENCE_CHROM_LABELS
 
     #############
     # process_gtex_files - gets a reformatted GTEx data file.
     # rev .0, 5/21/2019- supports v7 of GTEx data
     # rev .1, 9/27/2019 - supports v8 of GTEx data
+    # rev .2 - streams the tar and parses the tissue files in parallel
+    #
+    # The tar is read straight from the download, one member at a time, and each significant
+    # tissue file is handed to a pool of worker processes (see parse_tissue_file). Each worker writes
+    # the tissue's rows to a part file, and the parts are then combined into the output file. An output
+    # file name ending in .parquet gives a Parquet file (requires pyarrow), anything else a CSV file.
     #
     # param working_data_directory: str - the location of where the output files should go, defaults to the current directory
     # param out_file_name: str - the name of the processed output file, defaults to a default data file name
     # param tar_file_name: str - the name of the GTEx data file name (tar)
+    # param workers: int - the number of tissue files parsed at once, defaults to the number of CPUs
     # returns ret_val: object - Exception on error, otherwise None
     #############
-    def process_gtex_files(self, working_data_directory: str, out_file_name: str, tar_file_name: str = None, gtex_version: int = 8, is_sqtl: bool = False)-> object:
+    def process_gtex_files(self, working_data_directory: str, out_file_name: str, tar_file_name: str = None, gtex_version: int = 8, is_sqtl: bool = False, workers: int = None)-> object:
         # init the return
         ret_val = None
 
-        # init the input file path
-        full_tar_path = ''
-
         if not tar_file_name:
             if is_sqtl:
                 tar_file_name = f'GTEx_Analysis_v{gtex_version}_sQTL.tar'
             else:
                 tar_file_name = f'GTEx_Analysis_v{gtex_version}_eQTL.tar'
 
-        try:
-            # define full paths to the input and output files
-            full_tar_path = f'{working_data_directory}{tar_file_name}'
-            full_out_path = f'{working_data_directory}{out_file_name}'
+        # define full paths to the output file and the per tissue files that make it up
+        full_out_path = f'{working_data_directory}{out_file_name}'
+        parts_directory = f'{full_out_path}.parts'
 
+        try:
             # define the url for the raw data file
             url = f'https://storage.googleapis.com/gtex_analysis_v{gtex_version}/single_tissue_qtl_data/{tar_file_name}'
 
-            logger.info(f'Downloading raw GTEx data file {url}.')
+            logger.info(f'Streaming raw GTEx data file {url}.')
 
             # get a http handle to the file stream
             http_handle = request.urlopen(url)
 
-            # open the file and save it
-            with open(full_tar_path, 'wb') as tar_file:
-                # while there is data
-                while True:
-                    # read a block of data
-                    data = http_handle.read(8192)
-
-                    # if nothing read
-                    if len(data) == 0:
-                        break
+            # parse the tissue files as they arrive
+            part_paths = self.parse_tissue_files(http_handle, parts_directory, full_out_path.endswith('.parquet'), is_sqtl, workers)
 
-                    # write out the data to the output file
-                    tar_file.write(data)
+            # insure that we got every tissue. the tar contains 2 files for each tissue, only one of them significant pairs
+            if len(part_paths) != len(self.tissues):
+                raise Exception(f'Unexpected number of GTEx input files detected. Aborting.')
 
-            logger.info(f'GTEx tar file downloaded. Extracting and parsing individual tissue files in {full_tar_path}.')
+            logger.info(f'All {len(part_paths)} tissue files parsed. Combining them into {full_out_path}.')
 
-            # init a first line read flag
-            first_file_flag: bool = True
-
-            # for each file in the tar archive
-            with tarfile.open(full_tar_path, 'r:') as tar_files, open(full_out_path, 'w') as output_file:
-                # insure that we have the correct number of expected tar_files. the contents of this file contains 2 types for each tissue
-                if len(self.tissues) * 2 == len(tar_files.getnames()):
-                    # for each tissue data file in the tar
-                    for tissue_file in tar_files:
-                        # get a handle to the tissue file
-                        tissue_handle = tar_files.extractfile(tissue_file)
-
-                        # is this a "significant variant" data file. expecting formats:
-                        # eqtl - 'GTEx_Analysis_v8_eQTL/<tissue_name>.v8.signif_variant_gene_pairs.txt.gz'
-                        # sqtl - 'GTEx_Analysis_v8_sQTL/<tissue_name>.v8.sqtl_signifpairs.txt.gz'
-                        if tissue_file.name.find('signif') > 0:
-
-                            logger.debug(f'Processing tissue file {tissue_file.name}.')
-
-                            # get the tissue name from the name of the file
-                            tissue_name: str = tissue_file.name.split('/')[1].split('.')[0]
-
-                            # lookup the uberon code for the tissue using the file name
-                            tissue_uberon: str = self.tissues[tissue_name]
-
-                            # check to make sure we know about this file
-                            if tissue_uberon is not None:
-                                # insure that the file name doesnt have an underscore ro the rest of this files' processing
-                                tissue_name = tissue_name.replace('_', ' ')
-
-                                # open up the compressed file
-                                with gzip.open(tissue_handle, 'rt') as compressed_file:
-                                    # get the headers line of the file
-                                    first_line = next(compressed_file)
-
-                                    # if this if the first file write out the csv file header
-                                    if first_file_flag is True:
-                                        output_file.write(f'tissue_name,tissue_uberon,HGVS,gene_id,{first_line}'.replace('\t', ','))
-                                        first_file_flag = False
-
-                                    # for each line in the file
-                                    for line in compressed_file:
-                                        if is_sqtl:
-                                            output_file.write(self.parse_tissue_line(line, tissue_name, tissue_uberon, 0, 1, is_sqtl=True))
-                                        else:
-                                            output_file.write(self.parse_tissue_line(line, tissue_name, tissue_uberon, 0, 1, is_sqtl=False))
-                            else:
-                                logger.debug(f'Skipping unexpected tissue file {tissue_file.name}.')
-                        else:
-                            logger.debug(f'Skipping non-significant tissue file {tissue_file.name}.')
-                else:
-                    raise Exception(f'Unexpected number of GTEx input files detected. Aborting.')
+            # combine the tissue files in a predictable order
+            merge_processed_parts([part_paths[tissue_name] for tissue_name in sorted(part_paths)], full_out_path)
         except Exception as e:
             logger.error(f'Exception caught. Exception: {e}')
             ret_val = e
         finally:
-            # remove all the intermediate (tar) files
-            if os.path.isfile(full_tar_path):
-                os.remove(full_tar_path)
+            # remove all the intermediate (per tissue) files
+            if os.path.isdir(parts_directory):
+                shutil.rmtree(parts_directory)
 
         logger.info(f'GTEx data file decompression and reformatting complete.')
 
         # return the output file name to the caller
         return ret_val
 
+    #############
+    # parse_tissue_files - reads a GTEx tar stream and parses its significant tissue files in a process pool
+    #
+    # param tar_stream - a file like object with the tar data
+    # param parts_directory: str - where the per tissue output files go
+    # param parquet: bool - write Parquet rather than CSV part files
+    # param workers: int - the number of worker processes
+    # returns: dict - the part file path of every tissue
+    #############
+    def parse_tissue_files(self, tar_stream, parts_directory: str, parquet: bool, is_sqtl: bool = False, workers: int = None) -> dict:
+        # init the return
+        part_paths: dict = {}
+
+        os.makedirs(parts_directory, exist_ok=True)
+
+        workers = workers or os.cpu_count()
+
+        futures = []
+
+        # the futures still running
+        pending = set()
+
+        # 'r|' reads the tar sequentially so nothing has to be staged on disk
+        with tarfile.open(fileobj=tar_stream, mode='r|') as tar_files, ProcessPoolExecutor(workers) as pool:
+            # for each file in the tar archive
+            for tissue_file in tar_files:
+                # is this a "significant variant" data file. expecting formats:
+                # eqtl - 'GTEx_Analysis_v8_eQTL/<tissue_name>.v8.signif_variant_gene_pairs.txt.gz'
+                # sqtl - 'GTEx_Analysis_v8_sQTL/<tissue_name>.v8.sqtl_signifpairs.txt.gz'
+                if tissue_file.name.find('signif') < 0:
+                    logger.debug(f'Skipping non-significant tissue file {tissue_file.name}.')
+                    continue
+
+                # get the tissue name from the name of the file
+                tissue_name: str = tissue_file.name.split('/')[1].split('.')[0]
+
+                # lookup the uberon code for the tissue using the file name
+                tissue_uberon: str = self.tissues.get(tissue_name)
+
+                # check to make sure we know about this file
+                if tissue_uberon is None:
+                    logger.debug(f'Skipping unexpected tissue file {tissue_file.name}.')
+                    continue
+
+                logger.debug(f'Processing tissue file {tissue_file.name}.')
+
+                # the member can only be read now, while the stream is positioned on it
+                data: bytes = tar_files.extractfile(tissue_file).read()
+
+                part_paths[tissue_name] = os.path.join(parts_directory, f'{tissue_name}.{"parquet" if parquet else "csv"}')
+
+                # insure that the file name doesnt have an underscore ro the rest of this files' processing
+                futures.append(pool.submit(parse_tissue_file, data, tissue_name.replace('_', ' '), tissue_uberon, part_paths[tissue_name], is_sqtl))
+                pending.add(futures[-1])
+
+                # do not hold more tissue files in memory than the pool can work on
+                while len(pending) > workers:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            # collect the results, raising any worker exception
+            for future in futures:
+                tissue_name, row_count, error_count = future.result()
+
+                logger.info(f'Parsed {row_count} rows for {tissue_name}, {error_count} rows skipped.')
+
+        # return to the caller
+        return part_paths
+
     #############
     # parse_tissue_line - parses a line of tissue csv data from a GTEx tissue file
     #
@@ -304,89 +339,7 @@ class GTExUtils:
     # returns: str the HGVS value
     #############
     def get_hgvs_value(self, gtex_variant_id: str):
-        try:
-            # split the string into the components
-            variant_id = gtex_variant_id.split('_')
-
-            # get position indexes into the data element
-            reference_patch = 'p1'
-            position = int(variant_id[1])
-            ref_allele = variant_id[2]
-            alt_allele = variant_id[3]
-            reference_genome = variant_id[4]
-            chromosome = variant_id[0]
-
-            # X or Y to integer values for proper indexing
-            if chromosome == 'X':
-                chromosome = 23
-            elif chromosome == 'Y':
-                chromosome = 24
-            else:
-                chromosome = int(variant_id[0])
-
-            # get the HGVS chromosome label
-            ref_chromosome = self.reference_chrom_labels[reference_genome][reference_patch][chromosome]
-        except KeyError:
-            return ''
-
-        # get the length of the reference allele
-        len_ref = len(ref_allele)
-
-        # is there an alt allele
-        if alt_allele == '.':
-            # deletions
-            if len_ref == 1:
-                variation = f'{position}del'
-            else:
-                variation = f'{position}_{position + len_ref - 1}del'
-
-        elif alt_allele.startswith('<'):
-            # we know about these but don't support them yet
-            return ''
-
-        else:
-            # get the length of the alternate allele
-            len_alt = len(alt_allele)
-
-            # if this is a SNP
-            if (len_ref == 1) and (len_alt == 1):
-                # simple layout of ref/alt SNP
-                variation = f'{position}{ref_allele}>{alt_allele}'
-            # if the alternate allele is larger than the reference is an insert
-            elif (len_alt > len_ref) and alt_allele.startswith(ref_allele):
-                # get the length of the insertion
-                diff = len_alt - len_ref
-
-                # get the position offset
-                offset = len_alt - diff
-
-                # layout the insert
-                variation = f'{position + offset - 1}_{position + offset}ins{alt_allele[offset:]}'
-            # if the reference is larger than the deletion it is a deletion
-            elif (len_ref > len_alt) and ref_allele.startswith(alt_allele):
-                # get the length of the deletion
-                diff = len_ref - len_alt
-
-                # get the position offset
-                offset = len_ref - diff
-
-                # if the diff is only 1 BP
-                if diff == 1:
-                    # layout the SNP deletion
-                    variation = f'{position + offset}del'
-                # else this is more that a single BP deletion
-                else:
-                    # layout the deletion
-                    variation = f'{position + offset}_{position + offset + diff - 1}del'
-            # we do not support this allele
-            else:
-                return ''
-
-        # layout the final HGVS expression in curie format
-        hgvs: str = f'{ref_chromosome}:g.{variation}'
-
-        # return the expression to the caller
-        return hgvs
+        return get_hgvs_value(gtex_variant_id)
 
     #############
     # get_expression_direction - gets the polarity of slope to get the direction of expression.
@@ -438,6 +391,21 @@ class GTExUtils:
         # return to the caller
         return hyper_edge_id
 
+    #############
+    # get_hyper_edge_ids() - get_hyper_edge_id for whole columns of tissue, gene and variant ids
+    #
+    # param uberons: list - the uberon IDs
+    # param ensembls: list - the ensembl IDs
+    # param variants: list - the variant IDs
+    # return hyper_edge_ids: list - the hyper edge ID composites, in order
+    #############
+    @staticmethod
+    def get_hyper_edge_ids(uberons: list, ensembls: list, variants: list) -> list:
+        md5 = hashlib.md5
+
+        return [0 if uberon is None or ensembl is None or variant is None else int(md5(f'{uberon}_{ensembl}_{variant}'.encode()).hexdigest()[:8], 16)
+                for uberon, ensembl, variant in zip(uberons, ensembls, variants)]
+
     #############
     # get_sequence_variant_obj - Creates a SequenceVariant object out of the variant id data field.
     #                            this also converts the variant_id to a HGVS expression along the way
@@ -542,22 +510,23 @@ class GTExUtils:
     # prepopulate_variant_synonymization_cache - populate the variant synonymization cache by walking through the variant list
     #                                            and batch synonymize any that need it
     #
+    # the cache is probed CACHE_PROBE_SIZE variants at a time and the uncached ones stream to clingen,
+    # which keeps several allele registry posts in flight
+    #
     # param data_directory: str - the directory of the data file
     # param file_names: list - the name of the data file
+    # param workers: int - the number of concurrent clingen posts
     # returns: object, pass if it is none, otherwise an exception object
     #############
     #######
-    def prepopulate_variant_synonymization_cache(self, data_directory: str, file_name: str) -> object:
+    def prepopulate_variant_synonymization_cache(self, data_directory: str, file_name: str, workers: int = DEFAULT_BATCH_WORKERS) -> object:
         logger.info("Starting variant synonymization cache pre-population")
 
         # init the return value
         ret_val = None
 
-        # create an array to bucket the uncached variants
-        uncached_variants = []
-
-        # init a line counter
-        line_counter = 0
+        # init the counters, the line counter is updated as the file is read
+        counts: dict = {'lines': 0, 'cached': 0, 'synonymized': 0}
 
         try:
             # get the full path to the input file
@@ -565,56 +534,70 @@ class GTExUtils:
 
             logger.info(f'Pre-populating data elements in file: {full_file_path}')
 
-            # open the file and start reading
-            with open(full_file_path, 'r') as inFH:
-                # open up a csv reader
-                csv_reader = csv.reader(inFH)
+            # the HGVS expressions in the file that are not cached yet
+            uncached_variants = self.get_uncached_variants(self.read_hgvs_expressions(full_file_path, counts), counts)
 
-                # read the header
-                header_line = next(csv_reader)
+            # synonymize them a batch at a time, as the batches come back
+            for batch_synonyms in self.clingen.stream_batches_of_synonyms(uncached_variants, workers=workers):
+                # write out the batch
+                self.write_variant_synonymization_cache(batch_synonyms)
 
-                # index into the array to the HGVS position
-                hgvs_index = header_line.index('HGVS')
+                counts['synonymized'] += len(batch_synonyms)
 
-                # for the rest of the lines in the file
-                for line in csv_reader:
-                    # increment the counter
-                    line_counter += 1
+        except Exception as e:
+            logger.error(f'Exception caught. Exception: {e}')
+            ret_val = e
 
-                    try:
-                        # get the HGVS data element
-                        hgvs = line[hgvs_index]
+        logger.info(f'Variant synonymization cache pre-population complete. Processed: {counts["lines"]} variants, '
+                    f'{counts["cached"]} were cached, {counts["synonymized"]} synonymized.')
 
-                        # look up the variant by the HGVS expression
-                        if self.cache.get(f'synonymize(HGVS:{hgvs})') is None:
-                            uncached_variants.append(hgvs)
+        # return to the caller
+        return ret_val
 
-                        # if there is enough in the batch process it
-                        if len(uncached_variants) == 10000:
-                            self.process_variant_synonymization_cache(uncached_variants)
+    #######
+    # read_hgvs_expressions - the HGVS expressions in a processed GTEx file, one at a time
+    #
+    # param full_file_path: str - the file, Parquet or CSV
+    # param counts: dict - the 'lines' count is updated as rows are read
+    #######
+    @staticmethod
+    def read_hgvs_expressions(full_file_path: str, counts: dict):
+        # only the HGVS column is needed, a batch of rows at a time
+        for batch in read_processed_batches(full_file_path):
+            for hgvs in batch['HGVS']:
+                # increment the counter
+                counts['lines'] += 1
 
-                            # clear out the bucket
-                            uncached_variants = []
+                yield hgvs
 
-                    except Exception as e:
-                        logger.error(f'Exception caught at line: {line_counter}. Exception: {e}')
-                        logger.error('Continuing...')
+                # output some feedback for the user
+                if (counts['lines'] % 250000) == 0:
+                    logger.info(f'Processed {counts["lines"]} variants.')
 
-                    # output some feedback for the user
-                    if (line_counter % 250000) == 0:
-                        logger.info(f'Processed {line_counter} variants.')
+    #######
+    # get_uncached_variants - the HGVS expressions whose synonyms are not cached, probing the cache a batch at a time
+    #
+    # param hgvs_expressions: iterable - the HGVS expressions
+    # param counts: dict - the 'cached' count is updated
+    #######
+    def get_uncached_variants(self, hgvs_expressions, counts: dict):
+        hgvs_expressions = iter(hgvs_expressions)
 
-            # process any that are in the last batch
-            if uncached_variants:
-                self.process_variant_synonymization_cache(uncached_variants)
-        except Exception as e:
-            logger.error(f'Exception caught. Exception: {e}')
-            ret_val = e
+        # get the first batch
+        batch: list = list(islice(hgvs_expressions, CACHE_PROBE_SIZE))
 
-        logger.info(f'Variant synonymization cache pre-population complete. Processed: {line_counter} variants.')
+        while batch:
+            # look up the whole batch at once
+            cache_results: list = self.cache.get_many([f'synonymize(HGVS:{hgvs})' for hgvs in batch])
 
-        # return to the caller
-        return ret_val
+            for hgvs, cache_result in zip(batch, cache_results):
+                if cache_result is None:
+                    yield hgvs
+                else:
+                    counts['cached'] += 1
+
+            # get the next batch
+            batch = list(islice(hgvs_expressions, CACHE_PROBE_SIZE))
 
     #######
     # Deprecated
@@ -628,6 +611,17 @@ class GTExUtils:
         # process a list of hgvs values
         batch_synonyms = self.clingen.get_batch_of_synonyms(batch_of_hgvs)
 
+        # write them out
+        self.write_variant_synonymization_cache(batch_synonyms)
+
+        logger.info("Variant synonymization cache processing complete.")
+
+    #######
+    # write_variant_synonymization_cache - caches the synonyms of a batch of variants under their HGVS and CAID ids
+    #
+    # param batch_synonyms: dict - the synonyms of each HGVS curie
+    #######
+    def write_variant_synonymization_cache(self, batch_synonyms: dict):
         # open up a connection to the cache database
         with self.cache.redis.pipeline() as redis_pipe:
             # init a counter
@@ -678,4 +672,246 @@ class GTExUtils:
             if count > 0:
                 redis_pipe.execute()
 
-        logger.info("Variant synonymization cache processing complete.")
+
+# the columns of the processed GTEx file
+PROCESSED_COLUMNS: list = ['tissue_name', 'tissue_uberon', 'HGVS', 'gene_id', 'variant_id', 'pval_nominal', 'slope']
+
+
+#############
+# get_processed_schema - the Arrow schema of a processed GTEx Parquet file
+#############
+def get_processed_schema():
+    return pyarrow.schema([(column, pyarrow.float64() if column in ('pval_nominal', 'slope') else pyarrow.string()) for column in PROCESSED_COLUMNS])
+
+
+#############
+# get_hgvs_value - parses the GTEx variant ID and converts it to an HGVS expression.
+#                  variants repeat across genes and tissues so the results are cached
+#
+# param gtex_variant_id: str - the gtex variant id
+# returns: str the HGVS value
+#############
+@lru_cache(maxsize=1_000_000)
+def get_hgvs_value(gtex_variant_id: str):
+    try:
+        # split the string into the components
+        variant_id = gtex_variant_id.split('_')
+
+        # get position indexes into the data element
+        reference_patch = 'p1'
+        position = int(variant_id[1])
+        ref_allele = variant_id[2]
+        alt_allele = variant_id[3]
+        reference_genome = variant_id[4]
+        chromosome = variant_id[0]
+
+        # X or Y to integer values for proper indexing
+        if chromosome == 'X':
+            chromosome = 23
+        elif chromosome == 'Y':
+            chromosome = 24
+        else:
+            chromosome = int(variant_id[0])
+
+        # get the HGVS chromosome label
+        ref_chromosome = REFERENCE_CHROM_LABELS[reference_genome][reference_patch][chromosome]
+    except (KeyError, ValueError, IndexError):
+        return ''
+
+    # get the length of the reference allele
+    len_ref = len(ref_allele)
+
+    # is there an alt allele
+    if alt_allele == '.':
+        # deletions
+        if len_ref == 1:
+            variation = f'{position}del'
+        else:
+            variation = f'{position}_{position + len_ref - 1}del'
+
+    elif alt_allele.startswith('<'):
+        # we know about these but don't support them yet
+        return ''
+
+    else:
+        # get the length of the alternate allele
+        len_alt = len(alt_allele)
+
+        # if this is a SNP
+        if (len_ref == 1) and (len_alt == 1):
+            # simple layout of ref/alt SNP
+            variation = f'{position}{ref_allele}>{alt_allele}'
+        # if the alternate allele is larger than the reference is an insert
+        elif (len_alt > len_ref) and alt_allele.startswith(ref_allele):
+            # get the length of the insertion
+            diff = len_alt - len_ref
+
+            # get the position offset
+            offset = len_alt - diff
+
+            # layout the insert
+            variation = f'{position + offset - 1}_{position + offset}ins{alt_allele[offset:]}'
+        # if the reference is larger than the deletion it is a deletion
+        elif (len_ref > len_alt) and ref_allele.startswith(alt_allele):
+            # get the length of the deletion
+            diff = len_ref - len_alt
+
+            # get the position offset
+            offset = len_ref - diff
+
+            # if the diff is only 1 BP
+            if diff == 1:
+                # layout the SNP deletion
+                variation = f'{position + offset}del'
+            # else this is more that a single BP deletion
+            else:
+                # layout the deletion
+                variation = f'{position + offset}_{position + offset + diff - 1}del'
+        # we do not support this allele
+        else:
+            return ''
+
+    # layout the final HGVS expression in curie format
+    hgvs: str = f'{ref_chromosome}:g.{variation}'
+
+    # return the expression to the caller
+    return hgvs
+
+
+#############
+# parse_tissue_file - parses a gzipped GTEx tissue file into the processed columns and writes them to a part file.
+#                     runs in the process pool of GTExUtils.parse_tissue_files. the file is decompressed as a
+#                     stream into Arrow columns, and filtered and converted a column at a time
+#
+# param data: bytes - the gzipped tissue file
+# param tissue_name - the name of the tissue
+# param tissue_uberon - the tissue uberon id
+# param part_path: str - the output file, Parquet if it ends in .parquet otherwise CSV without a header
+# returns (tissue name, rows written, rows skipped)
+#############
+def parse_tissue_file(data: bytes, tissue_name: str, tissue_uberon: str, part_path: str, is_sqtl: bool = False) -> tuple:
+    if pq is None:
+        raise Exception('pyarrow is required to parse GTEx tissue files.')
+
+    # the variant is the first column and the gene (eqtl) or phenotype (sqtl) the second
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as tissue_file:
+        header: list = tissue_file.readline().decode('utf-8').rstrip('\n').split('\t')
+
+    variant_column, gene_column = header[0], header[1]
+
+    # rows with the wrong column count are skipped
+    bad_rows: list = []
+
+    # non numeric p-values and slopes (NA) come back as nulls
+    table = pa_csv.read_csv(
+        pyarrow.input_stream(pyarrow.BufferReader(data), compression='gzip'),
+        parse_options=pa_csv.ParseOptions(delimiter='\t', invalid_row_handler=lambda row: bad_rows.append(row.number) or 'skip'),
+        convert_options=pa_csv.ConvertOptions(include_columns=[variant_column, gene_column, 'pval_nominal', 'slope'],
+                                              column_types={variant_column: pyarrow.string(), gene_column: pyarrow.string(),
+                                                            'pval_nominal': pyarrow.float64(), 'slope': pyarrow.float64()},
+                                              null_values=['NA', ''], strings_can_be_null=False))
+    del data
+
+    row_count: int = table.num_rows + len(bad_rows)
+
+    table = table.filter(pc.and_(pc.is_valid(table['pval_nominal']), pc.is_valid(table['slope'])))
+
+    if is_sqtl:
+        # for sqtl the phenotype id contains the ensembl id for the gene.
+        # it has the format: chr1:497299:498399:clu_51878:ENSG00000237094.11
+        gene_ids = pc.list_element(pc.split_pattern(table[gene_column], ':'), 4)
+    else:
+        # for eqtl this should just be the ensembl gene id
+        gene_ids = table[gene_column]
+
+    # remove the version number
+    gene_ids = pc.list_element(pc.split_pattern(gene_ids, '.', max_splits=1), 0)
+
+    # variants repeat across genes, so each distinct one is converted once.
+    # the variant ids start with "chr", the HGVS conversion expects just the chromosome
+    variant_ids = table[variant_column].combine_chunks().dictionary_encode()
+    hgvs_values = pyarrow.array([get_hgvs_value(variant_id[3:]) for variant_id in variant_ids.dictionary.to_pylist()], pyarrow.string())
+
+    processed = pyarrow.table({'tissue_name': pyarrow.repeat(tissue_name, table.num_rows),
+                               'tissue_uberon': pyarrow.repeat(tissue_uberon, table.num_rows),
+                               'HGVS': hgvs_values.take(variant_ids.indices),
+                               'gene_id': gene_ids,
+                               'variant_id': table[variant_column],
+                               'pval_nominal': table['pval_nominal'],
+                               'slope': table['slope']}, schema=get_processed_schema())
+
+    if part_path.endswith('.parquet'):
+        pq.write_table(processed, part_path)
+    else:
+        pa_csv.write_csv(processed, part_path, pa_csv.WriteOptions(include_header=False))
+
+    # return the counts to the caller
+    return tissue_name, processed.num_rows, row_count - processed.num_rows
+
+
+#############
+# merge_processed_parts - combines the per tissue part files into one processed GTEx file
+#
+# param part_paths: list - the part files, all Parquet or all CSV
+# param out_path: str - the processed GTEx file
+#############
+def merge_processed_parts(part_paths: list, out_path: str):
+    if out_path.endswith('.parquet'):
+        writer = None
+
+        # each tissue becomes (at least) one row group
+        for part_path in part_paths:
+            table = pq.read_table(part_path)
+
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+
+            writer.write_table(table)
+
+        if writer is not None:
+            writer.close()
+    else:
+        with open(out_path, 'w', newline='') as output_file:
+            csv.writer(output_file).writerow(PROCESSED_COLUMNS)
+
+            for part_path in part_paths:
+                with open(part_path, newline='') as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+
+
+#############
+# read_processed_batches - reads a processed GTEx file in batches of columns
+#
+# param file_path: str - a processed GTEx file, Parquet or CSV
+# param batch_size: int - the number of rows in a batch
+# returns: a generator of dicts of column name to list of values, for the PROCESSED_COLUMNS in the file
+#############
+def read_processed_batches(file_path: str, batch_size: int = 100_000):
+    if file_path.endswith('.parquet'):
+        if pq is None:
+            raise Exception('pyarrow is required to read Parquet GTEx files.')
+
+        parquet_file = pq.ParquetFile(file_path)
+
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield record_batch.to_pydict()
+    else:
+        with open(file_path, 'r', newline='') as inFH:
+            # open up a csv reader
+            csv_reader = csv.reader(inFH)
+
+            # read the header. older files carry every GTEx column, only the processed ones are kept
+            header_line = next(csv_reader)
+            indexes = {column: header_line.index(column) for column in PROCESSED_COLUMNS if column in header_line}
+
+            rows: list = []
+
+            for line in csv_reader:
+                rows.append(line)
+
+                if len(rows) == batch_size:
+                    yield {column: [row[index] for row in rows] for column, index in indexes.items()}
+                    rows = []
+
+            if rows:
+                yield {column: [row[index] for row in rows] for column, index in indexes.items()}
@@ -4,21 +4,51 @@ from greent.graph_components import KNode, LabeledID
 from greent.service import Service
 from greent.util import LoggingUtil
 import logging, re,os,sys
-from collections import defaultdict
 from robokop_genetics.genetics_normalization import GeneticsNormalizer
 from greent.export_delegator import WriterDelegator
 from greent.rosetta import Rosetta
 
 logger = LoggingUtil.init_logging("robo-commons.builder.gwascatalog", logging.DEBUG, format='medium', logFilePath=f'{os.environ["ROBOKOP_HOME"]}/logs/')
 
+# how trait ids, the last part of a MAPPED_TRAIT_URI, become curies: id prefix -> (curie prefix, characters to drop)
+# ids show up like EFO_123, Orphanet_123, HP_123
+TRAIT_PREFIXES = [
+    ('EFO', 'EFO', 4),
+    ('Orp', 'ORPHANET', 9),
+    ('HP', 'HP', 3),
+    ('NCIT', 'NCIT', 5),
+    ('MONDO', 'MONDO', 6),
+]
+GWAS_FILE = 'gwas-catalog-associations_ontology-annotated.tsv'
+
+
+def get_trait_curie(trait_uri):
+    """ The curie for a trait uri, None if it is a biological process or activity (GO, 5k+ of these)
+    or not a recognized trait format. """
+    trait_id = trait_uri.rsplit('/', 1)[1]
+    for id_prefix, curie_prefix, offset in TRAIT_PREFIXES:
+        if trait_id.startswith(id_prefix):
+            return f'{curie_prefix}:{trait_id[offset:]}'
+    if not trait_id.startswith('GO'):
+        logger.warning(f'{trait_uri} not a recognized trait format')
+    return None
+
+
 class GWASCatalog(Service):
-    def __init__(self, rosetta):
+    def __init__(self, rosetta, data_directory=None, batch_size=10000):
         self.is_cached_already = False
         self.genetics_normalizer = GeneticsNormalizer()
         self.rosetta = rosetta
         self.writer = WriterDelegator(rosetta)
         self.version = '2020/05/04'
         self.sequence_variant_export_labels = None
+        # downloaded catalogs are kept here, one directory per release
+        self.data_directory = data_directory or os.path.join(os.environ['ROBOKOP_HOME'], 'gwas')
+        self.batch_size = batch_size
+        # trait uri -> curie (or None), trait uris repeat a lot across lines
+        self.trait_curies = {}
+        # adding a specific version instead of latest to help track things
+        self.query_url = f'ftp.ebi.ac.uk/pub/databases/gwas/releases/{self.version}/{GWAS_FILE}'
 
 
     def process_gwas(self):
@@ -28,46 +58,89 @@ class GWASCatalog(Service):
 
     def get_gwas_file(self):
         """
-        Get the gwas file
-        :return: Array of lines in the `gwas-catalog-associations_ontology-annotated.tsv` file
+        Get the gwas file, downloading it unless this release has been downloaded before
+        :return: Path to the local copy of the `gwas-catalog-associations_ontology-annotated.tsv` file
         """
-        # adding a specific version instead of latest to help track things
-        self.query_url = f'ftp.ebi.ac.uk/pub/databases/gwas/releases/{self.version}/' \
-                         f'gwas-catalog-associations_ontology-annotated.tsv'
+        gwas_path = os.path.join(self.data_directory, self.version.replace('/', '-'), GWAS_FILE)
+        if os.path.exists(gwas_path):
+            logger.info(f'Using GWAS catalog {gwas_path}')
+            return gwas_path
+        os.makedirs(os.path.dirname(gwas_path), exist_ok=True)
         ftpsite = 'ftp.ebi.ac.uk'
         ftpdir = f'/pub/databases/gwas/releases/{self.version}'
-        ftpfile = 'gwas-catalog-associations_ontology-annotated.tsv'
         ftp = FTP(ftpsite)
         ftp.login()
         ftp.cwd(ftpdir)
-        gwas_catalog = []
-        ftp.retrlines(f'RETR {ftpfile}', gwas_catalog.append)
+        # download next to the final name so an interrupted download is never mistaken for the catalog
+        with open(f'{gwas_path}.part', 'wb') as gwas_file:
+            ftp.retrbinary(f'RETR {GWAS_FILE}', gwas_file.write)
         ftp.quit()
-        return gwas_catalog
+        os.replace(f'{gwas_path}.part', gwas_path)
+        return gwas_path
 
-    def parse_gwas_file(self, gwas_catalog):
+    def read_gwas_batches(self, gwas_catalog):
+        """
+        Read the catalog in batches of lines
+        :param gwas_catalog: Path to the catalog file, or an iterable of its lines
+        :return: Generator of lists of at most batch_size lines, the header line first on its own
+        """
+        if isinstance(gwas_catalog, str):
+            with open(gwas_catalog, encoding='utf-8') as gwas_file:
+                yield from self.read_gwas_batches(line.rstrip('\n') for line in gwas_file)
+            return
+        lines = iter(gwas_catalog)
+        yield [next(lines, '')]
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_trait_curies(self, trait_uris):
+        """ Convert the trait uris of a batch, each distinct uri only once per run. """
+        for trait_uri in set(trait_uris) - self.trait_curies.keys():
+            try:
+                self.trait_curies[trait_uri] = get_trait_curie(trait_uri)
+            except IndexError:
+                logger.warning(f'trait uri index error:({trait_uri}) not splittable')
+                self.trait_curies[trait_uri] = None
+        return [self.trait_curies[trait_uri] for trait_uri in trait_uris]
 
+    def parse_gwas_file(self, gwas_catalog):
+        """
+        Write the variants, phenotypes and variant to phenotype edges in the catalog, a batch of lines at a time
+        :param gwas_catalog: Path to the catalog file, or an iterable of its lines
+        :return: counts of the lines read and skipped, all zero if the header is not usable
+        """
+        stats = {'lines': 0, 'corrupted_lines': 0, 'missing_variant_ids': 0, 'missing_phenotype_ids': 0}
+        batches = self.read_gwas_batches(gwas_catalog)
         try:
             # get column headers
-            file_headers = gwas_catalog[0].split('\t')
+            file_headers = next(batches)[0].split('\t')
             pub_med_index = file_headers.index('PUBMEDID')
             p_value_index = file_headers.index('P-VALUE')
             snps_index = file_headers.index('SNPS')
             trait_ids_index = file_headers.index('MAPPED_TRAIT_URI')
         except (IndexError, ValueError) as e:
             logger.error(f'GWAS Catalog failed to prepopulate_cache ({e})')
-            return []
-
-        corrupted_lines = 0
-        missing_variant_ids = 0
-        missing_phenotype_ids = 0
-        variant_to_pheno_cache = defaultdict(set)
-        progress_counter = 0
-        total_lines = len(gwas_catalog)
+            return stats
+
+        for batch in batches:
+            self.write_gwas_batch(batch, pub_med_index, p_value_index, snps_index, trait_ids_index, stats)
+            logger.info(f'GWASCatalog progress: {stats["lines"]} lines')
+        logger.info(f'GWASCatalog complete: {stats}')
+        return stats
+
+    def write_gwas_batch(self, batch, pub_med_index, p_value_index, snps_index, trait_ids_index, stats):
         trait_uri_pattern = re.compile(r'[^,\s]+')
         snp_pattern = re.compile(r'[^,;x*\s]+')
-        for line in gwas_catalog[1:]:
-
+        # (pubmed id, p-value, trait uris, snps) for each good line
+        rows = []
+        for line in batch:
+            stats['lines'] += 1
             line = line.split('\t')
             try:
                 # get pubmed id
@@ -81,79 +154,58 @@ class GWASCatalog(Service):
                 # find all sequence variants
                 snps = snp_pattern.findall(line[snps_index])
             except (IndexError, ValueError) as e:
-                corrupted_lines += 1
+                stats['corrupted_lines'] += 1
                 logger.warning(f'GWASCatalog corrupted line: {e}')
                 continue
 
             if not (trait_uris and snps):
-                corrupted_lines += 1
+                stats['corrupted_lines'] += 1
                 logger.warning(f'GWASCatalog corrupted line: {line}')
                 continue
-            else:
-                traits = []
-                for trait_uri in trait_uris:
-                    try:
-                        trait_id = trait_uri.rsplit('/', 1)[1]
-                        # ids show up like EFO_123, Orphanet_123, HP_123
-                        if trait_id.startswith('EFO'):
-                            curie_trait_id = f'EFO:{trait_id[4:]}'
-                        elif trait_id.startswith('Orp'):
-                            curie_trait_id = f'ORPHANET:{trait_id[9:]}'
-                        elif trait_id.startswith('HP'):
-                            curie_trait_id = f'HP:{trait_id[3:]}'
-                        elif trait_id.startswith('NCIT'):
-                            curie_trait_id = f'NCIT:{trait_id[5:]}'
-                        elif trait_id.startswith('MONDO'):
-                            curie_trait_id = f'MONDO:{trait_id[6:]}'
-                        elif trait_id.startswith('GO'):
-                            # Biological process or activity
-                            # 5k+ of these
-                            missing_phenotype_ids += 1
-                            continue
-                        else:
-                            missing_phenotype_ids += 1
-                            logger.warning(f'{trait_uri} not a recognized trait format')
-                            continue
-
-                        traits.append(curie_trait_id)
-
-                    except IndexError as e:
-                        logger.warning(f'trait uri index error:({trait_uri}) not splittable')
-
-                variant_nodes = set()
-                for n, snp in enumerate(snps):
-                    if snp.startswith('rs'):
-                        dbsnp_curie = f'DBSNP:{snp}'
-                        variant_node = KNode(
-                            dbsnp_curie,
-                            type=node_types.SEQUENCE_VARIANT
-                        )
+            rows.append((pubmed_id, p_value, trait_uris, snps))
+
+        # convert every trait uri in the batch at once
+        trait_curies = iter(self.get_trait_curies([trait_uri for row in rows for trait_uri in row[2]]))
+
+        # collect the nodes and edges of the batch, then write them: unique nodes first, edges in line order
+        variant_nodes = {}
+        phenotype_nodes = {}
+        edges = []
+        for pubmed_id, p_value, trait_uris, snps in rows:
+            traits = [curie for curie in (next(trait_curies) for _ in trait_uris) if curie is not None]
+            stats['missing_phenotype_ids'] += len(trait_uris) - len(traits)
+
+            variant_ids = []
+            for snp in snps:
+                if snp.startswith('rs'):
+                    variant_ids.append(f'DBSNP:{snp}')
+                else:
+                    stats['missing_variant_ids'] += 1
+
+            if traits and variant_ids:
+                props = {'p_value' : p_value}
+                for variant_id in dict.fromkeys(variant_ids):
+                    variant_node = variant_nodes.get(variant_id)
+                    if variant_node is None:
+                        variant_node = KNode(variant_id, type=node_types.SEQUENCE_VARIANT)
                         # adding an export label, this will ensure that it will go into the proper queue
                         # hence we can do batch normalization in the writer.
                         variant_node.add_export_labels([node_types.SEQUENCE_VARIANT])
-                        variant_nodes.add(variant_node)
-                    else:
-                        missing_variant_ids += 1
-                        pass
-
-                if traits and variant_nodes:
-                    props = {'p_value' : p_value}
-                    for variant_node in variant_nodes:
-                        self.writer.write_node(variant_node)
-                        for trait_id in traits:
-                            variant_to_pheno_edge, phenotype_node = self.create_variant_to_phenotype_components(
-                                                                            variant_node,
-                                                                            trait_id,
-                                                                            None,
-                                                                            pubmed_id=pubmed_id,
-                                                                            properties=props)
-                            self.writer.write_node(phenotype_node)
-                            self.writer.write_edge(variant_to_pheno_edge)
-            progress_counter += 1
-            if progress_counter % 1000 == 0:
-                percent_complete = (progress_counter / total_lines) * 100
-                logger.info(f'GWASCatalog progress: {int(percent_complete)}%')
-
+                        variant_nodes[variant_id] = variant_node
+                    for trait_id in traits:
+                        variant_to_pheno_edge, phenotype_node = self.create_variant_to_phenotype_components(
+                                                                        variant_node,
+                                                                        trait_id,
+                                                                        None,
+                                                                        pubmed_id=pubmed_id,
+                                                                        properties=props)
+                        phenotype_nodes.setdefault(trait_id, phenotype_node)
+                        edges.append(variant_to_pheno_edge)
+
+        for node in list(variant_nodes.values()) + list(phenotype_nodes.values()):
+            self.writer.write_node(node)
+        for edge in edges:
+            self.writer.write_edge(edge)
 
     def create_variant_to_phenotype_components(self, variant_node, phenotype_id, phenotype_label, pubmed_id=None, properties={}):
         phenotype_node = KNode(phenotype_id, name=phenotype_label, type=node_types.DISEASE_OR_PHENOTYPIC_FEATURE)
@@ -0,0 +1,287 @@
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from greent.graph_components import CompactKNode, CompactKEdge, LabeledID
+from greent.util import LoggingUtil
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+# properties that have a place of their own on a KNode / KEdge, anything else goes into properties
+BASELINE_NODE_PROPERTIES = {'id', 'name', 'category', 'equivalent_identifiers', ''}
+BASELINE_EDGE_PROPERTIES = {'relation', 'predicate', 'subject', 'object', 'provided_by', 'edge_label',
+                            'source_database', 'publications'}
+NODE_COLUMNS = ['id', 'name', 'type', 'category', 'equivalent_identifiers', 'properties']
+EDGE_COLUMNS = ['subject', 'object', 'relation', 'edge_label', 'provided_by', 'publications', 'properties']
+
+
+def loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def get_delimiter(path):
+    """ The column delimiter of a KGX TSV/CSV file, None for JSON lines. """
+    if path.endswith('.tsv'):
+        return '\t'
+    if path.endswith('.csv'):
+        return ','
+    return None
+
+
+def split_file(path, chunk_bytes, skip_header=False):
+    """ Split a file into [start, end) byte ranges of about chunk_bytes, each ending on a line boundary.
+    With skip_header the first line is left out of every range. """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as stream:
+        start = len(stream.readline()) if skip_header else 0
+        while start < size:
+            stream.seek(min(start + chunk_bytes, size))
+            if stream.tell() < size:
+                # finish the line we landed in
+                stream.readline()
+            end = stream.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_header(path, delimiter):
+    with open(path, newline='') as stream:
+        return next(csv.reader(stream, delimiter=delimiter))
+
+
+def read_lines(path, start, end):
+    with open(path, 'rb') as stream:
+        stream.seek(start)
+        return stream.read(end - start).splitlines()
+
+
+def get_node_row(record):
+    props = {key: value for key, value in record.items() if key not in BASELINE_NODE_PROPERTIES}
+    category = record['category']
+    labels = [category] if isinstance(category, str) else category
+    return [record['id'], record['name'], 'named_thing', labels, record['equivalent_identifiers'], props]
+
+
+def get_edge_row(record, default_provided_by):
+    # the data source, in priority order
+    if 'provided_by' in record:
+        provided_by = record['provided_by']
+    elif 'source_database' in record:
+        provided_by = record['source_database'].replace('.', '_')
+    else:
+        provided_by = default_provided_by
+    relation = record['relation'] if 'relation' in record else record['predicate']
+    publications = record.get('publications') or []
+    if isinstance(publications, str):
+        publications = [publications]
+    props = {key: value for key, value in record.items() if key not in BASELINE_EDGE_PROPERTIES}
+    return [record['subject'], record['object'], relation, record['edge_label'], provided_by, publications, props]
+
+
+def get_tsv_node_row(record):
+    labels = [label for label in record['category'].split('|') if label]
+    labels = labels or ['named_thing']
+    return [record['id'], record['name'], labels[0], labels, [], {}]
+
+
+def get_tsv_edge_row(record, default_provided_by):
+    return [record['subject'], record['object'], record['relation'], record['edge_label'], default_provided_by, [], {}]
+
+
+def parse_range(task):
+    """ Parse one byte range of a KGX nodes or edges file into a columnar batch (a dict of column
+    lists, see NODE_COLUMNS and EDGE_COLUMNS). Runs in the worker processes. """
+    path, kind, start, end, header, delimiter, provided_by = task
+    columns = NODE_COLUMNS if kind == 'nodes' else EDGE_COLUMNS
+    batch = {column: [] for column in columns}
+    errors = 0
+    lines = read_lines(path, start, end)
+    if delimiter is None:
+        get_row = get_node_row if kind == 'nodes' else get_edge_row
+        records = []
+        for line in lines:
+            line = line.strip().rstrip(b',')
+            if not line:
+                continue
+            try:
+                records.append(loads(line))
+            except ValueError:
+                # the opening and closing lines of a KGX JSON array land here too
+                errors += 1
+    else:
+        get_row = get_tsv_node_row if kind == 'nodes' else get_tsv_edge_row
+        records = []
+        for record in csv.DictReader((line.decode('utf-8') for line in lines), fieldnames=header, delimiter=delimiter):
+            # short rows get None for their missing columns
+            if None in record.values():
+                errors += 1
+            else:
+                records.append(record)
+    for record in records:
+        try:
+            row = get_row(record) if kind == 'nodes' else get_row(record, provided_by)
+        except (KeyError, AttributeError, TypeError):
+            errors += 1
+            continue
+        for column, value in zip(columns, row):
+            batch[column].append(value)
+    return {'start': start, 'end': end, 'batch': batch, 'lines': len(lines), 'errors': errors}
+
+
+def batch_to_nodes(batch):
+    for node_id, name, node_type, labels, synonyms, props in zip(*(batch[column] for column in NODE_COLUMNS)):
+        yield CompactKNode(node_id, type=node_type, name=name, properties=props, synonyms=synonyms, export_labels=labels)
+
+
+def batch_to_edges(batch, ctime=None):
+    ctime = time.time() if ctime is None else ctime
+    for subject, object, relation, edge_label, provided_by, publications, props in \
+            zip(*(batch[column] for column in EDGE_COLUMNS)):
+        try:
+            yield CompactKEdge(source_id=subject,
+                               target_id=object,
+                               provided_by=provided_by,
+                               ctime=ctime,
+                               original_predicate=LabeledID(identifier=relation, label=relation.split(':')[-1]),
+                               standard_predicate=LabeledID(identifier=edge_label, label=edge_label.split(':')[-1]),
+                               input_id=subject,
+                               publications=publications,
+                               properties=props)
+        except Exception as e:
+            logger.warning(f'Skipping edge {subject} -{relation}-> {object}: {e}')
+
+
+class IngestProgress:
+    """ The byte ranges of a file that have been written, saved next to it so an interrupted ingest
+    can resume. Ranges are only recorded once the writer has flushed them. """
+
+    def __init__(self, path, chunk_bytes):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as stream:
+                state = json.load(stream)
+            # ranges from a run with another chunk size do not line up with ours
+            if state['chunk_bytes'] == chunk_bytes:
+                self.done = {tuple(r) for r in state['done']}
+                logger.info(f'Resuming from {path}: {len(self.done)} ranges already written')
+
+    def add(self, start, end):
+        self.done.add((start, end))
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as stream:
+            json.dump({'chunk_bytes': self.chunk_bytes, 'done': sorted(self.done)}, stream)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        self.done = set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def ingest_file(writer, path, kind, provided_by=None, workers=None, chunk_bytes=67108864, resume=True, delimiter=None):
+    """ Load a KGX nodes or edges file (JSON lines, or TSV/CSV with a header) through writer.
+
+    The file is split into byte ranges that a pool of workers parses into columnar batches. This
+    process is the only writer: it turns each batch into (compact) KNodes or KEdges, writes them, and flushes
+    the writer before recording the range as done. KGX files are already normalized, so nodes are not
+    annotated and edges keep their edge_label as standard predicate (writer.normalized should be set).
+    The delimiter is taken from the file extension unless given.
+    Returns {'lines', 'items', 'errors', 'seconds'}. """
+    if delimiter is None:
+        delimiter = get_delimiter(path)
+    header = read_header(path, delimiter) if delimiter else None
+    progress = IngestProgress(f'{path}.progress' if resume else None, chunk_bytes)
+    ranges = [r for r in split_file(path, chunk_bytes, skip_header=delimiter is not None) if r not in progress.done]
+    total_bytes = sum(end - start for start, end in ranges)
+    tasks = [(path, kind, start, end, header, delimiter, provided_by) for start, end in ranges]
+    stats = {'lines': 0, 'items': 0, 'errors': 0}
+    logger.info(f'Loading {kind} from {path}: {len(ranges)} ranges, {total_bytes / 1048576:.1f} MB')
+    started = time.monotonic()
+    done_bytes = 0
+    pool = multiprocessing.Pool(workers) if workers != 1 else None
+    try:
+        results = pool.imap_unordered(parse_range, tasks) if pool else map(parse_range, tasks)
+        for result in results:
+            items = 0
+            if kind == 'nodes':
+                for node in batch_to_nodes(result['batch']):
+                    writer.write_node(node, annotate=False)
+                    items += 1
+            else:
+                for edge in batch_to_edges(result['batch']):
+                    writer.write_edge(edge)
+                    items += 1
+            writer.flush()
+            progress.add(result['start'], result['end'])
+            stats['lines'] += result['lines']
+            stats['items'] += items
+            stats['errors'] += result['errors'] + len(result['batch']['properties']) - items
+            done_bytes += result['end'] - result['start']
+            elapsed = time.monotonic() - started
+            logger.info(f'{kind}: {done_bytes / max(total_bytes, 1):.1%} of {path}, {stats["items"]} written, '
+                        f'{stats["errors"]} unparseable, {stats["items"] / elapsed:.0f}/s, '
+                        f'{done_bytes / 1048576 / elapsed:.1f} MB/s')
+    finally:
+        if pool:
+            pool.terminate()
+    progress.clear()
+    stats['seconds'] = time.monotonic() - started
+    return stats
+
+
+def ingest(writer, nodes_file=None, edges_file=None, provided_by=None, workers=None, chunk_bytes=67108864, resume=True,
+           delimiter=None):
+    """ Load a KGX nodes file and then its edges file, see ingest_file. """
+    stats = {}
+    if nodes_file:
+        stats['nodes'] = ingest_file(writer, nodes_file, 'nodes', provided_by, workers, chunk_bytes, resume, delimiter)
+    if edges_file:
+        stats['edges'] = ingest_file(writer, edges_file, 'edges', provided_by, workers, chunk_bytes, resume, delimiter)
+    return stats
+
+
+def run(nodes_file, edges_file, provided_by, workers=None, chunk_bytes=67108864, resume=True, delimiter=None):
+    from greent.rosetta import Rosetta
+    from greent.export_delegator import WriterDelegator
+    rosetta = Rosetta()
+    with WriterDelegator(rosetta) as writer:
+        writer.normalized = True
+        stats = ingest(writer, nodes_file, edges_file, provided_by, workers, chunk_bytes, resume, delimiter)
+    for kind in stats:
+        logger.info(f"{kind}: {stats[kind]['items']} written from {stats[kind]['lines']} lines "
+                    f"in {stats[kind]['seconds']:.0f}s, {stats[kind]['errors']} unparseable")
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="""
+    Load KGX nodes and edges files (JSON lines, or TSV/CSV with a header row) into the graph.
+    Files are parsed in parallel; an interrupted load resumes from <file>.progress.
+    """)
+    parser.add_argument('-n', '--nodes_file', help="Nodes file")
+    parser.add_argument('-e', '--edges_file', help="Edges file")
+    parser.add_argument('-p', '--provided_by', help="provided by", required=True)
+    parser.add_argument('-w', '--workers', type=int, help="Parser processes (default: one per CPU)")
+    parser.add_argument('--chunk_mb', type=int, default=64, help="Size of the byte ranges handed to the parsers")
+    parser.add_argument('--restart', action='store_true', help="Ignore saved progress and load from the start")
+    args = parser.parse_args()
+    if not args.nodes_file and not args.edges_file:
+        print('Nothing to parse exiting')
+        exit()
+    run(args.nodes_file, args.edges_file, args.provided_by, args.workers, args.chunk_mb * 1048576, not args.restart)
@@ -3,6 +3,7 @@ from greent.graph_components import KEdge, LabeledID
 from greent.util import Text
 from greent.util import LoggingUtil
 from greent import node_types
+from greent.omnicorp_index import OmnicorpIndex
 from collections import defaultdict
 from datetime import datetime as dt
 import time
@@ -18,7 +19,18 @@ class OmnicorpSupport():
 
     def __init__(self,greent):
         self.greent = greent
-        self.omnicorp = greent.omnicorp
+        # the local co-occurrence index when one has been built. curies with prefixes it does not hold
+        # still go to the omnicorp service
+        self.index = OmnicorpIndex.from_config(greent.service_context.config.get('omnicorp_index'))
+
+    def is_indexed(self, node):
+        return self.index is not None and Text.get_curie(node.id) in self.index.prefixes
+
+    def get_omnicorp(self, *nodes):
+        """ The index if it holds the prefixes of all of nodes, otherwise the omnicorp service. """
+        if all(self.is_indexed(node) for node in nodes):
+            return self.index
+        return self.greent.omnicorp
 
     def term_to_term(self,node_a,node_b):
         count_a = 0
@@ -28,7 +40,7 @@ class OmnicorpSupport():
         if COUNT_KEY in node_b.properties:
             count_b = int(node_b.properties[COUNT_KEY]) 
         if (count_a > 0) and (count_b > 0):
-            articles = self.omnicorp.get_shared_pmids(node_a, node_b)
+            articles = self.get_omnicorp(node_a, node_b).get_shared_pmids(node_a, node_b)
         else:
             articles = []
         logger.debug(f'OmniCorp {node_a.id} {node_b.id} -> {len(articles)}')
@@ -42,7 +54,13 @@ class OmnicorpSupport():
         #return ke
 
     def generate_all_edges(self, nodelist):
-        results = self.omnicorp.get_all_shared_pmids(nodelist)
+        indexed = [node for node in nodelist if self.is_indexed(node)]
+        results = {}
+        if len(indexed) < len(nodelist):
+            results.update(self.greent.omnicorp.get_all_shared_pmids(nodelist))
+        if indexed:
+            # pairs of indexed nodes are answered by the index
+            results.update(self.index.get_all_shared_pmids(indexed))
         predicate=LabeledID(identifier='omnicorp:1', label='literature_co-occurrence')
         edges = [ KEdge(k[0], k[1], 'omnicorp.term_to_term', time.time(), predicate,predicate,
                         f'{k[0].id},{k[1].id}', publications=v, is_support=True)
@@ -51,9 +69,9 @@ class OmnicorpSupport():
 
 
     def get_node_info(self,node):
-        count = self.omnicorp.count_pmids(node)
+        count = self.get_omnicorp(node).count_pmids(node)
         return {COUNT_KEY: count}
 
     def prepare(self,nodes):
-        goodnodes = list(filter(lambda n: self.omnicorp.get_omni_identifier(n) is not None, nodes))
+        goodnodes = list(filter(lambda n: self.get_omnicorp(n).get_omni_identifier(n) is not None, nodes))
         return goodnodes
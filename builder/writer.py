@@ -11,7 +11,7 @@ import pickle
 import pika
 
 from greent.util import LoggingUtil
-from greent.export import BufferedWriter
+from greent.export import create_writer
 from builder.buildmain import setup
 from greent.graph_components import KNode, KEdge
 from builder.api import logging_config
@@ -74,7 +74,7 @@ def setup_consumer(callback = callback):
     # Setup code same as our previous, creating the queue on the channel.
     # Not doing auto_ack incase the channel drops on us and we lose some data that 
     # the channel has picked up but not processed yet.
-    writer = BufferedWriter(rosetta)
+    writer = create_writer(rosetta)
     logger.info(f' [*] Setting up consumer, creating new connection')
     connection = pika.BlockingConnection(pika.ConnectionParameters(
         host=os.environ['BROKER_HOST'],
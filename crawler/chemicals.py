@@ -1,7 +1,8 @@
 from greent.util import LoggingUtil, Text
 from greent.graph_components import LabeledID
 from crawler.mesh_unii import refresh_mesh_pubchem
-from crawler.crawl_util import glom, pull_via_ftp, pull_and_decompress, dump_cache
+from crawler.crawl_util import glom, pull_via_ftp, pull_and_decompress, dump_cache, EquivalenceSets
+from crawler.unichem import build_concordance, write_concordance, UnichemConcordance
 import greent.annotators.util.async_client as async_client
 from greent.annotators.chemical_annotator import ChemicalAnnotator
 from gzip import decompress, GzipFile
@@ -130,7 +131,8 @@ def load_chemicals(rosetta, refresh=True):
     # 1. Handle all the stuff that has an InchiKey using unichem
     # 2. Mesh is all "no structure".  We try to use a variety of sources to hook mesh id's to anything else
     print('UNICHEM')
-    concord = load_unichem()
+    # one EquivalenceSets takes every glom below, rather than a dictionary rebuilt on each call
+    concord = EquivalenceSets.from_dict(load_unichem())
     # 2. Mesh is all "no structure".  We try to use a variety of sources to hook mesh id's to anything else
     #DO MESH/UNII
     print('MESH/UNII')
@@ -173,6 +175,7 @@ def load_chemicals(rosetta, refresh=True):
     #  9. glom across sequence and chemical stuff
     new_groups = sequence_concord.values()
     glom(concord,new_groups,unique_prefixes=['GTOPDB','INCHI'])
+    concord = concord.to_dict()
     # 10. Drop PRO only sequences.
     to_remove = []
     for eq_id_set in concord:
@@ -358,7 +361,7 @@ def uni_glom(unichem_data, prefix1, prefix2, chemdict):
 
 
 def load_unichem_deprecated():
-    chemcord = {}
+    chemcord = EquivalenceSets()
     prefixes = {1: 'CHEMBL', 2: 'DRUGBANK', 4: 'GTOPDB', 6: 'KEGG.COMPOUND', 7: 'CHEBI', 14: 'UNII', 18: 'HMDB', 22: 'PUBCHEM'}
     #
     keys = list(prefixes.keys())
@@ -373,7 +376,7 @@ def load_unichem_deprecated():
             fl = f'src{ki}src{kj}.txt.gz'
             pairs = pull_and_decompress('ftp.ebi.ac.uk', dr, fl)
             uni_glom(pairs,prefix_i,prefix_j,chemcord)
-    return chemcord
+    return chemcord.to_dict()
 
 def uci_key(row):
     #print(row)
@@ -393,15 +396,15 @@ def uci_key(row):
 # working_dir: str - the working directory for the downloaded files
 # xref_file: str - optional location of already downloaded and decompressed unichem XREF file
 # struct_file: str - optional location of already downloaded and decompressed unichem STRUCTURE file
+# concordance_dir: str - where the clusters are saved (see crawler.unichem), crawler/unichem by default
 # return: dict - The cross referenced curies ready for inserting into the the redis cache
 #########################
-def load_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None) -> dict:
+def load_unichem(working_dir: str = '', xref_file: str = None, struct_file: str = None, concordance_dir: str = None) -> dict:
     #FOR TESTING
-    #upname = os.path.join(os.path.dirname(__file__), 'unichem.pickle')
-    #with open(upname,'rb') as up:
-    #    synonyms=pickle.load(up)
-    #return synonyms
+    #return UnichemConcordance.load(os.path.join(os.path.dirname(__file__), 'unichem')).get_synonyms()
     #DONE TESTING
+    if concordance_dir is None:
+        concordance_dir = os.path.join(os.path.dirname(__file__), 'unichem')
     logger.info(f'Start of Unichem loading. Working directory: {working_dir}')
 
     # init the returned list
@@ -474,53 +477,30 @@ def load_unichem(working_dir: str = '', xref_file: str = None, struct_file: str
         df_filtered_xrefs = pandas.read_csv(filtered_xref_file, dtype={"uci": int, "src_id": int, "src_compound_id": str}, sep='\t', header=None, usecols=[0, 1, 2], names=['uci', 'src_id', 'src_compound_id'])
         logger.debug('..done..')
 
-        # note: this is an alternate way to add a curie column to each record in one shot. takes about 10 minutes.
-        df_filtered_xrefs = df_filtered_xrefs.assign(curie=df_filtered_xrefs[['src_id', 'src_compound_id']].apply(lambda x: f'{data_sources[x[0]]}:{x[1]}', axis=1))
-        logger.debug(f'Curie column addition complete. Creating STRUCTURE iterator...')
-
-        # get an iterator to loop through the xref data
+        # get an iterator to loop through the structure data
         structure_iter = pandas.read_csv(struct_file, dtype={"uci": int, "standardinchikey": str},
                                          sep='\t', header=None, usecols=[0, 2], names=['uci', 'standardinchikey'], iterator=True, chunksize=100000)
         logger.debug(f'STRUCTURE iterator created. Loading structure data frame, filtering by targeted XREF unichem ids...')
 
         # load it into a data frame
-        df_structures = pandas.concat(struct_element[struct_element['uci'].isin(df_filtered_xrefs.uci)] for struct_element in structure_iter)
+        target_ucis = df_filtered_xrefs.uci.unique()
+        df_structures = pandas.concat(struct_element[struct_element['uci'].isin(target_ucis)] for struct_element in structure_iter)
         logger.debug(f'STRUCTURE data frame created with filtered with XREF unichem ids. {len(df_structures)} records loaded.')
 
-        # group the records by the unichem identifier
-        xref_grouped = df_filtered_xrefs.groupby(by=['uci'])
-        logger.debug(f'STRUCTURE data frame grouped by XREF unichem ids.')
-
         logger.info('Data pre-processing complete. Start of final data processing...')
 
-        # for each of the structured records use the uci to get the xref records
-        for name, group in xref_grouped:
-            # get the synonym group into a list
-            syn_list: list = group.curie.tolist()
-
-            # add the inchikey to the list
-            syn_list.append('INCHIKEY:' + df_structures[df_structures.uci == name]['standardinchikey'].values[0])
-
-            # create a dict of all the curies. each element gets equated with the whole list
-            syn_dict: dict = dict.fromkeys(syn_list, set(syn_list))
-
-            # add it to the returned list
-            synonyms.update(syn_dict)
-
-            # increment the counter
-            chem_counter += 1
-
-            # output some feedback for the user
-            if (chem_counter % 250000) == 0:
-                logger.info(f'Processed {chem_counter} unichem chemicals...')
+        # join the curies with their inchikeys and save the clusters
+        curies, clusters = build_concordance(df_filtered_xrefs, df_structures, data_sources)
+        del df_filtered_xrefs, df_structures
+        write_concordance(concordance_dir, curies, clusters)
+        concordance = UnichemConcordance.load(concordance_dir)
+        chem_counter = len(concordance)
+        synonyms = concordance.get_synonyms()
     except KeyError as e:
     #except Exception as e:
         logger.error(f'Exception caught. Exception: {e}')
 
     logger.info(f'Load complete. Processed a total of {chem_counter} unichem chemicals.')
-    upname = os.path.join(os.path.dirname(__file__), 'unichem.pickle')
-    with open(upname,'wb') as up:
-        pickle.dump(synonyms,up)
 
     # return the resultant list set to the caller
     return synonyms
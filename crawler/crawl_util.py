@@ -1,13 +1,18 @@
 from ftplib import FTP
 from gzip import decompress
 
-from greent.util import Text
+from greent.util import Text, LoggingUtil
 from builder.question import LabeledID
 from io import BytesIO
+from array import array
+from itertools import chain
 from greent.rosetta import Rosetta
 
+import logging
 import pickle
 
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
 def pull_via_ftp(ftpsite, ftpdir, ftpfile):
     ftp = FTP(ftpsite)
     ftp.login()
@@ -25,6 +30,159 @@ def get_most_recent_file_name(ftpsite, ftpdir):
     file_name = sorted(ftp.nlst(), key=lambda x: ftp.voidcmd(f"MDTM {x}"))[-1]
     return file_name
 
+def get_identifier(element):
+    """ The curie of a str or LabeledID element, None for anything else. """
+    if isinstance(element, str):
+        return element
+    return getattr(element, 'identifier', None)
+
+
+class EquivalenceSets:
+    """ Disjoint sets of equivalent identifiers.
+
+    Identifiers are numbered as they are first seen and merged with union by size and path halving,
+    so adding a group costs about its length no matter how large the sets it joins. For each prefix
+    that has to stay unique in a set, every root keeps a count of its identifiers with that prefix,
+    and the counts are added up as sets merge. """
+
+    def __init__(self):
+        self.ids = {}
+        self.elements = []
+        self.parent = []
+        self.size = []
+        # root -> {prefix: number of identifiers in the set starting with prefix}
+        self.counts = {}
+        self.tracked = set()
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __contains__(self, element):
+        return element in self.ids
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def get_id(self, element):
+        """ The number of an element, adding it as a set of its own if it is new. """
+        i = self.ids.get(element)
+        if i is None:
+            i = len(self.elements)
+            self.ids[element] = i
+            self.elements.append(element)
+            self.parent.append(i)
+            self.size.append(1)
+            identifier = get_identifier(element)
+            if identifier is not None:
+                counts = {prefix: 1 for prefix in self.tracked if identifier.startswith(prefix)}
+                if counts:
+                    self.counts[i] = counts
+        return i
+
+    def union(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return i
+        if self.size[i] < self.size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.size[i] += self.size[j]
+        counts = self.counts.pop(j, None)
+        if counts:
+            merged = self.counts.setdefault(i, {})
+            for prefix, n in counts.items():
+                merged[prefix] = merged.get(prefix, 0) + n
+        return i
+
+    def track(self, prefixes):
+        """ Start counting identifiers with these prefixes. """
+        for prefix in prefixes:
+            if prefix in self.tracked:
+                continue
+            self.tracked.add(prefix)
+            for i, element in enumerate(self.elements):
+                identifier = get_identifier(element)
+                if identifier is not None and identifier.startswith(prefix):
+                    counts = self.counts.setdefault(self.find(i), {})
+                    counts[prefix] = counts.get(prefix, 0) + 1
+
+    def add_groups(self, groups, unique_prefixes=()):
+        """ Merge each group (an iterable of identifiers) with every set it touches. A group that would
+        put two identifiers with one of the unique_prefixes into a set is skipped. Returns the number skipped. """
+        self.track(unique_prefixes)
+        skipped = 0
+        for group in groups:
+            roots = set()
+            new = set()
+            for element in group:
+                i = self.ids.get(element)
+                if i is None:
+                    new.add(element)
+                else:
+                    roots.add(self.find(i))
+            if unique_prefixes and self.is_conflicting(roots, new, unique_prefixes):
+                logger.debug(f'Not merging {group}: more than one identifier with one of {unique_prefixes}')
+                skipped += 1
+                continue
+            self.merge([*roots, *(self.get_id(element) for element in new)])
+        return skipped
+
+    def is_conflicting(self, roots, new, unique_prefixes):
+        identifiers = [get_identifier(element) for element in new]
+        for prefix in unique_prefixes:
+            n = sum(self.counts.get(root, {}).get(prefix, 0) for root in roots)
+            n += sum(1 for identifier in identifiers if identifier is not None and identifier.startswith(prefix))
+            if n > 1:
+                return True
+        return False
+
+    def merge(self, ids):
+        if ids:
+            root = ids[0]
+            for i in ids[1:]:
+                root = self.union(root, i)
+
+    @staticmethod
+    def from_dict(conc_set):
+        """ The sets of a glom dictionary. """
+        sets = EquivalenceSets()
+        seen = set()
+        for equivalents in conc_set.values():
+            if id(equivalents) not in seen:
+                seen.add(id(equivalents))
+                sets.merge([sets.get_id(e) for e in equivalents])
+        return sets
+
+    def export(self):
+        """ The sets in compact form: (elements, labels), where labels[i] numbers the set of elements[i] from 0. """
+        numbers = {}
+        labels = array('l', (numbers.setdefault(self.find(i), len(numbers)) for i in range(len(self.elements))))
+        return self.elements, labels
+
+    def components(self):
+        """ The sets, as lists of elements. """
+        elements, labels = self.export()
+        components = {}
+        for element, label in zip(elements, labels):
+            components.setdefault(label, []).append(element)
+        return list(components.values())
+
+    def items(self):
+        """ (element, set of its equivalents) pairs, with one set shared by the elements of a set. """
+        for component in self.components():
+            equivalents = set(component)
+            for element in component:
+                yield element, equivalents
+
+    def to_dict(self):
+        return dict(self.items())
+
+
 #def glom(conc_set, newgroups, unique_prefixes=[]):
 def glom(conc_set, newgroups, unique_prefixes=['INCHI']):
     """We want to construct sets containing equivalent identifiers.
@@ -32,56 +190,56 @@ def glom(conc_set, newgroups, unique_prefixes=['INCHI']):
     the keys are all of the elements in the set.   For each element in a set, there is a key
     in the dictionary that points to the set.
     newgroups is an iterable that of new equivalence groups (expressed as sets,tuples,or lists)
-    with which we want to update conc_set."""
+    with which we want to update conc_set.  A new group that would put two identifiers with one
+    of the unique_prefixes into one set is left out.
+    conc_set can also be an EquivalenceSets, which merges large sets much faster. Callers that glom many
+    times should build one (see EquivalenceSets.from_dict) and hand it to every call."""
+    if isinstance(conc_set, EquivalenceSets):
+        conc_set.add_groups(newgroups, unique_prefixes)
+        return
+    skipped = 0
     for group in newgroups:
-        #Find all the equivalence sets that already correspond to any of the identifiers in the new set.
-        p=False
-        existing_sets = [ conc_set[x] for x in group if x in conc_set ]
-        if p:
-            print(existing_sets)
-        #All of these sets are now going to be combined through the equivalence of our new set.
-        newset=set().union(*existing_sets)
-        if p:
-            print(newset)
-        #put all the new stuff in it.  Do it element-wise, cause we don't know the type of the new group
-        for element in group:
-            newset.add(element)
-        #make sure we didn't combine anything we want to keep separate
-        setok = True
-        for up in unique_prefixes:
-            idents = [e if type(e)==str else e.identifier for e in newset]
-            if len([1 for e in idents if e.startswith(up)]) > 1:
-                print('------')
-                print('up')
-                print(up)
-                print([e for e in newset if e.startswith(up)])
-                print('group')
-                print(group)
-                print('existing_sets')
-                print(existing_sets)
-                print('newset')
-                print(newset)
-                print('------')
-                setok = False
-                break
-        if not setok:
+        group = list(group)
+        #The sets that already hold any of the identifiers in the new group, largest first
+        existing_sets = sorted({id(conc_set[x]): conc_set[x] for x in group if x in conc_set}.values(), key=len, reverse=True)
+        new_elements = [x for x in group if x not in conc_set]
+        #make sure we don't combine anything we want to keep separate
+        if unique_prefixes and is_conflicting(existing_sets, new_elements, unique_prefixes):
+            logger.debug(f'Not merging {group}: more than one identifier with one of {unique_prefixes}')
+            skipped += 1
             continue
-        #Now make all the elements point to this new set:
-        if p:
-            print(newset)
-        for element in newset:
+        #grow the largest set, so only the elements of the others have to be re-pointed
+        newset = existing_sets[0] if existing_sets else set()
+        for other in existing_sets[1:]:
+            newset.update(other)
+            for element in other:
+                conc_set[element] = newset
+        newset.update(new_elements)
+        for element in new_elements:
             conc_set[element] = newset
+    if skipped:
+        logger.info(f'glom skipped {skipped} groups that would merge identifiers with one of {unique_prefixes}')
+
+def is_conflicting(existing_sets, new_elements, unique_prefixes):
+    """ Whether the union of existing_sets and new_elements has two identifiers with one of the unique_prefixes. """
+    if len(existing_sets) + len(new_elements) < 2:
+        return False
+    identifiers = [get_identifier(e) for e in chain(new_elements, *existing_sets)]
+    for prefix in unique_prefixes:
+        if sum(1 for i in identifiers if i is not None and i.startswith(prefix)) > 1:
+            return True
+    return False
 
 def dump_cache(concord,rosetta,outf=None):
+    """ Cache the synonyms of each identifier. concord is a glom dictionary or an EquivalenceSets. """
     with rosetta.cache.get_pipeline() as pipe:
         ecount = 0
-        for element in concord:
+        for element, value in concord.items():
             if isinstance(element,LabeledID):
                 element_id = element.identifier
             else:
                 element_id = element
             key = f"synonymize({Text.upper_curie(element_id)})"
-            value = concord[element]
             if outf is not None:
                 outf.write(f'{key}: {value}\n')
             rosetta.cache.set(key,value,pipe)
@@ -1,4 +1,4 @@
-from crawler.crawl_util import glom, dump_cache
+from crawler.crawl_util import glom, dump_cache, EquivalenceSets
 from builder.question import LabeledID
 from greent.util import Text
 import os
@@ -49,13 +49,14 @@ def load_diseases_and_phenotypes(rosetta):
     print('get and write umls sets')
     meddra_umls = read_meddra()
     write_sets(hpo_sets,'meddra_umls_sets.txt')
-    dicts = {}
+    sets = EquivalenceSets()
     print('put it all together')
-    glom(dicts,mondo_sets)
-    write_dicts(dicts,'mondo_dicts.txt')
-    glom(dicts,hpo_sets)
-    write_dicts(dicts,'mondo_hpo_dicts.txt')
-    glom(dicts,meddra_umls)
+    glom(sets,mondo_sets)
+    write_dicts(sets.to_dict(),'mondo_dicts.txt')
+    glom(sets,hpo_sets)
+    write_dicts(sets.to_dict(),'mondo_hpo_dicts.txt')
+    glom(sets,meddra_umls)
+    dicts = sets.to_dict()
     write_dicts(dicts,'mondo_hpo_meddra_dicts.txt')
     print('dump it')
     with open('disease.txt','w') as outf:
@@ -1,4 +1,3 @@
-import pickle
 import datetime
 import psycopg2
 from collections import defaultdict
@@ -12,12 +11,9 @@ max_piped = 1000000
 
 def create_omnicache(rosetta):
     redis = rosetta.cache.redis
-    key = 'OmnicorpPrefixes'
-    value = redis.get(key)
-    if value is None:
-        pairset = set()
-    else:
-        pairset = pickle.loads(value)
+    # values go through the cache's serializer, which also reads records written before a cache_tool migrate
+    serializer = rosetta.cache.serializer
+    pairset = get_prefixes(redis, serializer)
     p=['CHEBI','CL','DRUGBANK','ECTO','EFO','ENVO','FOODON','GO','HANCESTRO','HP','MONDO','NCBIGene','NCBITaxon','PUBCHEM_COMPOUND','UBERON','UMLS']
     sizes={}
     for i,prefix_i in enumerate(p):
@@ -26,7 +22,7 @@ def create_omnicache(rosetta):
             conn = create_connection(rosetta)
             print('go') 
             #cacheit(prefix_i, prefix_j, conn, redis)
-            cacheit2(prefix_i, prefix_j, conn, redis, pairset,sizes)
+            cacheit2(prefix_i, prefix_j, conn, redis, serializer, pairset,sizes)
             conn.close()
 
 def update_omnicache(rosetta,p1,p2):
@@ -34,7 +30,7 @@ def update_omnicache(rosetta,p1,p2):
     add the pair of interest to the build method above."""
     conn = create_connection(rosetta)
     redis = rosetta.cache.redis
-    cacheit(p1,p2, conn, redis)
+    cacheit(p1,p2, conn, redis, rosetta.cache.serializer)
 
 def create_connection(rosetta):
     context = rosetta.service_context
@@ -52,31 +48,32 @@ def create_connection(rosetta):
     return psycopg2.connect(dbname=db, user=user, host=host, port=port,password=pw)
 
 
-def dump(k, v, pipe):
+def dump(k, v, pipe, serializer):
     if len(k) == 0:
         return
     key = f'OmnicorpSupport({k[0]},{k[1]})'
     # outf.write(f'SET {key} {pickle.dumps(v)}\n')
-    pipe.set(key, pickle.dumps(v))
+    pipe.set(key, serializer.dumps(v))
 
-def dump_count(k,v,pipe):
+def dump_count(k,v,pipe, serializer):
     if len(k) == 0:
         return
     key = f'OmnicorpSupport_count({k[0]},{k[1]})'
     # outf.write(f'SET {key} {pickle.dumps(v)}\n')
-    pipe.set(key, pickle.dumps(v))
+    pipe.set(key, serializer.dumps(v))
 
-def update_prefixes(p1, p2, redis):
-    key = 'OmnicorpPrefixes'
-    value = redis.get(key)
+def get_prefixes(redis, serializer):
+    value = redis.get('OmnicorpPrefixes')
     if value is None:
-        pairset = set()
-    else:
-        pairset = pickle.loads(value)
+        return set()
+    return serializer.loads(value)
+
+def update_prefixes(p1, p2, redis, serializer):
+    pairset = get_prefixes(redis, serializer)
     pairset.add((p1, p2))
-    redis.set(key, pickle.dumps(pairset))
+    redis.set('OmnicorpPrefixes', serializer.dumps(pairset))
 
-def cacheit2(p1,p2,conn,redis,pairset,sizes):
+def cacheit2(p1,p2,conn,redis,serializer,pairset,sizes):
     start = datetime.datetime.now()
     p1,p2 = sorted([p1,p2])
     if (p1,p2) in pairset:
@@ -111,8 +108,8 @@ def cacheit2(p1,p2,conn,redis,pairset,sizes):
                 curie_1,curie_2 = sorted( [curie_1, curie_2] )
                 ckey = (curie_1, curie_2)
                 n+=1
-                dump(ckey, pubs, pipe)
-                dump_count(ckey, len(pubs), pipe)
+                dump(ckey, pubs, pipe, serializer)
+                dump_count(ckey, len(pubs), pipe, serializer)
                 num_piped += 1
                 if num_piped >= max_piped:
                     pipe.execute()
@@ -120,9 +117,9 @@ def cacheit2(p1,p2,conn,redis,pairset,sizes):
         pipe.execute()
     end = datetime.datetime.now()
     print(f'Wrote {n} entries in {end-start}')
-    update_prefixes(p1, p2, redis)
+    update_prefixes(p1, p2, redis, serializer)
 
-def cacheit(p1, p2, conn, redis):
+def cacheit(p1, p2, conn, redis, serializer):
     p1, p2 = sorted([p1, p2])
     print(p1,p2)
     start = datetime.datetime.now()
@@ -155,8 +152,8 @@ def cacheit(p1, p2, conn, redis):
                         curie_1,curie_2 = sorted( [curie_1, curie_2] )
                     if (curie_1, curie_2) != ckey:
                         n += 1
-                        dump(ckey, pubs, pipe)
-                        dump_count(ckey, len(pubs), pipe)
+                        dump(ckey, pubs, pipe, serializer)
+                        dump_count(ckey, len(pubs), pipe, serializer)
                         num_piped += 1
                         if num_piped >= max_piped:
                             pipe.execute()
@@ -180,7 +177,7 @@ def cacheit(p1, p2, conn, redis):
         pipe.execute()
     end = datetime.datetime.now()
     print(f'Wrote {n} entries in {end-start}')
-    update_prefixes(p1, p2, redis)
+    update_prefixes(p1, p2, redis, serializer)
 
 
 def get_curie_count(prefix,conn):
@@ -1,7 +1,7 @@
 from greent.util import Text, LoggingUtil
 from greent.graph_components import KNode
 from greent import node_types
-from greent.services.myvariant import MyVariant
+from greent.services.myvariant import MyVariant, BATCH_SIZE, DEFAULT_BATCH_WORKERS, get_batches
 from greent.export_delegator import WriterDelegator
 from greent.cache import Cache
 from builder.gtex_builder import GTExBuilder
@@ -9,7 +9,6 @@ from builder.question import LabeledID
 from crawler.crawl_util import query_the_graph
 
 import logging
-import pickle
 import os
 
 logger = LoggingUtil.init_logging("robokop-interfaces.crawler.sequence_variants", level=logging.INFO, logFilePath=f'{os.environ["ROBOKOP_HOME"]}/logs/')
@@ -103,7 +102,7 @@ def get_variants_and_synonyms_without_genes_from_graph(rosetta: object) -> list:
 ################
 # batch precache any sequence variant data
 ################
-def precache_variant_batch_data(rosetta: object, force_all: bool=False) -> object:
+def precache_variant_batch_data(rosetta: object, force_all: bool=False, workers: int=DEFAULT_BATCH_WORKERS) -> object:
     # init the return value
     ret_val = None
 
@@ -118,74 +117,75 @@ def precache_variant_batch_data(rosetta: object, force_all: bool=False) -> objec
             # grab only variants with no existing gene relationships 
             var_list = get_variants_and_synonyms_without_genes_from_graph(rosetta)
 
-        # create an array to handle the ones not already in cache that need to be processed
-        uncached_variant_annotation_nodes = []
+        # stream the variant nodes through the cache check and on to myvariant
+        cached_count, annotated_count = prepopulate_variant_annotation_cache(cache, myvariant, get_variant_nodes(var_list), workers)
 
-        # for each variant
-        for var in var_list:
-            # check to see if we have all the data elements we need. element [0] is the ID, element [1] is the synonym list
-            if len(var) == 2:
-                # create a variant node
-                variant_node = KNode(var[0], name=var[0], type=node_types.SEQUENCE_VARIANT)
+        logger.info(f'{annotated_count} variant annotations cached, {cached_count} were already in the cache')
 
-                # get the synonym data from the graph DB call
-                syn_set = set(var[1])
+    except Exception as e:
+        logger.error(f'Exception caught. Exception: {e}')
+        ret_val = e
 
-                # add the synonyms to the node
-                variant_node.add_synonyms(syn_set)
+    # return to the caller
+    return ret_val
 
-                # check if myvariant key exists in cache, otherwise add it to buffer for batch processing
-                cache_results = cache.get(f'myvariant.sequence_variant_to_gene({variant_node.id})')
 
-                if cache_results == None:
-                    uncached_variant_annotation_nodes.append(variant_node)
+#######
+# get_variant_nodes - creates variant nodes, one at a time, from the (id, synonym list) records of a graph query
+#######
+def get_variant_nodes(var_list: list):
+    # for each variant
+    for var in var_list:
+        # check to see if we have all the data elements we need. element [0] is the ID, element [1] is the synonym list
+        if len(var) == 2:
+            # create a variant node
+            variant_node = KNode(var[0], name=var[0], type=node_types.SEQUENCE_VARIANT)
 
-                    # if there is enough in the variant annotation batch process them and empty the array
-                    if len(uncached_variant_annotation_nodes) == 1000:
-                        prepopulate_variant_annotation_cache(cache, myvariant, uncached_variant_annotation_nodes)
-                        uncached_variant_annotation_nodes = []
+            # add the synonyms from the graph DB call to the node
+            variant_node.add_synonyms(set(var[1]))
 
-        # if there are remainder variant node entries left to process
-        if uncached_variant_annotation_nodes:
-            prepopulate_variant_annotation_cache(cache, myvariant, uncached_variant_annotation_nodes)
+            yield variant_node
 
-    except Exception as e:
-        logger.error(f'Exception caught. Exception: {e}')
-        ret_val = e
 
-    # return to the caller
-    return ret_val
+def get_variant_annotation_key(variant_id: str) -> str:
+    return f'myvariant.sequence_variant_to_gene({variant_id})'
 
 
 #######
-# process_variant_annotation_cache - processes an array of un-cached variant nodes.
+# get_uncached_variant_nodes - the variant nodes whose annotations are not in the cache, looked up in batches
 #######
-def prepopulate_variant_annotation_cache(cache: Cache, myvariant: MyVariant, batch_of_nodes: list) -> bool:
-    # init the return value, presume failure
-    ret_val = False
-    
-    # get a batch of variants
-    batch_annotations = myvariant.batch_sequence_variant_to_gene(batch_of_nodes)
-
-    # do we have anything to process
-    if len(batch_annotations) > 0:
-        # open a connection to the redis cache DB
-        with cache.redis.pipeline() as redis_pipe:
-            # for each variant
-            for seq_var_curie, annotations in batch_annotations.items():
-                # assemble the redis key
-                key = f'myvariant.sequence_variant_to_gene({seq_var_curie})'
-    
-                # add the key and data to the list to execute
-                redis_pipe.set(key, pickle.dumps(annotations))
-    
-            # write the records out to the cache DB
-            redis_pipe.execute()
-            
-            ret_val = True
-            
+def get_uncached_variant_nodes(cache: Cache, variant_nodes, counts: dict, batch_size: int=BATCH_SIZE):
+    for batch in get_batches(variant_nodes, batch_size):
+        # one round trip for the whole batch
+        cache_results = cache.get_many([get_variant_annotation_key(variant_node.id) for variant_node in batch])
+
+        for variant_node, cache_result in zip(batch, cache_results):
+            if cache_result is None:
+                yield variant_node
+            else:
+                counts['cached'] += 1
+
+
+#######
+# prepopulate_variant_annotation_cache - annotates any number of variant nodes that are not already cached.
+#
+# myvariant runs several batch posts at once, each batch of results is written with pipelined cache sets.
+# returns the number of variants that were already cached and the number annotated
+#######
+def prepopulate_variant_annotation_cache(cache: Cache, myvariant: MyVariant, variant_nodes, workers: int=DEFAULT_BATCH_WORKERS) -> tuple:
+    counts = {'cached': 0, 'annotated': 0}
+
+    uncached_variant_nodes = get_uncached_variant_nodes(cache, variant_nodes, counts)
+
+    # get the annotations a batch at a time, as they come back
+    for batch_annotations in myvariant.stream_sequence_variant_to_gene(uncached_variant_nodes, workers=workers):
+        # write the batch out to the cache DB
+        cache.set_many({get_variant_annotation_key(seq_var_curie): annotations for seq_var_curie, annotations in batch_annotations.items()})
+
+        counts['annotated'] += len(batch_annotations)
+
     # return to the caller
-    return ret_val
+    return counts['cached'], counts['annotated']
 
 # simple tester
 # if __name__ == '__main__':
@@ -0,0 +1,98 @@
+import logging
+import os
+import numpy
+import pandas
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+# the concordance files, each a numpy array that can be memory mapped
+CONCORDANCE_FILES = ['curies', 'clusters', 'members', 'offsets']
+
+
+#########################
+# build_concordance() - joins the UniChem cross references with their structures
+#
+# xrefs: DataFrame - uci, src_id and src_compound_id of the cross references to keep
+# structures: DataFrame - uci and standardinchikey
+# data_sources: dict - the curie prefix of each UniChem src_id
+# return: (curies, clusters) - the curies (utf-8 bytes, sorted) and the cluster (integer encoded uci) of each
+#########################
+def build_concordance(xrefs: pandas.DataFrame, structures: pandas.DataFrame, data_sources: dict) -> tuple:
+    # curies for all rows at once, the prefixes are mapped from the (few) source ids
+    xref_curies: pandas.Series = xrefs['src_id'].map(data_sources) + ':' + xrefs['src_compound_id']
+
+    # one merge brings in the inchikey of every uci group
+    keys: pandas.DataFrame = pandas.merge(xrefs[['uci']].drop_duplicates(), structures.drop_duplicates('uci'), on='uci')
+    members: pandas.DataFrame = pandas.concat([
+        pandas.DataFrame({'uci': xrefs['uci'].values, 'curie': xref_curies.values}),
+        pandas.DataFrame({'uci': keys['uci'].values, 'curie': ('INCHIKEY:' + keys['standardinchikey']).values})])
+
+    # a curie in more than one uci group stays in the last one, as it did when each group updated a dict
+    members = members.sort_values('uci', kind='mergesort').drop_duplicates('curie', keep='last')
+
+    clusters: numpy.ndarray = pandas.factorize(members['uci'], sort=True)[0].astype(numpy.int32)
+    curies: numpy.ndarray = members['curie'].str.encode('utf-8').values.astype(bytes)
+    order: numpy.ndarray = numpy.argsort(curies, kind='mergesort')
+    return curies[order], clusters[order]
+
+
+#########################
+# write_concordance() - saves a concordance as numpy arrays in a directory
+#
+# curies.npy: the sorted curies, clusters.npy: the cluster of each curie,
+# members.npy and offsets.npy: the positions of the curies of cluster k are members[offsets[k]:offsets[k + 1]]
+#########################
+def write_concordance(directory: str, curies: numpy.ndarray, clusters: numpy.ndarray):
+    os.makedirs(directory, exist_ok=True)
+    members: numpy.ndarray = numpy.argsort(clusters, kind='mergesort').astype(numpy.int64)
+    offsets: numpy.ndarray = numpy.zeros(clusters.max() + 2 if len(clusters) else 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(clusters), out=offsets[1:])
+    for name, array in zip(CONCORDANCE_FILES, [curies, clusters, members, offsets]):
+        path: str = os.path.join(directory, f'{name}.npy')
+        with open(f'{path}.tmp', 'wb') as stream:
+            numpy.save(stream, array)
+        os.replace(f'{path}.tmp', path)
+    logger.info(f'Wrote {len(curies)} curies in {len(offsets) - 1} clusters to {directory}')
+
+
+class UnichemConcordance:
+    """ The UniChem equivalence clusters, as written by write_concordance. The arrays are memory
+    mapped, so a concordance can be opened (and shared between processes) without reading it. """
+
+    def __init__(self, curies, clusters, members, offsets):
+        self.curies = curies
+        self.clusters = clusters
+        self.members = members
+        self.offsets = offsets
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        return UnichemConcordance(*[numpy.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                                    for name in CONCORDANCE_FILES])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_cluster_id(self, curie):
+        """ The cluster of a curie, None if it is not in the concordance. """
+        key = curie.encode('utf-8')
+        i = numpy.searchsorted(self.curies, key)
+        if i == len(self.curies) or self.curies[i] != key:
+            return None
+        return int(self.clusters[i])
+
+    def get_cluster(self, cluster_id):
+        """ The curies of a cluster. """
+        positions = self.members[self.offsets[cluster_id]: self.offsets[cluster_id + 1]]
+        return [curie.decode('utf-8') for curie in self.curies[positions]]
+
+    def get_synonyms(self):
+        """ {curie: set of equivalent curies}, one set shared by all the curies of a cluster, the form glom works on. """
+        curies = [curie.decode('utf-8') for curie in self.curies[self.members]]
+        offsets = self.offsets.tolist()
+        synonyms = {}
+        for start, end in zip(offsets, offsets[1:]):
+            cluster = curies[start: end]
+            synonyms.update(dict.fromkeys(cluster, set(cluster)))
+        return synonyms
@@ -3,11 +3,15 @@ import logging
 import aiohttp
 import asyncio
 import greent.annotators.util.async_client as async_client
+from greent.http_client import HttpClient
 from greent.util import Resource
 from greent import node_types
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG, format='medium')
 
+# concurrent fetches per source when its prefix config has no concurrency
+DEFAULT_SOURCE_LIMIT = 8
+
 class Annotator:
     """
     Super class for all annotators. Defines common methods that should be implemented among the annotators.
@@ -40,6 +44,7 @@ class Annotator:
         self.event_loop.set_debug(True)
 
     def __del__(self):
+        HttpClient.close_async_session(self.event_loop)
         self.event_loop.close()
 
     def get_prefix_config(self, prefix):
@@ -74,20 +79,67 @@ class Annotator:
         return node
 
 
+    def get_batch_curies(self, node):
+        """
+        The curies whose annotations make up the properties of node, None if the annotator skips it.
+        Used by annotator_factory.annotate_nodes, together with get_cache_key, fetch_annotation and merge_annotations.
+        """
+        return [synonym for prefix in self.prefix_source_mapping for synonym in node.get_synonyms_by_prefix(prefix)]
+
+    def get_source_limit(self, node_curie):
+        """
+        How many annotations may be fetched at once from the source of a curie: the concurrency
+        in the config of its prefix, or DEFAULT_SOURCE_LIMIT.
+        """
+        conf = self.get_prefix_config(Text.get_curie(node_curie)) or {}
+        return int(conf.get('concurrency', DEFAULT_SOURCE_LIMIT))
+
+    async def fetch_annotation(self, node_curie):
+        return await self.get_curie_annotation(node_curie)
+
+    def merge_annotations(self, node, annotations):
+        """
+        Adds the annotations of the curies from get_batch_curies, in the same order, to node.
+        """
+        for data in annotations:
+            node.properties.update(data)
+
     async def merge_property_data(self, synonym_basket):
         """
         Creates tasks that each will get part of the node property based on node id and synonyms.
+        Cached annotations for all the synonyms are looked up in one batch, only the misses are fetched.
         """
         properties = {}
-        tasks = []
-        for prefix in synonym_basket:
-            for synonym in synonym_basket[prefix]:
-                tasks.append(self.get_from_cache(synonym))
-        results = await asyncio.gather(*tasks,return_exceptions= False)  
-        for result in results:
-            properties.update(result)     
+        curies = [synonym for prefix in synonym_basket for synonym in synonym_basket[prefix]]
+        cached = self.get_many_from_cache(curies)
+        misses = list(dict.fromkeys(curie for curie, data in zip(curies, cached) if data is None))
+        fetched = await asyncio.gather(*[self.get_curie_annotation(curie) for curie in misses], return_exceptions= False)
+        fetched = dict(zip(misses, fetched))
+        self.insert_many_to_cache({curie: data for curie, data in fetched.items() if data != {}})
+        for curie, data in zip(curies, cached):
+            properties.update(data if data is not None else fetched[curie])
         return properties
 
+    def get_cache_key(self, node_curie):
+        return f"annotation({Text.upper_curie(node_curie)})"
+
+    def get_many_from_cache(self, node_curies):
+        """
+        Looks up cached annotations for a list of curies in one round trip, None for misses.
+        """
+        keys = [self.get_cache_key(curie) for curie in node_curies]
+        if not keys:
+            return []
+        cached = self.rosetta.cache.get_many(keys)
+        logger.info(f"cache hits: {sum(1 for data in cached if data is not None)} of {len(keys)}")
+        return cached
+
+    def insert_many_to_cache(self, annotations):
+        """
+        inserts annotations for many curies into redis in one pipeline.
+        """
+        if annotations:
+            self.rosetta.cache.set_many({self.get_cache_key(curie): annotation for curie, annotation in annotations.items()})
 
     async def get_from_cache(self, node_curie):
         """
@@ -95,7 +147,7 @@ class Annotator:
         add it to cache.
         Calling the cache is still a blocking call.
         """
-        key = f"annotation({Text.upper_curie(node_curie)})"
+        key = self.get_cache_key(node_curie)
         logger.info(f"Getting attribute: {key}")
         # also here it might be helpful to make it async
         cached_data = self.rosetta.cache.get(key)
@@ -118,7 +170,7 @@ class Annotator:
         inserts into redis cache, this might be a blocker of the event loop 
         might consider adding aioredis for sending data to redis async also.
         """
-        key = f"annotation({Text.upper_curie(node_curie)})"
+        key = self.get_cache_key(node_curie)
         logger.info(f'inserting into cache {key}')
         self.rosetta.cache.set(key, annotation)
         return annotation
@@ -3,7 +3,9 @@ from greent.annotators.gene_annotator import GeneAnnotator
 from greent.annotators.chemical_annotator import ChemicalAnnotator
 from greent.annotators.disease_annotator import DiseaseAnnotator
 from greent.annotators.generic_annotator import GenericAnnotator
+import asyncio
 import logging
+import threading
 
 logger = logging.getLogger(name= __name__)
 annotator_class_list = {
@@ -43,18 +45,90 @@ def annotate_shortcut(node, rosetta):
     using the factory and calling it on the node. Returns none if no annotator
     was found.
     """
+    annotate_nodes([node], rosetta)
+    if any(annotator is not None for annotator in make_annotator(node, rosetta)):
+        return True
+    return None
 
-    #generic annotation
+
+def get_generic_annotator(rosetta):
     if annotator_instances.get(node_types.NAMED_THING, None) == None :
         annotator_instances[node_types.NAMED_THING] = GenericAnnotator(rosetta)
-    generic_annotator = annotator_instances.get(node_types.NAMED_THING)
-    generic_annotator.annotate(node)
-
-    # typed annotation
-    annotated = None
-    typed_annotators = make_annotator(node, rosetta)
-    for annotator in typed_annotators:
-        if annotator != None:
-            annotator.annotate(node)
-        annotated = True
-    return annotated
+    return annotator_instances.get(node_types.NAMED_THING)
+
+
+def unwrap(annotator):
+    """
+    The annotator behind a singleton wrapper (GeneAnnotator, GenericAnnotator), whose own Annotator
+    methods were never initialized.
+    """
+    return getattr(annotator, 'instance', None) or annotator
+
+
+batch_loop = threading.local()
+
+
+def get_event_loop():
+    """
+    The event loop annotate_nodes runs in, one per thread (writers may annotate in a background thread).
+    """
+    loop = getattr(batch_loop, 'loop', None)
+    if loop is None:
+        loop = batch_loop.loop = asyncio.new_event_loop()
+    return loop
+
+
+async def fetch_annotations(misses):
+    """
+    Fetches {cache key: (annotator, curie)} concurrently, at most the source limit of the annotator
+    at a time from each source. Failed fetches are logged and come back as {}.
+    """
+    semaphores = {}
+    async def fetch(annotator, curie):
+        source = (type(annotator).__name__, curie.split(':')[0])
+        if source not in semaphores:
+            semaphores[source] = asyncio.Semaphore(annotator.get_source_limit(curie))
+        async with semaphores[source]:
+            return await annotator.fetch_annotation(curie)
+    keys = list(misses)
+    results = await asyncio.gather(*[fetch(*misses[key]) for key in keys], return_exceptions=True)
+    fetched = {}
+    for key, result in zip(keys, results):
+        if isinstance(result, Exception):
+            logger.error(f'Annotation of {key} failed: {result}')
+            result = {}
+        fetched[key] = result
+    return fetched
+
+
+def annotate_nodes(nodes, rosetta):
+    """
+    Annotates many nodes at once with the generic annotator and the annotators of their types.
+    Every cache key the annotators need for the batch is looked up in one multi-get, the misses of all
+    annotators are fetched concurrently in a single event loop run, then cached in one pipeline, and
+    the results are merged back into the nodes. Returns the nodes.
+    """
+    plan = []
+    for node in nodes:
+        annotators = [get_generic_annotator(rosetta)] + [a for a in make_annotator(node, rosetta) if a is not None]
+        for annotator in map(unwrap, annotators):
+            curies = annotator.get_batch_curies(node)
+            if curies is not None:
+                plan.append((node, annotator, [(annotator.get_cache_key(curie), curie) for curie in curies]))
+    keys = list(dict.fromkeys(key for _, _, lookups in plan for key, _ in lookups))
+    if keys:
+        cached = dict(zip(keys, rosetta.cache.get_many(keys)))
+    else:
+        cached = {}
+    misses = {}
+    for _, annotator, lookups in plan:
+        for key, curie in lookups:
+            if cached[key] is None and key not in misses:
+                misses[key] = (annotator, curie)
+    logger.info(f'Annotating {len(nodes)} nodes: {len(keys) - len(misses)} of {len(keys)} annotations cached')
+    fetched = get_event_loop().run_until_complete(fetch_annotations(misses)) if misses else {}
+    rosetta.cache.set_many({key: data for key, data in fetched.items() if data != {}})
+    for node, annotator, lookups in plan:
+        annotations = [cached[key] if cached[key] is not None else fetched[key] for key, _ in lookups]
+        annotator.merge_annotations(node, annotations)
+    return nodes
@@ -12,7 +12,7 @@ from greent.util import Text, LoggingUtil
 import logging
 import traceback
 from greent import node_types
-import requests
+from greent import http_client
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG, format='medium')
 
@@ -38,7 +38,7 @@ class GenericAnnotator(Annotator):
             self.onto_url = rosetta.core.onto.url
             self.concepts = rosetta.type_graph.concept_model
             # instead of querying onto blindly we can ask it for list of curies it supports
-            response = requests.get(f'{self.onto_url}/curie_uri_map')
+            response = http_client.get(f'{self.onto_url}/curie_uri_map')
             self.supported_prefixes = list(response.json().keys())
             logger.debug(f'generic annotator active for {self.supported_prefixes}')
 
@@ -50,6 +50,28 @@ class GenericAnnotator(Annotator):
             self.get_literary_synonyms(node)
             return node
 
+        def get_batch_curies(self, node):
+            if node.type == node_types.SEQUENCE_VARIANT:
+                return None
+            synonym_curies = map(lambda x: x.identifier if isinstance(x, LabeledID) else x, node.synonyms)
+            return [curie for curie in synonym_curies if self.curie_is_supported(curie)]
+
+        def get_cache_key(self, node_curie):
+            return f"literal_synonyms({node_curie})"
+
+        async def fetch_annotation(self, node_curie):
+            return await self.async_get_json(f'{self.onto_url}/synonyms/{node_curie}')
+
+        def merge_annotations(self, node, annotations):
+            names = []
+            for r in filter(lambda x: x and len(x), annotations):
+                for name in map(lambda x: x['desc'], r):
+                    if name not in names:
+                        names.append(name)
+            node.properties.update({
+                'synonyms': names
+            })
+
         def get_literary_synonyms(self, node):
             # synonym curies
             synonym_curies = list(map(lambda x: x.identifier if isinstance(x, LabeledID) else x, node.synonyms))
@@ -1,5 +1,5 @@
-import aiohttp
 import logging
+from greent.http_client import get_async_session
 
 logger = logging.getLogger(name = __name__)
 
@@ -7,41 +7,41 @@ async def async_get_json(url, headers = {},  retry_opts={'retry_attempts':3}):
     """
         Gets json response from url asyncronously.
     """
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    logger.error(f"Failed to get response from {url}. Status code {response.status}")
-                    return {}
-                return await response.json()
-        except Exception as e:
-            logger.error(f"Failed to get response from {url}. Failed with client opts {retry_opts}. Exception: {e}" )
-            return {}
+    session = get_async_session()
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status != 200:
+                logger.error(f"Failed to get response from {url}. Status code {response.status}")
+                return {}
+            return await response.json()
+    except Exception as e:
+        logger.error(f"Failed to get response from {url}. Failed with client opts {retry_opts}. Exception: {e}" )
+        return {}
 
 async def async_get_text(url,headers = {}):
     """
         Gets text response from url asyncronously
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers= headers) as response:
-            if response.status != 200:
-                logger.error(f'Failed to get response from {url}, returned status : {response.status}')
-                return ''
-            return await response.text()
+    session = get_async_session()
+    async with session.get(url, headers= headers) as response:
+        if response.status != 200:
+            logger.error(f'Failed to get response from {url}, returned status : {response.status}')
+            return ''
+        return await response.text()
 
 async def async_get_response(url, headers= {}, retry_opts={'retry_attempts':3}):
     """
     Returns the whole reponse object
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            json = await response.json()
-            text = await response.text()
-            raw = await response.read()
-            return {
-                'headers' : response.headers,
-                'json': json,
-                'text': text,
-                'raw': raw,
-                'status': response.status
-            }
+    session = get_async_session()
+    async with session.get(url, headers=headers) as response:
+        json = await response.json()
+        text = await response.text()
+        raw = await response.read()
+        return {
+            'headers' : response.headers,
+            'json': json,
+            'text': text,
+            'raw': raw,
+            'status': response.status
+        }
@@ -0,0 +1,303 @@
+import argparse
+import csv
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from greent import node_types
+from greent.export import BufferedWriter, export_node_chunk, export_edge_chunk, node_to_row, edge_to_row
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+SPILL_DIR = 'spill'
+IMPORT_DIR = 'import'
+SPILL_PATTERN = re.compile(r'(nodes|edges)-(\d+)-.*\.jsonl\.gz$')
+
+
+def get_edge_id(source_id, target_id, label):
+    """ The id export_edge_chunk gives an edge: apoc.util.md5 of its endpoint ids and label, concatenated. """
+    return hashlib.md5(f'{source_id}{target_id}{label}'.encode('utf-8')).hexdigest()
+
+
+def get_shard(key, shards):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16) % shards
+
+
+def to_json(value):
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+class BulkImportSink:
+    """ Stands in for the neo4j driver of a BufferedWriter. The node and edge chunks the writer would
+    send to export_node_chunk and export_edge_chunk are appended, as JSON lines, to gzipped spill files
+    sharded by node id and edge id. finalize() later merges the spill files into neo4j-admin import CSVs.
+    Each sink writes its own spill files, so any number of writers and processes can share a directory. """
+
+    def __init__(self, directory, shards=16):
+        self.directory = directory
+        self.shards = int(shards)
+        self.spill_dir = os.path.join(directory, SPILL_DIR)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # spill files are merged in name order, so start the name with the time the sink was created
+        self.name = f'{int(time.time() * 1000000):016d}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.files = {}
+
+    def session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write_transaction(self, export_function, items, *args):
+        if export_function is export_node_chunk:
+            self.write_nodes(items, *args)
+        elif export_function is export_edge_chunk:
+            self.write_edges(items, *args)
+        else:
+            raise ValueError(f'Bulk import does not support {export_function.__name__}')
+
+    def get_file(self, kind, shard):
+        stream = self.files.get((kind, shard))
+        if stream is None:
+            path = os.path.join(self.spill_dir, f'{kind}-{shard:03}-{self.name}.jsonl.gz')
+            stream = gzip.open(path, 'at', compresslevel=1)
+            self.files[(kind, shard)] = stream
+        return stream
+
+    def write_nodes(self, nodelist, labels):
+        labels = sorted(set(labels) | {node_types.ROOT_ENTITY})
+        for node_id in nodelist:
+            row = node_to_row(nodelist[node_id], labels)
+            row['labels'] = labels
+            self.get_file('nodes', get_shard(row['id'], self.shards)).write(json.dumps(row, default=to_json) + '\n')
+
+    def write_edges(self, edgelist, edgelabel, merge_edges):
+        for edge in edgelist:
+            row = edge_to_row(edge)
+            row['label'] = edgelabel
+            row['merge'] = bool(merge_edges)
+            row['id'] = get_edge_id(row['source_id'], row['target_id'], edgelabel)
+            self.get_file('edges', get_shard(row['id'], self.shards)).write(json.dumps(row, default=to_json) + '\n')
+
+    def close(self):
+        for stream in self.files.values():
+            stream.close()
+        self.files = {}
+
+
+class BulkImportWriter(BufferedWriter):
+    """ A BufferedWriter that writes neo4j-admin import files instead of running Cypher.
+    Nodes and edges are normalized, batched and de-duplicated exactly as for neo4j, then spilled to
+    directory by a BulkImportSink. With finalize_on_close the import CSVs are built when the writer is
+    closed; otherwise run `python -m greent.bulk_export finalize <directory>` once every writer is done. """
+
+    def create_driver(self):
+        writer_conf = self.rosetta.service_context.config.get('writer')
+        if writer_conf is None:
+            writer_conf = {}
+        self.directory = writer_conf.get('bulk_import_dir') or os.path.join(os.environ.get('ROBOKOP_HOME', '.'), 'bulk_import')
+        self.finalize_on_close = str(writer_conf.get('bulk_import_finalize_on_close', False)).lower() == 'true'
+        return BulkImportSink(self.directory, writer_conf.get('bulk_import_shards', 16))
+
+    def close(self):
+        self.driver.close()
+        if self.finalize_on_close:
+            finalize(self.directory)
+
+
+def read_spills(directory, kind, shard):
+    for path in sorted(glob.glob(os.path.join(directory, SPILL_DIR, f'{kind}-{shard:03}-*.jsonl.gz'))):
+        with gzip.open(path, 'rt') as stream:
+            for line in stream:
+                yield json.loads(line)
+
+
+def merge_nodes(rows):
+    """ Combine repeated nodes the way repeated MERGE/SET of export_node_chunk would. """
+    nodes = {}
+    for row in rows:
+        node = nodes.get(row['id'])
+        if node is None:
+            nodes[row['id']] = {'labels': set(row['labels']), 'properties': dict(row['properties'])}
+        else:
+            node['labels'].update(row['labels'])
+            node['properties'].update(row['properties'])
+    return nodes
+
+
+def merge_edges(rows):
+    """ Combine repeated edges the way repeated runs of export_edge_chunk would, in both its plain
+    and MERGE_EDGES forms. """
+    edges = {}
+    for row in rows:
+        key = (row['id'], row['standard_id'])
+        edge = edges.get(key)
+        if row['merge']:
+            if edge is None:
+                edge = {
+                    'edge_source': [row['provided_by']],
+                    'relation_label': [row['original_predicate_label']],
+                    'source_database': [row['database']],
+                    'ctime': [row['ctime']],
+                    'publications': row['publications'],
+                    'relation': [row['original_predicate_id']],
+                    'source_id': row['source_id'],
+                    'target_id': row['target_id'],
+                }
+            elif row['provided_by'] not in edge.get('edge_source', []):
+                for field, value in [('edge_source', row['provided_by']), ('ctime', row['ctime']),
+                                     ('relation_label', row['original_predicate_label']),
+                                     ('source_database', row['database']),
+                                     ('relation', row['original_predicate_id'])]:
+                    edge[field] = edge.get(field, []) + [value]
+                edge['predicate_id'] = row['standard_id']
+                edge['publications'] = [p for p in row['publications'] if p not in edge.get('publications', [])] \
+                    + edge.get('publications', [])
+        else:
+            if edge is None:
+                edge = {}
+            edge.update({
+                'provided_by': row['provided_by'],
+                'relation_label': row['original_predicate_label'],
+                'source_database': row['database'],
+                'ctime': row['ctime'],
+                'publications': row['publications'],
+                'relation': row['original_predicate_id'],
+                'source_id': row['source_id'],
+                'target_id': row['target_id'],
+            })
+        edge['predicate'] = row['standard_id']
+        edge.update(row['properties'])
+        edge[':START_ID'] = row['source_id']
+        edge[':END_ID'] = row['target_id']
+        edge[':TYPE'] = row['label']
+        edge['id'] = row['id']
+        edges[key] = edge
+    return edges.values()
+
+
+def get_column_type(values):
+    """ The neo4j-admin type for a property from the values it takes. """
+    kinds = set()
+    for value in values:
+        if isinstance(value, list):
+            kinds.add(get_column_type(value) + '[]' if value else 'string[]')
+        elif isinstance(value, bool):
+            kinds.add('boolean')
+        elif isinstance(value, int):
+            kinds.add('long')
+        elif isinstance(value, float):
+            kinds.add('double')
+        else:
+            kinds.add('string')
+    if kinds == {'long', 'double'}:
+        return 'double'
+    if len(kinds) == 1:
+        return kinds.pop()
+    return 'string[]' if any(kind.endswith('[]') for kind in kinds) else 'string'
+
+
+def format_value(value, column_type, array_delimiter):
+    if value is None:
+        return ''
+    if column_type.endswith('[]'):
+        values = value if isinstance(value, list) else [value]
+        return array_delimiter.join(format_value(v, column_type[:-2], array_delimiter).replace(array_delimiter, ' ')
+                                    for v in values)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def write_csv(records, header_path, data_path, fixed_columns, array_delimiter):
+    """ Write records (dicts) as a neo4j-admin header file and a gzipped data file. Returns the row count. """
+    records = list(records)
+    if not records:
+        return 0
+    keys = sorted({key for record in records for key in record} - set(fixed_columns))
+    types = {key: get_column_type([record[key] for record in records if record.get(key) is not None]) for key in keys}
+    types[':LABEL'] = 'string[]'
+    columns = fixed_columns + keys
+    header = fixed_columns + [key if types[key] == 'string' else f'{key}:{types[key]}' for key in keys]
+    with open(header_path, 'w', newline='') as stream:
+        csv.writer(stream).writerow(header)
+    with gzip.open(data_path, 'wt', newline='', compresslevel=6) as stream:
+        writer = csv.writer(stream)
+        for record in records:
+            writer.writerow([format_value(record.get(column), types.get(column, 'string'), array_delimiter)
+                             for column in columns])
+    return len(records)
+
+
+def get_shards(directory):
+    shards = set()
+    for path in glob.glob(os.path.join(directory, SPILL_DIR, '*.jsonl.gz')):
+        match = SPILL_PATTERN.search(os.path.basename(path))
+        if match:
+            shards.add(int(match.group(2)))
+    return sorted(shards)
+
+
+def finalize(directory, array_delimiter=';'):
+    """ Merge the spill files of every writer in directory into neo4j-admin import files, one header
+    and data file per shard, and write the matching neo4j-admin arguments to import.args. """
+    import_dir = os.path.join(directory, IMPORT_DIR)
+    os.makedirs(import_dir, exist_ok=True)
+    arguments = []
+    totals = {'nodes': 0, 'edges': 0}
+    for shard in get_shards(directory):
+        nodes = merge_nodes(read_spills(directory, 'nodes', shard))
+        records = []
+        for node_id, node in nodes.items():
+            record = dict(node['properties'])
+            record['id:ID'] = node_id
+            record[':LABEL'] = sorted(node['labels'])
+            records.append(record)
+        del nodes
+        header_path = os.path.join(import_dir, f'nodes-{shard:03}.header.csv')
+        data_path = os.path.join(import_dir, f'nodes-{shard:03}.csv.gz')
+        count = write_csv(records, header_path, data_path, ['id:ID', ':LABEL'], array_delimiter)
+        if count:
+            totals['nodes'] += count
+            arguments.append(f'--nodes={header_path},{data_path}')
+
+        edges = merge_edges(read_spills(directory, 'edges', shard))
+        header_path = os.path.join(import_dir, f'edges-{shard:03}.header.csv')
+        data_path = os.path.join(import_dir, f'edges-{shard:03}.csv.gz')
+        count = write_csv(edges, header_path, data_path, [':START_ID', ':END_ID', ':TYPE', 'id'], array_delimiter)
+        if count:
+            totals['edges'] += count
+            arguments.append(f'--relationships={header_path},{data_path}')
+    # label values use ';' too, which is the neo4j-admin default for both
+    arguments += [f'--array-delimiter={array_delimiter}', '--skip-duplicate-nodes=true',
+                  '--skip-bad-relationships=true', '--multiline-fields=true']
+    with open(os.path.join(directory, 'import.args'), 'w') as stream:
+        stream.write('\n'.join(arguments) + '\n')
+    logger.info(f"Wrote {totals['nodes']} nodes and {totals['edges']} edges to {import_dir}")
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build neo4j-admin import files from bulk import spill files.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    finalize_parser = subparsers.add_parser('finalize', help='Merge spill files into import CSVs')
+    finalize_parser.add_argument('directory', help='The writer.bulk_import_dir the writers used')
+    finalize_parser.add_argument('--array-delimiter', default=';')
+    args = parser.parse_args()
+    totals = finalize(args.directory, args.array_delimiter)
+    print(f"{totals['nodes']} nodes, {totals['edges']} edges. "
+          f"Import with: neo4j-admin import --database=<name> @{os.path.join(args.directory, 'import.args')}")
@@ -5,9 +5,18 @@ import os
 import pickle
 import requests
 import redis
+import threading
 import traceback
+from collections import OrderedDict
 from greent.util import LoggingUtil
-from lru import LRU
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
 
@@ -28,16 +37,289 @@ class PickleCacheSerializer(CacheSerializer):
 class JSONCacheSerializer(CacheSerializer):
     pass # would be nice
 
+class MsgPackCacheSerializer(CacheSerializer):
+    """ Compact, versioned serialization with msgpack and, optionally, zstd compression.
+
+    Records start with a header: the MAGIC bytes, a schema version byte and a flags byte
+    (FLAG_ZSTD if the body is compressed). KNode, KEdge and LabeledID are packed field by field
+    rather than pickled. Records without the header are legacy pickles and are still readable. """
+    MAGIC = b'RC'
+    VERSION = 1
+    FLAG_ZSTD = 1
+    EXT_LABELED_ID = 1
+    EXT_KNODE = 2
+    EXT_KEDGE = 3
+    EXT_TUPLE = 4
+    EXT_SET = 5
+    EXT_FROZENSET = 6
+    EXT_PICKLE = 127
+    KNODE_FIELDS = ['id', 'name', 'type', 'original_curie', 'properties', 'synonyms', 'export_labels']
+    KEDGE_FIELDS = ['source_id', 'target_id', 'provided_by', 'ctime', 'hyper_edge_id', 'original_predicate',
+                    'standard_predicate', 'input_id', 'publications', 'url', 'is_support', 'properties']
+
+    def __init__(self, compress=True, compression_level=3, compression_threshold=256):
+        if msgpack is None:
+            raise RuntimeError('The msgpack cache serializer needs the msgpack package.')
+        from greent.graph_components import KNode, KEdge, LabeledID, SynonymSet, CompactKNode, CompactKEdge
+        self.KNode = KNode
+        self.SynonymSet = SynonymSet
+        self.KEdge = KEdge
+        self.CompactKNode = CompactKNode
+        self.CompactKEdge = CompactKEdge
+        self.LabeledID = LabeledID
+        self.compress = compress and zstd is not None
+        if compress and zstd is None:
+            logger.warning('zstandard is not installed, cache records will not be compressed.')
+        self.compression_threshold = compression_threshold
+        self.compressor = zstd.ZstdCompressor(level=compression_level) if self.compress else None
+        self.decompressor = zstd.ZstdDecompressor() if zstd is not None else None
+
+    def pack(self, obj):
+        return msgpack.packb(obj, default=self.default, strict_types=True, use_bin_type=True)
+
+    def unpack(self, data):
+        return msgpack.unpackb(data, ext_hook=self.ext_hook, raw=False, strict_map_key=False)
+
+    def default(self, obj):
+        obj_type = type(obj)
+        if obj_type is self.LabeledID:
+            return msgpack.ExtType(self.EXT_LABELED_ID, self.pack([obj.identifier, obj.label]))
+        if obj_type is self.KNode or obj_type is self.CompactKNode:
+            return msgpack.ExtType(self.EXT_KNODE, self.pack(self.pack_fields(obj, self.KNODE_FIELDS)))
+        if obj_type is self.KEdge or obj_type is self.CompactKEdge:
+            return msgpack.ExtType(self.EXT_KEDGE, self.pack(self.pack_fields(obj, self.KEDGE_FIELDS)))
+        if obj_type is tuple:
+            return msgpack.ExtType(self.EXT_TUPLE, self.pack(list(obj)))
+        if obj_type is set or obj_type is self.SynonymSet:
+            # node synonyms come back as a plain set, KNode indexes them again when it needs to
+            return msgpack.ExtType(self.EXT_SET, self.pack(list(obj)))
+        if obj_type is frozenset:
+            return msgpack.ExtType(self.EXT_FROZENSET, self.pack(list(obj)))
+        if obj_type is list or obj_type is dict:
+            # subclasses of builtins lose their class, like they would in json
+            return obj_type(obj)
+        return msgpack.ExtType(self.EXT_PICKLE, pickle.dumps(obj))
+
+    def pack_fields(self, obj, fields):
+        """ Known fields by position, followed by a dict of any other attributes. Compact nodes and edges
+        are packed, and so come back, as KNode and KEdge. """
+        attributes = obj.get_state() if hasattr(obj, 'get_state') else vars(obj)
+        extra = {key: value for key, value in attributes.items() if key not in fields}
+        return [attributes.get(field) for field in fields] + [extra]
+
+    def unpack_fields(self, cls, data, fields):
+        obj = cls.__new__(cls)
+        attributes = dict(zip(fields, data))
+        attributes.update(data[len(fields)])
+        obj.__dict__.update(attributes)
+        return obj
+
+    def ext_hook(self, code, data):
+        if code == self.EXT_LABELED_ID:
+            return self.LabeledID(*self.unpack(data))
+        if code == self.EXT_KNODE:
+            return self.unpack_fields(self.KNode, self.unpack(data), self.KNODE_FIELDS)
+        if code == self.EXT_KEDGE:
+            return self.unpack_fields(self.KEdge, self.unpack(data), self.KEDGE_FIELDS)
+        if code == self.EXT_TUPLE:
+            return tuple(self.unpack(data))
+        if code == self.EXT_SET:
+            return set(self.unpack(data))
+        if code == self.EXT_FROZENSET:
+            return frozenset(self.unpack(data))
+        if code == self.EXT_PICKLE:
+            return pickle.loads(data)
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, obj):
+        body = self.pack(obj)
+        flags = 0
+        if self.compress and len(body) >= self.compression_threshold:
+            body = self.compressor.compress(body)
+            flags |= self.FLAG_ZSTD
+        return self.MAGIC + bytes([self.VERSION, flags]) + body
+
+    def loads(self, str):
+        if not self.is_current(str):
+            return pickle.loads (str)
+        version, flags = str[2], str[3]
+        if version > self.VERSION:
+            raise ValueError(f'Cache record version {version} is newer than this serializer ({self.VERSION})')
+        body = str[4:]
+        if flags & self.FLAG_ZSTD:
+            body = self.decompressor.decompress(body)
+        return self.unpack(body)
+
+    @staticmethod
+    def is_current(record):
+        return record[:2] == MsgPackCacheSerializer.MAGIC
+
+serializers = {
+    'pickle': PickleCacheSerializer,
+    'msgpack': MsgPackCacheSerializer
+}
+
+def get_namespace(key):
+    """ The part of a cache key before its argument list: ctd.drug_to_gene for ctd.drug_to_gene(CHEBI:1),
+    annotation for annotation(CHEBI:1). """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    return key.split('(', 1)[0]
+
+def get_service(key):
+    """ The service behind a cache key, e.g. ctd for ctd.drug_to_gene(CHEBI:1) and kegg for
+    caster.upcast(kegg~enzyme_get_chemicals,chemical_substance)(CHEBI:1). """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    call = key.split(')', 1)[0]
+    if '~' in call:
+        return call.split('~')[0].split('(')[-1]
+    return get_namespace(key).split('.')[0]
+
+def scan_key_batches(redis_conn, match='*', batch_size=1000):
+    """ SCAN the keyspace, yielding lists of at most batch_size keys. Unlike KEYS this does not block redis. """
+    batch = []
+    for key in redis_conn.scan_iter(match=match, count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def unlink_keys(redis_conn, keys):
+    """ Delete keys, reclaiming their memory in the background where redis supports UNLINK. """
+    try:
+        return redis_conn.unlink(*keys)
+    except redis.exceptions.ResponseError:
+        return redis_conn.delete(*keys)
+
+def delete_matching(redis_conn, match, batch_size=1000):
+    """ Delete every key matching a pattern, batch_size keys at a time. Returns the number deleted. """
+    deleted = 0
+    for keys in scan_key_batches(redis_conn, match, batch_size):
+        deleted += unlink_keys(redis_conn, keys)
+    return deleted
+
+class TTLPolicy:
+    """ Expiry times by key namespace. A key's TTL is the first of its namespace, its service,
+    'operators' (for service.operation namespaces) and 'default' found in the policy.
+    A TTL of 0 or None means the key never expires. """
+    def __init__(self, ttls=None):
+        self.ttls = dict(ttls) if ttls else {}
+
+    @staticmethod
+    def from_config(ttl_conf):
+        """ Read TTLs from the cache.ttl section of the config, honoring environment overrides. """
+        if ttl_conf is None:
+            return TTLPolicy ()
+        keys = getattr(ttl_conf, 'conf', ttl_conf).keys()
+        return TTLPolicy ({key: int(ttl_conf[key] or 0) for key in keys})
+
+    def get_ttl(self, key):
+        namespace = get_namespace(key)
+        candidates = [namespace, get_service(key)]
+        if '.' in namespace:
+            candidates.append('operators')
+        candidates.append('default')
+        for candidate in candidates:
+            if candidate in self.ttls:
+                return self.ttls[candidate] or None
+        return None
+
+class L1Cache:
+    """ In-process least recently used cache in front of redis. Bounded by entry count and,
+    optionally, by the serialized size of the entries it holds. """
+    def __init__(self, max_entries=1000, max_bytes=None):
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __getitem__(self, key):
+        with self.lock:
+            value, size = self.entries[key]
+            self.entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, key, value, size=0):
+        """ size is the serialized size of value, used for the memory bound. """
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            # too large to hold, but the old value must not be served either
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, size = self.entries.pop(key)
+            self.bytes -= size
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+class NoL1Cache:
+    """ L1 policy that holds nothing. """
+    def __contains__(self, key):
+        return False
+
+    def __getitem__(self, key):
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        pass
+
+    def __len__(self):
+        return 0
+
+    def put(self, key, value, size=0):
+        pass
+
+    def pop(self, key, default=None):
+        return default
+
+    def clear(self):
+        pass
+
+
 class Cache:
     """ Cache objects by configurable means. """
     def __init__(self, cache_path="cache",
                  serializer=PickleCacheSerializer,
                  redis_host="localhost", redis_port=6379, redis_db=0, redis_password="",
-                 enabled=True, prefix=''):
+                 enabled=True, prefix='', l1_size=1000, l1_max_bytes=None, l1_policy='lru',
+                 serializer_options=None, ttl_policy=None):
         
-        """ Connect to cache. """
+        """ Connect to cache.
+        l1_policy is lru (an in-process cache of l1_size entries and at most l1_max_bytes
+        serialized bytes) or none. serializer_options are passed to the serializer.
+        ttl_policy is a TTLPolicy or a map of namespaces to expiry times in seconds. """
         self.enabled = enabled
         self.prefix = prefix
+        self.ttl_policy = ttl_policy if isinstance(ttl_policy, TTLPolicy) else TTLPolicy (ttl_policy)
         try:
             if redis_password:
                 self.redis = redis.StrictRedis(host=redis_host, port=int(redis_port), db=int(redis_db), password=redis_password)
@@ -53,8 +335,13 @@ class Cache:
         self.cache_path = cache_path
         if not os.path.exists (self.cache_path):
             os.makedirs (self.cache_path)
-        self.cache = LRU (1000) 
-        self.serializer = serializer ()
+        if l1_policy == 'lru':
+            self.cache = L1Cache (l1_size, l1_max_bytes)
+        elif l1_policy == 'none':
+            self.cache = NoL1Cache ()
+        else:
+            raise ValueError(f"Unknown l1 cache policy {l1_policy}")
+        self.serializer = serializer (**(serializer_options or {}))
         
     def get(self, key):
         """ Get a cached item by key. """
@@ -63,19 +350,46 @@ class Cache:
         key = self.prefix + key
         result = None
         if self.enabled:
-            if key in self.cache:
-                result = self.cache[key]
-            elif self.redis:
+            try:
+                return self.cache[key]
+            except KeyError:
+                pass
+            if self.redis:
                 rec = self.redis.get (key)
                 result = self.serializer.loads (rec) if rec is not None else None
-                self.cache[key] = result
+                self.cache.put(key, result, len(rec) if rec is not None else 0)
             else:
                 path = os.path.join (self.cache_path, key)
                 if os.path.exists (path):
                     with open(path, 'rb') as stream:
-                        result = self.serializer.loads (stream.read ())
-                        self.cache[key] = result
+                        rec = stream.read ()
+                        result = self.serializer.loads (rec)
+                        self.cache.put(key, result, len(rec))
         return result
+
+    def get_many(self, keys):
+        """ Get cached items for a list of keys, in the same order, with None for misses.
+        Keys missing from the in-process cache are fetched with a single MGET. """
+        keys = list(keys)
+        results = [None] * len(keys)
+        if not self.enabled:
+            return results
+        if not self.redis:
+            return [self.get(key) for key in keys]
+        missing = []
+        for index, key in enumerate(keys):
+            full_key = self.prefix + key
+            try:
+                results[index] = self.cache[full_key]
+            except KeyError:
+                missing.append(index)
+        if missing:
+            full_keys = [self.prefix + keys[index] for index in missing]
+            for index, full_key, rec in zip(missing, full_keys, self.redis.mget(full_keys)):
+                result = self.serializer.loads (rec) if rec is not None else None
+                self.cache.put(full_key, result, len(rec) if rec is not None else 0)
+                results[index] = result
+        return results
     
     def set(self, key, value, pipeline=None):
         """ Add an item to the cache. """
@@ -83,22 +397,44 @@ class Cache:
         if self.enabled:
             if self.redis:
                 if value is not None:
+                    rec = self.serializer.dumps(value)
+                    ttl = self.ttl_policy.get_ttl(key[len(self.prefix):])
                     if pipeline is not None:
-                        pipeline.set(key, self.serializer.dumps(value))
+                        pipeline.set(key, rec, ex=ttl)
                     else:
-                        self.redis.set (key, self.serializer.dumps (value))
-                    self.cache[key] = value
+                        self.redis.set (key, rec, ex=ttl)
+                    self.cache.put(key, value, len(rec))
             else:
                 path = os.path.join (self.cache_path, key)
+                rec = self.serializer.dumps (value)
                 with open(path, 'wb') as stream:
-                    stream.write (self.serializer.dumps (value))
-                self.cache[key] = value
+                    stream.write (rec)
+                self.cache.put(key, value, len(rec))
+
+    def set_many(self, mapping, batch_size=1000):
+        """ Add many items to the cache, pipelining the writes batch_size at a time. """
+        if not self.enabled:
+            return
+        if not self.redis:
+            for key, value in mapping.items():
+                self.set(key, value)
+            return
+        with self.redis.pipeline(transaction=False) as pipe:
+            pending = 0
+            for key, value in mapping.items():
+                self.set(key, value, pipe)
+                pending += 1
+                if pending >= batch_size:
+                    pipe.execute()
+                    pending = 0
+            if pending:
+                pipe.execute()
 
     def flush(self):
+        """ Delete this cache's keys: those under its prefix or, without a prefix, the whole db. """
+        self.cache.clear()
         if self.prefix:
-            keys = self.redis.keys(f'{self.prefix}*')
-            if keys:
-                self.redis.delete(*keys)
+            delete_matching(self.redis, f'{self.prefix}*')
         else:
             self.redis.flushdb()
 
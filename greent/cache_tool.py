@@ -0,0 +1,235 @@
+import argparse
+import logging
+import os
+import pickle
+from collections import defaultdict
+import redis
+from greent.cache import MsgPackCacheSerializer, TTLPolicy, get_namespace, get_service, scan_key_batches, unlink_keys
+from greent.config import Config
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+
+def migrate(redis_conn, serializer, match='*', batch_size=1000, dry_run=False):
+    """ Rewrite legacy pickled values with serializer, keeping each key's TTL.
+    Returns stats per namespace: keys seen, keys migrated, errors and bytes before/after. """
+    stats = defaultdict(lambda: {'keys': 0, 'migrated': 0, 'errors': 0, 'bytes_before': 0, 'bytes_after': 0})
+    for keys in scan_key_batches(redis_conn, match, batch_size):
+        values = redis_conn.mget(keys)
+        rewrites = []
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            namespace_stats = stats[get_namespace(key)]
+            namespace_stats['keys'] += 1
+            namespace_stats['bytes_before'] += len(value)
+            if MsgPackCacheSerializer.is_current(value):
+                namespace_stats['bytes_after'] += len(value)
+                continue
+            try:
+                record = serializer.dumps(pickle.loads(value))
+            except Exception as e:
+                logger.warning(f'Could not migrate {key}: {e}')
+                namespace_stats['errors'] += 1
+                namespace_stats['bytes_after'] += len(value)
+                continue
+            namespace_stats['migrated'] += 1
+            namespace_stats['bytes_after'] += len(record)
+            rewrites.append((key, record))
+        if dry_run or not rewrites:
+            continue
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for key, record in rewrites:
+                pipe.pttl(key)
+            ttls = pipe.execute()
+            for (key, record), ttl in zip(rewrites, ttls):
+                if ttl is not None and ttl > 0:
+                    pipe.set(key, record, px=ttl)
+                else:
+                    pipe.set(key, record)
+            pipe.execute()
+    return dict(stats)
+
+
+def print_migration_report(stats):
+    print(f"{'namespace':<60} {'keys':>10} {'migrated':>10} {'errors':>8} {'before':>14} {'after':>14} {'saved':>7}")
+    totals = defaultdict(int)
+    for namespace, row in sorted(stats.items(), key=lambda item: item[1]['bytes_before'] - item[1]['bytes_after'], reverse=True):
+        for field, value in row.items():
+            totals[field] += value
+        print_migration_row(namespace, row)
+    print_migration_row('TOTAL', totals)
+
+
+def print_migration_row(namespace, row):
+    saved = row['bytes_before'] - row['bytes_after']
+    percent = 100 * saved / row['bytes_before'] if row['bytes_before'] else 0
+    print(f"{namespace[:60]:<60} {row['keys']:>10} {row['migrated']:>10} {row['errors']:>8} "
+          f"{row['bytes_before']:>14} {row['bytes_after']:>14} {percent:>6.1f}%")
+
+
+def measure(redis_conn, keys):
+    """ Memory used by each key, from MEMORY USAGE or, on redis older than 4, the value length. """
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.memory_usage(key)
+        try:
+            return pipe.execute()
+        except redis.exceptions.ResponseError:
+            pass
+        for key in keys:
+            pipe.strlen(key)
+        return pipe.execute()
+
+
+def collect_stats(redis_conn, match='*', batch_size=1000, group_by=get_namespace):
+    """ Key count, bytes and keys without expiry per group (namespace or service). """
+    stats = defaultdict(lambda: {'keys': 0, 'bytes': 0, 'persistent': 0})
+    for keys in scan_key_batches(redis_conn, match, batch_size):
+        sizes = measure(redis_conn, keys)
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+            ttls = pipe.execute()
+        for key, size, ttl in zip(keys, sizes, ttls):
+            if size is None:
+                continue
+            group_stats = stats[group_by(key)]
+            group_stats['keys'] += 1
+            group_stats['bytes'] += size
+            if ttl == -1:
+                group_stats['persistent'] += 1
+    return dict(stats)
+
+
+def print_stats_report(stats, top=None):
+    print(f"{'group':<60} {'keys':>10} {'bytes':>14} {'no expiry':>10}")
+    rows = sorted(stats.items(), key=lambda item: item[1]['bytes'], reverse=True)
+    for group, row in rows[:top]:
+        print(f"{group[:60]:<60} {row['keys']:>10} {row['bytes']:>14} {row['persistent']:>10}")
+    print(f"{'TOTAL':<60} {sum(row['keys'] for _, row in rows):>10} {sum(row['bytes'] for _, row in rows):>14} "
+          f"{sum(row['persistent'] for _, row in rows):>10}")
+
+
+def evict(redis_conn, namespaces=(), services=(), match='*', batch_size=1000, dry_run=False):
+    """ Delete keys matching match whose namespace is in namespaces or whose service is in services
+    (any key when neither is given). Returns the number of keys deleted per namespace. """
+    deleted = defaultdict(int)
+    namespaces, services = set(namespaces), set(services)
+    for keys in scan_key_batches(redis_conn, match, batch_size):
+        doomed = [key for key in keys
+                  if (not namespaces and not services)
+                  or get_namespace(key) in namespaces
+                  or get_service(key) in services]
+        for key in doomed:
+            deleted[get_namespace(key)] += 1
+        if doomed and not dry_run:
+            unlink_keys(redis_conn, doomed)
+    return dict(deleted)
+
+
+def expire(redis_conn, ttl_policy, match='*', batch_size=1000, dry_run=False):
+    """ Apply ttl_policy to keys that have no expiry, e.g. ones written before the policy
+    existed or by bulk loaders that write to redis directly. Returns keys expired per namespace. """
+    expired = defaultdict(int)
+    for keys in scan_key_batches(redis_conn, match, batch_size):
+        with redis_conn.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.ttl(key)
+            ttls = pipe.execute()
+            for key, ttl in zip(keys, ttls):
+                policy_ttl = ttl_policy.get_ttl(key)
+                if ttl != -1 or policy_ttl is None:
+                    continue
+                expired[get_namespace(key)] += 1
+                if not dry_run:
+                    pipe.expire(key, policy_ttl)
+            pipe.execute()
+    return dict(expired)
+
+
+def print_counts(counts, label):
+    for namespace, count in sorted(counts.items(), key=lambda item: item[1], reverse=True):
+        print(f"{namespace[:60]:<60} {count:>10}")
+    print(f"{label} {sum(counts.values())} keys")
+
+
+def connect(args):
+    if args.password:
+        return redis.StrictRedis(host=args.host, port=int(args.port), db=int(args.db), password=args.password)
+    return redis.StrictRedis(host=args.host, port=int(args.port), db=int(args.db))
+
+
+def run_migrate(args):
+    serializer = MsgPackCacheSerializer(compress=not args.no_compress, compression_level=args.compression_level)
+    stats = migrate(connect(args), serializer, match=args.match, batch_size=args.batch_size, dry_run=args.dry_run)
+    print_migration_report(stats)
+
+
+def run_stats(args):
+    group_by = get_service if args.by == 'service' else get_namespace
+    print_stats_report(collect_stats(connect(args), match=args.match, batch_size=args.batch_size, group_by=group_by), args.top)
+
+
+def run_evict(args):
+    if not (args.namespace or args.service or args.match != '*'):
+        raise SystemExit('Refusing to evict everything, give --namespace, --service or --match.')
+    deleted = evict(connect(args), args.namespace, args.service, match=args.match,
+                    batch_size=args.batch_size, dry_run=args.dry_run)
+    print_counts(deleted, 'Would delete' if args.dry_run else 'Deleted')
+
+
+def run_expire(args):
+    ttl_policy = TTLPolicy.from_config(args.cache_conf.get('ttl'))
+    expired = expire(connect(args), ttl_policy, match=args.match, batch_size=args.batch_size, dry_run=args.dry_run)
+    print_counts(expired, 'Would expire' if args.dry_run else 'Expired')
+
+
+def parse_args(argv=None):
+    cache_conf = Config(os.path.join(os.path.dirname(__file__), 'greent.conf'))['cache']
+    parser = argparse.ArgumentParser(description='Inspect and maintain the redis result cache.')
+    parser.add_argument('--host', default=cache_conf.get('host'))
+    parser.add_argument('--port', default=cache_conf.get('port'))
+    parser.add_argument('--db', default=cache_conf.get('db'))
+    parser.add_argument('--password', default=cache_conf.get('password'))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    migrate_parser = subparsers.add_parser('migrate', help='Rewrite pickled values in the compact msgpack format')
+    migrate_parser.add_argument('--match', default='*', help='Only migrate keys matching this pattern')
+    migrate_parser.add_argument('--batch-size', type=int, default=1000)
+    migrate_parser.add_argument('--no-compress', action='store_true', help='Do not zstd compress large values')
+    migrate_parser.add_argument('--compression-level', type=int, default=int(cache_conf.get('compression_level', 3)))
+    migrate_parser.add_argument('--dry-run', action='store_true', help='Report the savings without writing')
+    migrate_parser.set_defaults(func=run_migrate)
+
+    stats_parser = subparsers.add_parser('stats', help='Report key counts and memory per namespace or service')
+    stats_parser.add_argument('--match', default='*', help='Only count keys matching this pattern')
+    stats_parser.add_argument('--by', choices=['namespace', 'service'], default='namespace')
+    stats_parser.add_argument('--top', type=int, default=None, help='Only show the largest groups')
+    stats_parser.add_argument('--batch-size', type=int, default=1000)
+    stats_parser.set_defaults(func=run_stats)
+
+    evict_parser = subparsers.add_parser('evict', help='Delete keys by namespace, service or pattern')
+    evict_parser.add_argument('--namespace', action='append', default=[], help='e.g. ctd.drug_to_gene or annotation')
+    evict_parser.add_argument('--service', action='append', default=[], help='e.g. ctd')
+    evict_parser.add_argument('--match', default='*', help='Only consider keys matching this pattern')
+    evict_parser.add_argument('--batch-size', type=int, default=1000)
+    evict_parser.add_argument('--dry-run', action='store_true', help='Count the keys without deleting them')
+    evict_parser.set_defaults(func=run_evict)
+
+    expire_parser = subparsers.add_parser('expire', help='Apply the configured TTLs to keys without an expiry')
+    expire_parser.add_argument('--match', default='*', help='Only consider keys matching this pattern')
+    expire_parser.add_argument('--batch-size', type=int, default=1000)
+    expire_parser.add_argument('--dry-run', action='store_true', help='Count the keys without changing them')
+    expire_parser.set_defaults(func=run_expire)
+
+    args = parser.parse_args(argv)
+    args.cache_conf = cache_conf
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    args.func(args)
@@ -1,5 +1,4 @@
 import re
-import requests
 from greent.service import Service
 from greent.cache import Cache
 
@@ -15,7 +14,7 @@ class CachedService(Service):
         if not obj:
             if url.endswith('/'):
                 url = url[:-1]
-            rv = requests.get(url)
+            rv = self.http_get(url)
             if rv.status_code == 200:
                 obj = rv.json()
                 self.context.cache.set(key, obj)
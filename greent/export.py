@@ -4,12 +4,66 @@ from collections import defaultdict, deque
 from greent.export_type_graph import ExportGraph
 from greent.synonymization import Synonymizer
 from greent.graph_components import LabeledID
+from greent.annotators.annotator_factory import annotate_nodes
 import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 
 logger = LoggingUtil.init_logging(__name__, logging.DEBUG)
 
 
+class AdaptiveBatchSize:
+    """A batch size that tunes itself from observed transaction latency. Full batches that commit well
+    under target_latency grow the size by half; batches slower than target_latency halve it. The size
+    stays within [minimum, maximum].
+
+    A flush split into several transactions (one per node type or predicate) is judged as one batch:
+    each transaction reports the total of its flush and whether the flush was full, its latency is
+    scaled up to the whole flush, and it moves the size by its share of a step."""
+
+    def __init__(self, size=1000, minimum=100, maximum=10000, target_latency=2.0, adaptive=True):
+        self.minimum = int(minimum)
+        self.maximum = int(maximum)
+        self.size = min(max(int(size), self.minimum), self.maximum)
+        self.target_latency = float(target_latency)
+        self.adaptive = adaptive
+        self.lock = threading.Lock()
+
+    def observe(self, latency, count, total=None, full=None):
+        if not self.adaptive or not count:
+            return
+        share = count / max(total or count, count)
+        latency = latency / share
+        with self.lock:
+            if full is None:
+                full = count >= self.size
+            step = math.ceil(self.size // 2 * share)
+            if latency > self.target_latency:
+                self.size = max(self.minimum, self.size - step)
+            elif latency < self.target_latency / 2 and full:
+                self.size = min(self.maximum, self.size + step)
+
+
+def estimate_node_bytes(node):
+    """Rough size of a node in a neo4j UNWIND payload."""
+    size = 64 + len(node.id) + len(node.name or '') + 32 * len(node.synonyms)
+    for key, value in node.properties.items():
+        size += len(key) + len(str(value))
+    return size
+
+
+def estimate_edge_bytes(edge):
+    """Rough size of an edge in a neo4j UNWIND payload."""
+    size = 128 + len(edge.source_id) + len(edge.target_id) + 16 * len(edge.publications or [])
+    for key, value in (edge.properties or {}).items():
+        size += len(key) + len(str(value))
+    return size
+
+
 class BufferedWriter:
     """Buffered writer accepts individual nodes and edges to write to neo4j.
     It doesn't write the node/edge if it has already been written in its lifetime (it maintains a record)
@@ -22,6 +76,11 @@ class BufferedWriter:
         ...
 
     Doing this as a context manager will make sure that the different queues all get flushed out.
+
+    Nodes and edges are flushed separately, each when its queue reaches the current batch size,
+    max_bytes of estimated payload, or max_age seconds since its oldest entry. Batch sizes adapt to
+    transaction latency (see AdaptiveBatchSize). Pending nodes are always flushed before edges so
+    edges never reach neo4j before their endpoints. All of this is set in the writer section of the config.
     """
 
     def __init__(self, rosetta):
@@ -31,9 +90,26 @@ class BufferedWriter:
         self.written_edges = defaultdict(lambda: defaultdict( set ) )
         self.node_queues = defaultdict(dict)
         self.edge_queues = []
-        self.node_buffer_size = 100
-        self.edge_buffer_size = 100
-        self.driver = self.rosetta.type_graph.driver
+        writer_conf = rosetta.service_context.config.get('writer')
+        if writer_conf is None:
+            writer_conf = {}
+        adaptive = str(writer_conf.get('adaptive', True)).lower() != 'false'
+        batch_settings = {
+            'minimum': writer_conf.get('min_batch_size', 100),
+            'maximum': writer_conf.get('max_batch_size', 10000),
+            'target_latency': writer_conf.get('target_latency', 2.0),
+            'adaptive': adaptive
+        }
+        self.node_batch = AdaptiveBatchSize(writer_conf.get('node_batch_size', 1000), **batch_settings)
+        self.edge_batch = AdaptiveBatchSize(writer_conf.get('edge_batch_size', 1000), **batch_settings)
+        self.max_age = float(writer_conf.get('max_age', 30))
+        self.max_bytes = int(writer_conf.get('max_bytes', 8388608))
+        self.pending_nodes = 0
+        self.pending_node_bytes = 0
+        self.pending_edge_bytes = 0
+        self.nodes_pending_since = None
+        self.edges_pending_since = None
+        self.driver = self.create_driver()
         self.maxWrittenNodes = 100000
         self.maxWrittenEdges = 100000
         self.missed_curies = {}
@@ -42,20 +118,33 @@ class BufferedWriter:
         self.normalized = False
         # temporary cache of ids , this will be kept around till we hit maxWrittenNodes
         self.synonym_map = {}
+        self.nodes_to_annotate = []
+
+    def create_driver(self):
+        return self.rosetta.type_graph.driver
 
     def __enter__(self):
         return self
 
-    def write_node(self,node):
+    def write_node(self,node, annotate=False):
         if node.id in self.written_nodes:
             return
         if node.name is None or node.name == '':
             logger.warning(f"Node {node.id} is missing a label")
         self.written_nodes.add(node.id)
+        if annotate:
+            # annotated with the rest of the batch when the nodes are flushed
+            self.nodes_to_annotate.append(node)
         typednodes = self.node_queues[frozenset(node.export_labels)]
         typednodes.update({node.id: node})
-        if len(typednodes) >= self.node_buffer_size:
-            self.flush()
+        if self.nodes_pending_since is None:
+            self.nodes_pending_since = time.monotonic()
+        self.pending_nodes += 1
+        self.pending_node_bytes += estimate_node_bytes(node)
+        if self.nodes_due():
+            self.flush_pending_nodes()
+        elif self.edges_due():
+            self.flush_pending_edges()
 
     def write_edge(self,edge, force_create=False):
         if edge.original_predicate.identifier in self.written_edges[edge.source_id][edge.target_id] and not force_create:
@@ -66,10 +155,63 @@ class BufferedWriter:
         self.written_edges[edge.source_id][edge.target_id].add(edge.original_predicate.identifier)
         # Append the edge in the edge queue. It will be standardized in a batch when flushing
         self.edge_queues.append(edge)
-        if len(self.edge_queues) >= self.edge_buffer_size:
-            self.flush()
+        if self.edges_pending_since is None:
+            self.edges_pending_since = time.monotonic()
+        self.pending_edge_bytes += estimate_edge_bytes(edge)
+        if self.edges_due():
+            self.flush_pending_edges()
+        elif self.nodes_due():
+            self.flush_pending_nodes()
+
+    def nodes_due(self):
+        if not self.pending_nodes:
+            return False
+        return self.pending_nodes >= self.node_batch.size \
+            or self.pending_node_bytes >= self.max_bytes \
+            or time.monotonic() - self.nodes_pending_since >= self.max_age
+
+    def edges_due(self):
+        if not self.edge_queues:
+            return False
+        return len(self.edge_queues) >= self.edge_batch.size \
+            or self.pending_edge_bytes >= self.max_bytes \
+            or time.monotonic() - self.edges_pending_since >= self.max_age
+
+    def flush_pending_nodes(self):
+        with self.driver.session() as session:
+            self.flush_nodes(session)
+        self.trim_written()
+
+    def flush_pending_edges(self):
+        with self.driver.session() as session:
+            # the endpoints have to exist before the edges are matched to them
+            if self.pending_nodes:
+                self.flush_nodes(session)
+            self.flush_edges(session)
+        self.trim_written()
+
+    def run_transaction(self, session, batch_size, export_function, items, *args, total=None, full=None):
+        """Run an export transaction and feed its latency back to the batch size. total and full describe the
+        flush the transaction is part of (see AdaptiveBatchSize.observe)."""
+        start = time.monotonic()
+        session.write_transaction(export_function, items, *args)
+        batch_size.observe(time.monotonic() - start, len(items), total, full)
+
+    def annotate_pending_nodes(self):
+        """Annotate the queued nodes written with annotate=True, all in one batch."""
+        if not self.nodes_to_annotate:
+            return
+        nodes, self.nodes_to_annotate = self.nodes_to_annotate, []
+        try:
+            annotate_nodes(nodes, self.rosetta)
+        except Exception as e:
+            logger.error(f'Annotating {len(nodes)} nodes failed: {e}')
 
     def flush_nodes(self, session):
+        self.annotate_pending_nodes()
+        # the transactions of this flush are judged together
+        total = sum(len(node_queue) for node_queue in self.node_queues.values())
+        full = total >= self.node_batch.size
         for node_type in self.node_queues:
             # Condition # 1. Handling nodes that could not be synonymized.
             # This could happen among other reasons,
@@ -101,10 +243,14 @@ class BufferedWriter:
             if missed_nodes:
                 for missed_node_id in missed_nodes:
                     self.synonym_map.update({missed_node_id: missed_node_id})
-                session.write_transaction(
+                self.run_transaction(
+                    session,
+                    self.node_batch,
                     export_node_chunk,
                     missed_nodes,
-                    node_type
+                    node_type,
+                    total=total,
+                    full=full
                 )
             # Condition # 2
             # bucket out  normalized node into chunks by their type and do something similar
@@ -122,12 +268,19 @@ class BufferedWriter:
                 typed_nodes.update({curie: normalized_node})
                 by_type[types] = typed_nodes
             for n_type in by_type:
-                session.write_transaction(
+                self.run_transaction(
+                    session,
+                    self.node_batch,
                     export_node_chunk,
                     by_type[n_type],
-                    n_type
+                    n_type,
+                    total=total,
+                    full=full
                 )
             self.node_queues[node_type] = {}
+        self.pending_nodes = 0
+        self.pending_node_bytes = 0
+        self.nodes_pending_since = None
 
     def flush_edges(self, session):
         # batch normalize edges
@@ -168,9 +321,14 @@ class BufferedWriter:
                 edge_by_predicate_id[predicate_id] = []
             edge_by_predicate_id[predicate_id].append(edge)
 
+        total = len(self.edge_queues)
+        full = total >= self.edge_batch.size
         for predicate_id in edge_by_predicate_id:
-            session.write_transaction(export_edge_chunk, edge_by_predicate_id[predicate_id], predicate_id, self.merge_edges)
+            self.run_transaction(session, self.edge_batch, export_edge_chunk, edge_by_predicate_id[predicate_id], predicate_id,
+                                 self.merge_edges, total=total, full=full)
         self.edge_queues = []
+        self.pending_edge_bytes = 0
+        self.edges_pending_since = None
 
     def flush(self):
         with self.driver.session() as session:
@@ -179,15 +337,17 @@ class BufferedWriter:
 
             # flush edges
             self.flush_edges(session)
+        self.trim_written()
 
-            # clear the memory on a threshold boundary to avoid using up all memory when
-            # processing large data sets
-            if len(self.written_nodes) > self.maxWrittenNodes:
-                self.synonym_map = {}
-                self.written_nodes.clear()
+    def trim_written(self):
+        # clear the memory on a threshold boundary to avoid using up all memory when
+        # processing large data sets
+        if len(self.written_nodes) > self.maxWrittenNodes:
+            self.synonym_map = {}
+            self.written_nodes.clear()
 
-            if len(self.written_edges) > self.maxWrittenEdges:
-                self.written_edges.clear()
+        if len(self.written_edges) > self.maxWrittenEdges:
+            self.written_edges.clear()
 
     def write_missed_curies_to_file(self):
         """ When node normalization is not working write the missed curies to file."""
@@ -198,8 +358,155 @@ class BufferedWriter:
                 f.write(f'{curie}\t {",".join(self.missed_curies[curie])}\n')
         self.missed_curies = {}
 
+    def close(self):
+        pass
+
     def __exit__(self,*args):
-        self.flush()
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+
+class PipelinedBufferedWriter(BufferedWriter):
+    """A BufferedWriter that never makes its producers wait on normalization or neo4j.
+
+    write_node and write_edge put onto a bounded queue (blocking when it is full, which is the
+    backpressure). A background thread takes from the queue and does the batching and batch
+    normalization of BufferedWriter. The resulting export_node_chunk and export_edge_chunk
+    transactions run on a pool of transaction_workers threads, so the chunks of different labels
+    and predicates are written concurrently. Edge transactions wait for every node transaction
+    submitted before them, so edges still never reach neo4j before their endpoints.
+
+    flush() returns once everything written before it is in neo4j. Errors raised in the background
+    are re-raised by the next write, flush or close. Use it as a context manager, or call close().
+    """
+
+    def __init__(self, rosetta):
+        super().__init__(rosetta)
+        writer_conf = rosetta.service_context.config.get('writer')
+        if writer_conf is None:
+            writer_conf = {}
+        transaction_workers = int(writer_conf.get('transaction_workers', 4))
+        self.queue = queue.Queue(maxsize=int(writer_conf.get('queue_size', 10000)))
+        self.executor = ThreadPoolExecutor(max_workers=transaction_workers)
+        # bounds the transactions waiting on the pool, so normalization can't run far ahead of neo4j
+        self.in_flight = threading.BoundedSemaphore(2 * transaction_workers)
+        self.node_futures = []
+        self.edge_futures = []
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='BufferedWriter', daemon=True)
+        self.thread.start()
+
+    def write_node(self, node, annotate=False):
+        self.put(('node', node, annotate))
+
+    def write_edge(self, edge, force_create=False):
+        self.put(('edge', edge, force_create))
+
+    def flush(self):
+        done = threading.Event()
+        self.put(('flush', done))
+        done.wait()
+        self.raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.raise_error()
+
+    def put(self, item):
+        self.raise_error()
+        if self.closed:
+            raise RuntimeError('BufferedWriter is closed')
+        self.queue.put(item)
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        """The normalization stage: batch what comes off the queue and hand transactions to the pool."""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.drain()
+                return
+            try:
+                if item[0] == 'node':
+                    BufferedWriter.write_node(self, item[1], item[2])
+                elif item[0] == 'edge':
+                    BufferedWriter.write_edge(self, item[1], item[2])
+                else:
+                    BufferedWriter.flush(self)
+                    self.wait_for(self.node_futures)
+                    self.wait_for(self.edge_futures)
+            except Exception as e:
+                logger.error(f'Background write failed: {e}')
+                self.error = e
+            finally:
+                if item[0] == 'flush':
+                    item[1].set()
+
+    def drain(self):
+        try:
+            BufferedWriter.flush(self)
+            self.wait_for(self.node_futures)
+            self.wait_for(self.edge_futures)
+        except Exception as e:
+            logger.error(f'Background write failed: {e}')
+            self.error = e
+
+    def wait_for(self, futures):
+        """Wait for every one of futures, then raise the first failure."""
+        pending = list(futures)
+        futures.clear()
+        wait(pending)
+        for future in pending:
+            future.result()
+
+    def flush_edges(self, session):
+        if self.edge_queues:
+            self.wait_for(self.node_futures)
+        super().flush_edges(session)
+
+    def run_transaction(self, session, batch_size, export_function, items, *args, total=None, full=None):
+        """Queue the transaction on the pool, each worker with its own session."""
+        self.in_flight.acquire()
+        try:
+            future = self.executor.submit(self.run_pooled_transaction, batch_size, export_function, items, *args,
+                                          total=total, full=full)
+        except Exception:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda f: self.in_flight.release())
+        futures = self.edge_futures if export_function is export_edge_chunk else self.node_futures
+        # forget transactions that have already succeeded
+        futures[:] = [f for f in futures if not f.done() or f.exception() is not None]
+        futures.append(future)
+
+    def run_pooled_transaction(self, batch_size, export_function, items, *args, total=None, full=None):
+        with self.driver.session() as session:
+            BufferedWriter.run_transaction(self, session, batch_size, export_function, items, *args, total=total, full=full)
+
+
+def create_writer(rosetta):
+    """The writer selected by writer.backend (neo4j or bulk_import) and writer.pipelined in the config."""
+    writer_conf = rosetta.service_context.config.get('writer')
+    if writer_conf is None:
+        return BufferedWriter(rosetta)
+    if writer_conf.get('backend', 'neo4j') == 'bulk_import':
+        from greent.bulk_export import BulkImportWriter
+        return BulkImportWriter(rosetta)
+    if str(writer_conf.get('pipelined', False)).lower() == 'true':
+        return PipelinedBufferedWriter(rosetta)
+    return BufferedWriter(rosetta)
 
 
 def sort_edges_by_label(edges):
@@ -251,19 +558,7 @@ def export_edge_chunk(tx,edgelist,edgelabel, merge_edges):
                 SET r += row.properties
                 """
 
-    batch = [ {'source_id': edge.source_id,
-               'target_id': edge.target_id,
-               'provided_by': edge.provided_by,
-               'database': edge.provided_by.split('.')[0],
-               'ctime': edge.ctime,
-               'standard_id': edge.standard_predicate.identifier,
-               'original_predicate_id': edge.original_predicate.identifier,
-               'original_predicate_label': edge.original_predicate.label,
-               'publication_count': len(edge.publications),
-               'publications': edge.publications[:1000],
-               'properties': edge.properties if edge.properties != None else {}
-               }
-              for edge in edgelist]
+    batch = [edge_to_row(edge) for edge in edgelist]
 
     tx.run(cypher,{'batches': batch})
 
@@ -271,6 +566,21 @@ def export_edge_chunk(tx,edgelist,edgelabel, merge_edges):
         if edge.standard_predicate.identifier == 'GAMMA:0':
             logger.warn(f"Unable to map predicate for edge {edge.original_predicate}  {edge}")
 
+def edge_to_row(edge):
+    """The parameters export_edge_chunk sends for an edge."""
+    return {'source_id': edge.source_id,
+            'target_id': edge.target_id,
+            'provided_by': edge.provided_by,
+            'database': edge.provided_by.split('.')[0],
+            'ctime': edge.ctime,
+            'standard_id': edge.standard_predicate.identifier,
+            'original_predicate_id': edge.original_predicate.identifier,
+            'original_predicate_label': edge.original_predicate.label,
+            'publication_count': len(edge.publications),
+            'publications': edge.publications[:1000],
+            'properties': edge.properties if edge.properties != None else {}
+            }
+
 def sort_nodes_by_label(nodes):
     nl = defaultdict(list)
     deque( map( lambda x: nl[x.type].append(x), nodes ) )
@@ -284,13 +594,14 @@ def export_node_chunk(tx,nodelist,labels):
         cypher += f"set a:`{label}`\n"
     cypher += """set a += batch.properties\n"""
 
-    batch = []
-    for node_id in nodelist:
-        n = nodelist[node_id]
-        n.properties['equivalent_identifiers'] = [s.identifier for s in n.synonyms]
-        n.properties['category'] = list(labels)
-        if n.name is not None:
-            n.properties['name'] = n.name
-        nodeout = {'id': n.id, 'properties': n.properties}
-        batch.append(nodeout)
+    batch = [node_to_row(nodelist[node_id], labels) for node_id in nodelist]
     tx.run(cypher,{'batches': batch})
+
+
+def node_to_row(n, labels):
+    """The parameters export_node_chunk sends for a node. Like the export, this updates the node's properties."""
+    n.properties['equivalent_identifiers'] = [s.identifier for s in n.synonyms]
+    n.properties['category'] = list(labels)
+    if n.name is not None:
+        n.properties['name'] = n.name
+    return {'id': n.id, 'properties': n.properties}
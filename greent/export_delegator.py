@@ -5,7 +5,7 @@ import pika
 import logging
 import requests
 from greent.util import LoggingUtil
-from greent.export import BufferedWriter
+from greent.export import create_writer
 from greent.annotators.annotator_factory import annotate_shortcut
 import traceback
 
@@ -30,7 +30,12 @@ class WriterDelegator:
             self.connection = None
             self.channel = None
         
-        self.buffered_writer = BufferedWriter(rosetta)
+        self.buffered_writer = create_writer(rosetta)
+        writer_conf = rosetta.service_context.config.get('writer')
+        if writer_conf is None:
+            writer_conf = {}
+        # leave annotation to the writer, which does a whole batch of nodes when it flushes them
+        self.batch_annotation = str(writer_conf.get('batch_annotation', True)).lower() == 'true'
 
     @property
     def normalized(self, normalized):
@@ -50,9 +55,11 @@ class WriterDelegator:
     def __del__(self):
         if self.connection is not None:
             self.connection.close()
+        self.buffered_writer.close()
 
     def __exit__(self,*args):
         self.flush()
+        self.buffered_writer.close()
 
     def write_node(self, node, synonymize=False, annotate=True):
         # check if node has already hit writer
@@ -61,7 +68,8 @@ class WriterDelegator:
             return
         if synonymize:
             self.synonymizer.synonymize(node)
-        if annotate:
+        batch_annotate = annotate and self.batch_annotation and self.channel is None
+        if annotate and not batch_annotate:
             try:
                 result = annotate_shortcut(node, self.rosetta)
                 #if type(result) == type(None):
@@ -75,7 +83,7 @@ class WriterDelegator:
                 routing_key='neo4j',
                 body=pickle.dumps({'nodes': [node], 'edges': []}))
         else:
-            self.buffered_writer.write_node(node)
+            self.buffered_writer.write_node(node, annotate=batch_annotate)
             
     def write_edge(self, edge, force_create=False):
         if self.channel is not None:
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import numpy
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+# the index arrays, each a .npy file that is memory mapped
+INDEX_ARRAYS = ['ids', 'starts', 'ends', 'max_ends']
+# chromosome name to [first, last + 1] row, and the source the index was built from.
+# written last so a complete index has one
+CHROMOSOMES_FILE = 'chromosomes.json'
+
+
+class GeneIntervalIndex:
+    """ Gene locations, for finding the genes that overlap many regions at once.
+
+    Genes are sorted by chromosome and start. For each row, max_ends holds the largest end of the
+    genes of its chromosome up to and including it, which makes it sorted too: the genes that can
+    overlap a region [start, end] are those from the first row whose max_end reaches start to the
+    last row that starts by end, and two searchsorted calls find those rows for every region of a
+    chromosome at once.
+
+    An index is a directory of .npy files (see write_gene_index) that load memory maps, so every
+    process that opens it shares one copy of the pages. """
+
+    def __init__(self, chromosomes, ids, starts, ends, max_ends):
+        self.chromosomes = chromosomes
+        self.ids = ids
+        self.starts = starts
+        self.ends = ends
+        self.max_ends = max_ends
+
+    @staticmethod
+    def load(directory, source=None, mmap_mode='r'):
+        """ The index in directory, None if there is no complete index there or, when source is given,
+        if it was built from a different source (see write_gene_index). """
+        try:
+            with open(os.path.join(directory, CHROMOSOMES_FILE)) as stream:
+                contents = json.load(stream)
+        except FileNotFoundError:
+            return None
+        if 'chromosomes' not in contents or (source is not None and contents['source'] != source):
+            logger.info(f'The gene index in {directory} is out of date')
+            return None
+        return GeneIntervalIndex(contents['chromosomes'], *[numpy.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                                                for name in INDEX_ARRAYS])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def find_overlaps(self, chromosome, starts, ends):
+        """ The (region, row) pairs of the genes on chromosome that overlap the regions [starts[i], ends[i]],
+        ends included, as two arrays. """
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+        if chromosome not in self.chromosomes or not len(starts):
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        first, last = self.chromosomes[chromosome]
+        lows = first + numpy.searchsorted(self.max_ends[first: last], starts, side='left')
+        highs = first + numpy.searchsorted(self.starts[first: last], ends, side='right')
+        counts = numpy.maximum(highs - lows, 0)
+        regions = numpy.repeat(numpy.arange(len(starts)), counts)
+        # the candidate rows of each region, lows[i] up to highs[i]
+        rows = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(lows, counts)
+        overlapping = self.ends[rows] >= starts[regions]
+        return regions[overlapping], rows[overlapping]
+
+    def get_nearby_genes(self, locations, flanking_region_size):
+        """ For each (chromosome, start, end) location, a list of (gene id, gene start, gene end, distance)
+        for the genes within flanking_region_size of it. A gene that starts after the location is as far as its
+        start, one that ends before the location's end as far as its end, and any other gene 0. """
+        nearby_genes = [[] for _ in locations]
+        by_chromosome = {}
+        for position, (chromosome, start, end) in enumerate(locations):
+            by_chromosome.setdefault(chromosome, []).append((position, start, end))
+        for chromosome, chromosome_locations in by_chromosome.items():
+            positions, starts, ends = (numpy.array(column, dtype=numpy.int64) for column in zip(*chromosome_locations))
+            regions, rows = self.find_overlaps(chromosome, numpy.maximum(starts - flanking_region_size, 0),
+                                               ends + flanking_region_size)
+            gene_starts = self.starts[rows]
+            gene_ends = self.ends[rows]
+            region_starts = starts[regions]
+            region_ends = ends[regions]
+            distances = numpy.where(region_starts < gene_starts, gene_starts - region_starts,
+                                    numpy.maximum(region_ends - gene_ends, 0))
+            for position, gene_id, gene_start, gene_end, distance in zip(positions[regions].tolist(), self.ids[rows].tolist(),
+                                                                         gene_starts.tolist(), gene_ends.tolist(),
+                                                                         distances.tolist()):
+                nearby_genes[position].append((gene_id.decode('utf-8'), gene_start, gene_end, distance))
+        return nearby_genes
+
+
+def write_gene_index(directory, genes, source=None):
+    """ Write an index of (gene id, chromosome, start, end) rows to directory. Each file is written under a
+    temporary name and renamed, the chromosomes file last, so processes can build and load the same index.
+    source is a JSON list or value that identifies what the genes were read from, for load to check. """
+    os.makedirs(directory, exist_ok=True)
+    genes = sorted(genes, key=lambda gene: (str(gene[1]), gene[2], gene[3]))
+    ids = numpy.array([gene[0].encode('utf-8') for gene in genes], dtype=bytes)
+    starts = numpy.array([gene[2] for gene in genes], dtype=numpy.int64)
+    ends = numpy.array([gene[3] for gene in genes], dtype=numpy.int64)
+    max_ends = ends.copy()
+    chromosomes = {}
+    for row, gene in enumerate(genes):
+        chromosome = str(gene[1])
+        if chromosome in chromosomes:
+            chromosomes[chromosome][1] = row + 1
+            max_ends[row] = max(max_ends[row - 1], ends[row])
+        else:
+            chromosomes[chromosome] = [row, row + 1]
+    suffix = f'{os.getpid()}.tmp'
+    for name, array in zip(INDEX_ARRAYS, [ids, starts, ends, max_ends]):
+        path = os.path.join(directory, f'{name}.npy')
+        with open(f'{path}.{suffix}', 'wb') as stream:
+            numpy.save(stream, array)
+        os.replace(f'{path}.{suffix}', path)
+    path = os.path.join(directory, CHROMOSOMES_FILE)
+    with open(f'{path}.{suffix}', 'w') as stream:
+        json.dump({'source': source, 'chromosomes': chromosomes}, stream)
+    os.replace(f'{path}.{suffix}', path)
+    logger.info(f'Wrote a gene index of {len(genes)} genes on {len(chromosomes)} chromosomes to {directory}')
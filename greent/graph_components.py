@@ -1,15 +1,102 @@
 from collections import defaultdict
-from functools import singledispatch
+from functools import singledispatch, lru_cache
 from greent import node_types
 from greent.util import Text, LoggingUtil
 from typing import NamedTuple
 from builder.question import LabeledID
-from builder.util import FromDictMixin
+from builder.util import FromDictMixin, recursive_dump
+import copyreg
 import logging
 import re
+import sys
 
 logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
 
+def get_synonym_prefix(synonym):
+    """The upper cased prefix of a LabeledID or curie synonym."""
+    return Text.get_curie(getattr(synonym, 'identifier', synonym))
+
+
+class SynonymSet(set):
+    """A set of synonyms (LabeledIDs, or curies) that also keeps them indexed by upper cased prefix,
+    so looking up the synonyms with one prefix does not scan the set. Every mutating set method
+    keeps the index in step; copies and set algebra results are plain sets."""
+
+    def __init__(self, synonyms=()):
+        super().__init__()
+        self.by_prefix = defaultdict(set)
+        self.update(synonyms)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def prefixed(self, prefix):
+        """The synonyms with the prefix, not a copy."""
+        return self.by_prefix.get(prefix.upper(), ())
+
+    def add(self, synonym):
+        super().add(synonym)
+        self.by_prefix[get_synonym_prefix(synonym)].add(synonym)
+
+    def discard(self, synonym):
+        if synonym in self:
+            self.remove(synonym)
+
+    def remove(self, synonym):
+        super().remove(synonym)
+        prefix = get_synonym_prefix(synonym)
+        self.by_prefix[prefix].discard(synonym)
+        if not self.by_prefix[prefix]:
+            del self.by_prefix[prefix]
+
+    def pop(self):
+        synonym = next(iter(self))
+        self.remove(synonym)
+        return synonym
+
+    def clear(self):
+        super().clear()
+        self.by_prefix.clear()
+
+    def update(self, *others):
+        for other in others:
+            for synonym in other:
+                self.add(synonym)
+
+    def difference_update(self, *others):
+        for other in others:
+            for synonym in other:
+                self.discard(synonym)
+
+    def intersection_update(self, *others):
+        keep = set(self).intersection(*others)
+        for synonym in [s for s in self if s not in keep]:
+            self.remove(synonym)
+
+    def symmetric_difference_update(self, other):
+        for synonym in set(other):
+            if synonym in self:
+                self.remove(synonym)
+            else:
+                self.add(synonym)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+
 class KNode(FromDictMixin):
     """Used as the node object in KnowledgeGraph.
     
@@ -40,7 +127,7 @@ class KNode(FromDictMixin):
             self.id = Text.obo_to_curie(self.id)
 
         #Synonyms is just for CURIEs
-        self.synonyms = set()
+        self.synonyms = SynonymSet()
         self.synonyms.add(LabeledID(identifier=self.id, label=self.name))
 
         #List of labels to attach to exports
@@ -60,13 +147,19 @@ class KNode(FromDictMixin):
     def add_export_labels(self, all_types):
         self.export_labels = frozenset(all_types)
 
+    def get_indexed_synonyms(self):
+        # synonyms may have been replaced by a plain set, or come from an older pickle
+        if type(self.synonyms) is not SynonymSet:
+            self.synonyms = SynonymSet(self.synonyms)
+        return self.synonyms
+
     def get_synonyms_by_prefix(self, prefix):
         """Returns curies (not labeledIDs) for any synonym with the input prefix"""
-        return set( filter(lambda x: Text.get_curie(x).upper() == prefix.upper(), [s.identifier for s in self.synonyms]) )
+        return set( getattr(s, 'identifier', s) for s in self.get_indexed_synonyms().prefixed(prefix) )
 
     def get_labeled_ids_by_prefix(self, prefix):
         """Returns labeledIDs for any synonym with the input prefix"""
-        return set( filter(lambda x: Text.get_curie(x.identifier).upper() == prefix.upper(), self.synonyms) )
+        return set( self.get_indexed_synonyms().prefixed(prefix) )
 
     def __repr__(self):
         # return "KNode(id={0},type={1})".format (self.id, self.type)
@@ -214,5 +307,161 @@ class KEdge(FromDictMixin):
             "obj"    : self.target_id,
             "pubs"   : str(self.publications)
         }
+
+
+KNODE_FIELDS = ['id', 'name', 'type', 'original_curie', 'properties', 'synonyms', 'export_labels']
+KEDGE_FIELDS = ['source_id', 'target_id', 'provided_by', 'ctime', 'hyper_edge_id', 'original_predicate',
+                'standard_predicate', 'input_id', 'publications', 'url', 'is_support', 'properties']
+
+
+def intern_string(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def intern_labeled_id(value):
+    """One shared LabeledID per identifier and label, with interned strings. Takes a LabeledID or a dict."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        value = LabeledID(**value)
+    return get_labeled_id(value.identifier, value.label)
+
+
+# predicates repeat across millions of edges, so they are shared. the table is bounded: a LabeledID that
+# falls out of it stays shared by the edges made while it was in, and later edges share a new one
+@lru_cache(maxsize=100_000)
+def get_labeled_id(identifier, label):
+    return LabeledID(identifier=intern_string(identifier), label=intern_string(label))
+
+
+class CompactKNode(KNode):
+    """A KNode for builds that hold millions of nodes. Its fields are slots instead of a __dict__,
+    id and type strings are interned, and properties and synonyms are only allocated when they are
+    used (until then the synonyms are just the node's own id). It is built directly from its
+    arguments, without the FromDictMixin lookups.
+
+    Pickles (and so goes over the writer queue) as the equivalent KNode, with only standard library
+    names besides KNode, and unpickles as one."""
+    __slots__ = ('id', 'name', 'type', 'original_curie', '_properties', '_synonyms', 'export_labels')
+
+    def __init__(self, id, type=None, name=None, properties=None, synonyms=None, export_labels=None):
+        if id.startswith('http'):
+            id = Text.obo_to_curie(id)
+        self.id = sys.intern(id)
+        self.name = name[0] if isinstance(name, list) else name
+        self.type = intern_string(type)
+        self.original_curie = None
+        self._properties = properties if properties else None
+        self._synonyms = None
+        self.export_labels = frozenset(export_labels) if export_labels else []
+        if synonyms:
+            self.add_synonyms(synonyms)
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = {}
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = properties
+
+    @property
+    def synonyms(self):
+        if self._synonyms is None:
+            self._synonyms = SynonymSet([LabeledID(identifier=self.id, label=self.name)])
+        return self._synonyms
+
+    @synonyms.setter
+    def synonyms(self, synonyms):
+        self._synonyms = synonyms
+
+    def get_synonyms_by_prefix(self, prefix):
+        if self._synonyms is None:
+            return {self.id} if Text.get_curie(self.id) == prefix.upper() else set()
+        return super().get_synonyms_by_prefix(prefix)
+
+    def get_labeled_ids_by_prefix(self, prefix):
+        if self._synonyms is None:
+            return {LabeledID(identifier=self.id, label=self.name)} if Text.get_curie(self.id) == prefix.upper() else set()
+        return super().get_labeled_ids_by_prefix(prefix)
+
+    def get_state(self):
+        """The __dict__ of the equivalent KNode, with any attributes set beyond its fields."""
+        state = {field: getattr(self, field) for field in KNODE_FIELDS}
+        state.update(vars(self))
+        return state
+
+    def __reduce_ex__(self, protocol):
+        return copyreg._reconstructor, (KNode, object, None), self.get_state()
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
+    def dump(self):
+        return recursive_dump(self.get_state())
+
+
+class CompactKEdge(KEdge):
+    """A KEdge for builds that hold millions of edges, see CompactKNode. Ids and provided_by are
+    interned, predicates are shared LabeledIDs, publications and properties are allocated on use.
+    Publications are validated as for KEdge. Pickles as, and unpickles as, the equivalent KEdge."""
+    __slots__ = ('source_id', 'target_id', 'provided_by', 'ctime', 'hyper_edge_id', 'original_predicate',
+                 'standard_predicate', 'input_id', '_publications', 'url', 'is_support', '_properties')
+
+    def __init__(self, source_id, target_id, provided_by, ctime=None, original_predicate=None, standard_predicate=None,
+                 input_id=None, publications=None, url=None, is_support=False, properties=None, hyper_edge_id=None):
+        if provided_by is None:
+            raise Exception('Invalid source?')
+        self.source_id = intern_string(source_id)
+        self.target_id = intern_string(target_id)
+        self.provided_by = intern_string(provided_by)
+        self.ctime = ctime
+        self.hyper_edge_id = hyper_edge_id
+        self.original_predicate = intern_labeled_id(original_predicate)
+        self.standard_predicate = intern_labeled_id(standard_predicate)
+        self.input_id = intern_string(input_id)
+        self._publications = publications if publications else None
+        self.url = url
+        self.is_support = is_support
+        self._properties = properties if properties else None
+        if self._publications is not None:
+            self.validate_publications()
+
+    @property
+    def publications(self):
+        if self._publications is None:
+            self._publications = []
+        return self._publications
+
+    @publications.setter
+    def publications(self, publications):
+        self._publications = publications
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            self._properties = {}
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties):
+        self._properties = properties
+
+    def get_state(self):
+        """The __dict__ of the equivalent KEdge, with any attributes set beyond its fields."""
+        state = {field: getattr(self, field) for field in KEDGE_FIELDS}
+        state.update(vars(self))
+        return state
+
+    def __reduce_ex__(self, protocol):
+        return copyreg._reconstructor, (KEdge, object, None), self.get_state()
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
+    def dump(self):
+        return recursive_dump(self.get_state())
     
 
@@ -0,0 +1,160 @@
+import asyncio
+import atexit
+import logging
+import socket
+import threading
+import time
+import weakref
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+
+class DNSCache:
+    """ Caches socket.getaddrinfo answers for ttl seconds. Installed process wide so both
+    requests/urllib3 and aiohttp's threaded resolver benefit. """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.getaddrinfo = socket.getaddrinfo
+
+    def __call__(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            return entry[1]
+        result = self.getaddrinfo(*args, **kwargs)
+        with self.lock:
+            self.entries[key] = (now, result)
+        return result
+
+    def install(self):
+        socket.getaddrinfo = self
+
+    def uninstall(self):
+        if socket.getaddrinfo is self:
+            socket.getaddrinfo = self.getaddrinfo
+
+
+class HttpClient:
+    """ Process wide pooled HTTP client.
+
+    The sync facade is one requests.Session whose adapter keeps up to pool_maxsize keep-alive
+    connections per host (pool_connections hosts). The async facade hands out one aiohttp
+    ClientSession per event loop, each with a connector limited to async_limit connections
+    (async_limit_per_host per host) and its own DNS cache. Both are configured from the http
+    section of the config (see ServiceContext), e.g.
+
+      http:
+        pool_connections: 32
+        pool_maxsize: 32
+        async_limit: 100
+        async_limit_per_host: 16
+        keepalive_timeout: 30
+        dns_ttl: 300
+    """
+    settings = {
+        'pool_connections': 32,
+        'pool_maxsize': 32,
+        'async_limit': 100,
+        'async_limit_per_host': 16,
+        'keepalive_timeout': 30,
+        'dns_ttl': 300
+    }
+    session = None
+    async_sessions = weakref.WeakKeyDictionary()
+    dns_cache = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def configure(**settings):
+        """ Change pool settings. Existing sessions are closed so the new settings apply to the next call. """
+        for key, value in settings.items():
+            if key in HttpClient.settings and value is not None:
+                HttpClient.settings[key] = int(value)
+        HttpClient.close()
+
+    @staticmethod
+    def install_dns_cache():
+        ttl = HttpClient.settings['dns_ttl']
+        if HttpClient.dns_cache is not None:
+            HttpClient.dns_cache.uninstall()
+            HttpClient.dns_cache = None
+        if ttl > 0:
+            HttpClient.dns_cache = DNSCache(ttl)
+            HttpClient.dns_cache.install()
+
+    @staticmethod
+    def get_session():
+        """ The shared requests.Session. """
+        with HttpClient.lock:
+            if HttpClient.session is None:
+                HttpClient.install_dns_cache()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HttpClient.settings['pool_connections'],
+                                      pool_maxsize=HttpClient.settings['pool_maxsize'],
+                                      pool_block=False)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                HttpClient.session = session
+            return HttpClient.session
+
+    @staticmethod
+    def get_async_session():
+        """ The shared aiohttp.ClientSession for the running event loop. Call from a coroutine. """
+        loop = asyncio.get_event_loop()
+        session = HttpClient.async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=HttpClient.settings['async_limit'],
+                                             limit_per_host=HttpClient.settings['async_limit_per_host'],
+                                             keepalive_timeout=HttpClient.settings['keepalive_timeout'],
+                                             use_dns_cache=True,
+                                             ttl_dns_cache=HttpClient.settings['dns_ttl'] or None)
+            session = aiohttp.ClientSession(connector=connector)
+            HttpClient.async_sessions[loop] = session
+        return session
+
+    @staticmethod
+    def close():
+        """ Close the sync session and any async sessions whose loops are still usable. """
+        with HttpClient.lock:
+            if HttpClient.session is not None:
+                HttpClient.session.close()
+                HttpClient.session = None
+        for loop in list(HttpClient.async_sessions.keys()):
+            HttpClient.close_async_session(loop)
+
+    @staticmethod
+    def close_async_session(loop):
+        """ Close the async session bound to loop, e.g. before closing the loop. """
+        session = HttpClient.async_sessions.pop(loop, None)
+        if session is not None and not session.closed and not loop.is_closed() and not loop.is_running():
+            try:
+                loop.run_until_complete(session.close())
+            except Exception as e:
+                logger.debug(f'Failed to close http session: {e}')
+
+
+atexit.register(HttpClient.close)
+
+
+def request(method, url, **kwargs):
+    return HttpClient.get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('get', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('post', url, **kwargs)
+
+
+def get_async_session():
+    return HttpClient.get_async_session()
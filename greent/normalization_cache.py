@@ -0,0 +1,149 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from greent.config import Config
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+
+class NormalizationCache:
+    """ Persistent local store of node normalization responses, kept in sqlite.
+
+    Each curie maps to the JSON the node normalization service returned for it, or to nothing for a
+    curie the service does not know (negative caching). Entries expire after ttl seconds (negative_ttl
+    for misses) and are then fetched again; a ttl of 0 keeps them forever. """
+    # sqlite allows at most 999 parameters per statement
+    CHUNK_SIZE = 900
+
+    def __init__(self, path, ttl=2592000, negative_ttl=86400):
+        self.path = path
+        self.ttl = int(ttl)
+        self.negative_ttl = int(negative_ttl)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS nodes (curie TEXT PRIMARY KEY, value TEXT, expires REAL)')
+
+    @staticmethod
+    def from_config(cache_conf):
+        """ A cache from the normalization_cache section of the config, None if it is missing or disabled. """
+        if cache_conf is None or str(cache_conf.get('enabled', True)).lower() == 'false':
+            return None
+        return NormalizationCache(cache_conf.get('path') or get_default_path(),
+                                  ttl=int(cache_conf.get('ttl', 2592000)),
+                                  negative_ttl=int(cache_conf.get('negative_ttl', 86400)))
+
+    def get_expiry(self, ttl):
+        return time.time() + ttl if ttl else None
+
+    def get_many(self, curies):
+        """ Returns ({curie: response dict, or None for a known miss}, [curies not cached or expired]). """
+        found = {}
+        now = time.time()
+        curies = list(dict.fromkeys(curies))
+        with self.lock:
+            for start in range(0, len(curies), self.CHUNK_SIZE):
+                chunk = curies[start: start + self.CHUNK_SIZE]
+                rows = self.connection.execute(
+                    f"SELECT curie, value FROM nodes WHERE curie IN ({','.join('?' * len(chunk))}) "
+                    f"AND (expires IS NULL OR expires > ?)", chunk + [now])
+                for curie, value in rows:
+                    found[curie] = json.loads(value) if value is not None else None
+        return found, [curie for curie in curies if curie not in found]
+
+    def set_many(self, responses, ttl=None):
+        """ Store {curie: response dict, or None for a miss}. """
+        hit_expiry = self.get_expiry(self.ttl if ttl is None else ttl)
+        miss_expiry = self.get_expiry(self.negative_ttl)
+        rows = [(curie, json.dumps(value), hit_expiry) if value is not None else (curie, None, miss_expiry)
+                for curie, value in responses.items()]
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)', rows)
+
+    def purge_expired(self):
+        with self.lock, self.connection:
+            return self.connection.execute('DELETE FROM nodes WHERE expires <= ?', (time.time(),)).rowcount
+
+    def get_stats(self):
+        now = time.time()
+        with self.lock:
+            query = 'SELECT COUNT(*), SUM(value IS NULL), SUM(expires IS NOT NULL AND expires <= ?) FROM nodes'
+            total, misses, expired = self.connection.execute(query, (now,)).fetchone()
+        return {'entries': total, 'misses': misses or 0, 'expired': expired or 0}
+
+    def prewarm(self, dump_path, ttl=0, batch_size=10000):
+        """ Load a normalization dump: JSON lines, optionally gzipped, each either one node normalization
+        response ({"id": ..., "equivalent_identifiers": [...], "type": [...]}) or a saved service reply
+        mapping curies to responses. Every equivalent identifier of a response gets the response.
+        Returns the number of curies stored. """
+        opener = gzip.open if dump_path.endswith('.gz') else open
+        stored = 0
+        batch = {}
+        with opener(dump_path, 'rt') as stream:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                responses = [record] if 'equivalent_identifiers' in record else record.values()
+                for response in responses:
+                    if not response:
+                        continue
+                    for identifier in response['equivalent_identifiers']:
+                        batch[identifier['identifier']] = response
+                if len(batch) >= batch_size:
+                    self.set_many(batch, ttl)
+                    stored += len(batch)
+                    batch = {}
+        if batch:
+            self.set_many(batch, ttl)
+            stored += len(batch)
+        return stored
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_default_path():
+    return os.path.join(os.environ.get('ROBOKOP_HOME', '.'), 'normalization_cache.sqlite')
+
+
+def parse_args(argv=None):
+    cache_conf = Config(os.path.join(os.path.dirname(__file__), 'greent.conf')).get('normalization_cache')
+    if cache_conf is None:
+        cache_conf = {}
+    parser = argparse.ArgumentParser(description='Maintain the local node normalization cache.')
+    parser.add_argument('--path', default=cache_conf.get('path') or get_default_path())
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    prewarm_parser = subparsers.add_parser('prewarm', help='Load a normalization dump')
+    prewarm_parser.add_argument('dump', nargs='+', help='JSON lines files, optionally gzipped')
+    prewarm_parser.add_argument('--ttl', type=int, default=0, help='Seconds until the loaded entries expire, 0 for never')
+    subparsers.add_parser('stats', help='Count entries, misses and expired entries')
+    subparsers.add_parser('purge', help='Delete expired entries')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    cache = NormalizationCache(args.path)
+    if args.command == 'prewarm':
+        for dump in args.dump:
+            logger.info(f'Loading {dump}')
+            print(f'{dump}: {cache.prewarm(dump, args.ttl)} curies')
+    elif args.command == 'stats':
+        print(cache.get_stats())
+    elif args.command == 'purge':
+        print(f'Deleted {cache.purge_expired()} expired entries')
+    cache.close()
@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+from array import array
+from itertools import groupby
+from greent.config import Config
+from greent.util import LoggingUtil, Text
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+# the omnicorp tables, one per prefix
+PREFIXES = ['CHEBI', 'CL', 'DRUGBANK', 'ECTO', 'EFO', 'ENVO', 'FOODON', 'GO', 'HANCESTRO', 'HP', 'MONDO', 'NCBIGene',
+            'NCBITaxon', 'PUBCHEM_COMPOUND', 'UBERON', 'UMLS']
+# curies that are in nearly every paper and carry no signal
+BAD_IDS = {'CL:0000000', 'HP:0000001'}
+
+
+class OmnicorpIndex:
+    """ Local co-occurrence engine over the OmniCorp curie to PubMed id mappings.
+
+    For each prefix, the index directory holds PREFIX.postings, the sorted, distinct PubMed ids of
+    every curie as one run of uint32s (native byte order), and PREFIX.directory, a JSON map from
+    curie to [start, count] in that run. Postings files are memory-mapped and a prefix is only
+    opened when one of its curies is asked for. Shared PubMed ids are intersected on demand (with
+    numpy when it is installed), so nothing is precomputed per curie pair.
+
+    The methods mirror the OmniCorp services, so OmnicorpSupport can use an index in their place. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Text.get_curie upper cases prefixes, so they are looked up upper cased and mapped to the file names
+        self.prefixes = {name[:-len('.directory')].upper(): name[:-len('.directory')]
+                         for name in os.listdir(directory) if name.endswith('.directory')}
+        self.postings = {}
+        self.curies = {}
+
+    @staticmethod
+    def from_config(index_conf):
+        """ The index in the omnicorp_index section of the config, None if it is not configured or not built. """
+        if index_conf is None:
+            return None
+        directory = index_conf.get('path') or get_default_path()
+        if not os.path.isdir(directory):
+            return None
+        return OmnicorpIndex(directory)
+
+    def load_prefix(self, prefix):
+        name = self.prefixes[prefix]
+        with open(os.path.join(self.directory, f'{name}.directory')) as stream:
+            self.curies[prefix] = json.load(stream)
+        path = os.path.join(self.directory, f'{name}.postings')
+        if os.path.getsize(path) == 0:
+            # an empty file cannot be mapped
+            self.postings[prefix] = array('I')
+            return
+        with open(path, 'rb') as stream:
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        if numpy is not None:
+            self.postings[prefix] = numpy.frombuffer(mapped, dtype=numpy.uint32)
+        else:
+            self.postings[prefix] = memoryview(mapped).cast('I')
+
+    def get_pmids(self, curie):
+        """ The sorted PubMed ids (ints) of a curie, empty if the index does not know it. """
+        prefix = Text.get_curie(curie)
+        if prefix not in self.prefixes:
+            return []
+        if prefix not in self.curies:
+            self.load_prefix(prefix)
+        entry = self.curies[prefix].get(curie)
+        if entry is None:
+            return []
+        start, count = entry
+        return self.postings[prefix][start: start + count]
+
+    def count(self, curie):
+        return len(self.get_pmids(curie))
+
+    def get_shared(self, curie_a, curie_b):
+        """ The sorted PubMed ids (ints) the two curies share. """
+        pmids_a = self.get_pmids(curie_a)
+        pmids_b = self.get_pmids(curie_b)
+        if not len(pmids_a) or not len(pmids_b):
+            return []
+        if numpy is not None:
+            return numpy.intersect1d(pmids_a, pmids_b, assume_unique=True).tolist()
+        return sorted(set(pmids_a).intersection(pmids_b))
+
+    def get_omni_identifier(self, node):
+        if Text.get_curie(node.id) not in self.prefixes:
+            return None
+        return node.id
+
+    def count_pmids(self, node):
+        identifier = self.get_omni_identifier(node)
+        if identifier is None:
+            return 0
+        return self.count(identifier)
+
+    def get_shared_pmids(self, node1, node2):
+        id1 = self.get_omni_identifier(node1)
+        id2 = self.get_omni_identifier(node2)
+        if id1 is None or id2 is None:
+            return []
+        return [f'PMID:{p}' for p in self.get_shared(id1, id2)]
+
+    def get_all_shared_pmids(self, nodes):
+        """ {(node_i, node_j): shared PubMed id curies} for every pair of nodes, i before j. """
+        pubmeds = {}
+        for i, node_i in enumerate(nodes):
+            for node_j in nodes[i + 1:]:
+                pubmeds[(node_i, node_j)] = self.get_shared_pmids(node_i, node_j)
+        return pubmeds
+
+
+def write_prefix(directory, prefix, rows):
+    """ Write the postings of one prefix from (curie, pubmed id) rows sorted by curie. Returns the number of curies. """
+    postings_path = os.path.join(directory, f'{prefix}.postings')
+    directory_path = os.path.join(directory, f'{prefix}.directory')
+    curies = {}
+    start = 0
+    with open(f'{postings_path}.tmp', 'wb') as postings:
+        for curie, group in groupby(rows, key=lambda row: row[0]):
+            if curie in curies:
+                raise ValueError(f'{prefix} rows are not sorted by curie ({curie})')
+            if curie in BAD_IDS:
+                continue
+            pmids = sorted({int(pmid) for _, pmid in group})
+            array('I', pmids).tofile(postings)
+            curies[curie] = [start, len(pmids)]
+            start += len(pmids)
+    with open(f'{directory_path}.tmp', 'w') as stream:
+        json.dump(curies, stream)
+    os.replace(f'{postings_path}.tmp', postings_path)
+    os.replace(f'{directory_path}.tmp', directory_path)
+    return len(curies)
+
+
+def build_index(conn, directory, prefixes=PREFIXES, batch_size=100000):
+    """ Build an index in directory from the omnicorp tables of a postgres connection. """
+    os.makedirs(directory, exist_ok=True)
+    for prefix in prefixes:
+        table = ''.join(prefix.split('.'))
+
+        def rows():
+            # a named (server side) cursor streams the table instead of loading it
+            with conn.cursor(name=f'omnicorp_{table}') as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(f'SELECT curie, pubmedid FROM omnicorp.{table} ORDER BY curie')
+                yield from cursor
+        logger.info(f'Indexing omnicorp.{table}')
+        logger.info(f'{prefix}: {write_prefix(directory, prefix, rows())} curies')
+
+
+def get_default_path():
+    return os.path.join(os.environ.get('ROBOKOP_HOME', '.'), 'omnicorp_index')
+
+
+if __name__ == '__main__':
+    config = Config(os.path.join(os.path.dirname(__file__), 'greent.conf'))
+    index_conf = config.get('omnicorp_index')
+    if index_conf is None:
+        index_conf = {}
+    parser = argparse.ArgumentParser(description='Maintain the local OmniCorp co-occurrence index.')
+    parser.add_argument('--path', default=index_conf.get('path') or get_default_path())
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help='Build the index from the OmniCorp postgres tables')
+    build_parser.add_argument('--prefix', action='append', help='Only (re)build these prefixes')
+    shared_parser = subparsers.add_parser('shared', help='Show the PubMed ids two curies share')
+    shared_parser.add_argument('curie', nargs=2)
+    args = parser.parse_args()
+    if args.command == 'build':
+        import psycopg2
+        conn = psycopg2.connect(dbname=config['OMNICORP_DB'], user=config['OMNICORP_USER'], host=config['OMNICORP_HOST'],
+                                port=config['OMNICORP_PORT'], password=config['OMNICORP_PASSWORD'])
+        build_index(conn, args.path, args.prefix or PREFIXES)
+        conn.close()
+    elif args.command == 'shared':
+        index = OmnicorpIndex(args.path)
+        shared = index.get_shared(*args.curie)
+        print(f'{args.curie[0]}: {index.count(args.curie[0])}, {args.curie[1]}: {index.count(args.curie[1])}, shared: {len(shared)}')
+        print(' '.join(f'PMID:{p}' for p in shared))
@@ -4,19 +4,24 @@ import pika
 from datetime import datetime as dt
 from datetime import timedelta
 import hashlib
-import requests
+from greent import http_client
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from builder.question import QNode
 from greent.graph_components import KNode, node_types
 from greent.export_delegator import WriterDelegator
 from greent.synonymization import Synonymizer
 from greent.util import LoggingUtil, Text
-from greent.cache import Cache
+from greent.visited import VisitedIndex
 from greent.annotators.annotator_factory import annotate_shortcut
 import traceback
 
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
 
+DEPTH_FIRST = 'depth_first'
+BREADTH_FIRST = 'breadth_first'
+
 
 class QueryDefinition:
     """Defines a query"""
@@ -34,7 +39,7 @@ class QueryDefinition:
 
 
 def get_name_for_curie(curie):
-    response = requests.get(f"https://bionames.renci.org/ID_to_label/{curie}/")
+    response = http_client.get(f"https://bionames.renci.org/ID_to_label/{curie}/")
     if response.ok:
         response_json = response.json()
         #logger.debug(response_json)
@@ -54,13 +59,6 @@ class Program:
         self.transitions = plan
         self.rosetta = rosetta
         self.prefix = hashlib.md5((str(plan) + str(machine_question['nodes'])).encode()).hexdigest()
-        self.cache = Cache(
-            redis_host=os.environ['BUILD_CACHE_HOST'],
-            redis_port=os.environ['BUILD_CACHE_PORT'],
-            redis_db=os.environ['BUILD_CACHE_DB'],
-            prefix=self.prefix)
-
-        self.cache.flush()
         self.log_program()
         #self.excluded_identifiers=set()
         """
@@ -96,6 +94,22 @@ class Program:
 
         self.writer_delegator = WriterDelegator(rosetta)
 
+        # Execution settings. The breadth first executor dispatches operators concurrently
+        # but never runs more than service_concurrency calls against one service at a time.
+        program_conf = self.rosetta.service_context.config.get('program')
+        if program_conf is None:
+            program_conf = {}
+        self.mode = program_conf.get('mode', DEPTH_FIRST)
+        self.max_workers = int(program_conf.get('max_workers', 8))
+        self.service_concurrency = int(program_conf.get('service_concurrency', 4))
+        self.service_semaphores = {}
+
+        # Which question nodes each curie has been expanded toward. With a checkpoint_dir, breadth
+        # first runs save it after every hop and a rerun of the same program resumes from there.
+        checkpoint_dir = program_conf.get('checkpoint_dir')
+        checkpoint_path = os.path.join(checkpoint_dir, f'{self.prefix}.visited') if checkpoint_dir else None
+        self.visited = VisitedIndex(checkpoint_path)
+
     def log_program(self):
         logstring = f'Program {self.program_number}\n'
         logstring += 'Nodes: \n'
@@ -110,7 +124,8 @@ class Program:
         logger.debug(logstring)
         logger.debug(f'total transitions : {total_transitions}')
 
-    def initialize_instance_nodes(self):
+    def get_start_nodes(self):
+        """Normalize the curies in the question and return (start node, question node id) pairs."""
         # No error checking here. You should have caught any malformed questions before this point.
         logger.debug("Initializing program {}".format(self.program_number))
 
@@ -125,48 +140,73 @@ class Program:
         # during processing we don't need to do synonymization at
         # any point. We will let each service return a KNode
         # we will batch synonymize results later in Buffered writer.
+        start_nodes = []
         for n in self.machine_question['nodes']:
             if n.curie:
                 # if node is not normalized via synonymization service promote it to Knowledge node.
-                start_node = normalized_nodes.get(n.curie, self.parse_QNode_to_KNode(n))
-                self.process_node(start_node, [n.id])
+                start_nodes.append((normalized_nodes.get(n.curie, self.parse_QNode_to_KNode(n)), n.id))
+        return start_nodes
+
+    def initialize_instance_nodes(self):
+        for start_node, qnode_id in self.get_start_nodes():
+            self.process_node(start_node, [qnode_id])
         return
 
     def parse_QNode_to_KNode(self, qNode: QNode):
         """Incase of synonymization failure question Node is promoted to Knowledge node"""
         return KNode(qNode.curie, type=[qNode.type])
 
-    def process_op(self, link, source_node, history):
-        op_name = link['op']
-        key = f"{op_name}({Text.upper_curie(source_node.id)})"
+    def get_op_key(self, op_name, source_node):
+        return f"{op_name}({Text.upper_curie(source_node.id)})"
+
+    def execute_op(self, op_name, source_node):
+        """Call an operator, without looking in the cache."""
+        key = self.get_op_key(op_name, source_node)
         maxtime = timedelta(minutes=2)
+        logger.debug(f"exec op: {key}")
+        op = self.rosetta.get_ops(op_name)
+        start = dt.now()
+        results = op(source_node)
+        end = dt.now()
+        logger.debug(f'Call {key} took {end-start}')
+        if (end-start) > maxtime:
+            logger.warn(f"Call {key} exceeded {maxtime}")
+        return results
+
+    def get_op_results(self, op_name, source_node):
+        """Return the (edge, node) results of an operator, from the cache if possible."""
+        key = self.get_op_key(op_name, source_node)
         try:
-            try:
-                results = self.rosetta.cache.get(key)
-            except Exception as e:
-                # logger.warning(e)
-                results = None
-            if results is not None:
-                logger.debug(f"cache hit: {key} size:{len(results)}")
-            else:
-                logger.debug(f"exec op: {key}")
-                op = self.rosetta.get_ops(op_name)
-                start = dt.now()
-                results = op(source_node)
-                end = dt.now()
-                logger.debug(f'Call {key} took {end-start}')
-                if (end-start) > maxtime:
-                    logger.warn(f"Call {key} exceeded {maxtime}")
-                self.rosetta.cache.set(key, results)
-                logger.debug(f"cache.set-> {key} length:{len(results)}")
-                logger.debug(f"    {[node for _, node in results]}")
-            results = list(filter(lambda x: x[1].id not in self.excluded_identifiers, results))
-            for edge, node in results:
-                edge_label = Text.snakify(edge.original_predicate.label)
-                if link['predicate'] is None or edge_label == link['predicate'] or (isinstance(link['predicate'], list) and (edge_label in link['predicate'])):
-                    self.process_node(node, history, edge)
-                else:
-                    pass
+            results = self.rosetta.cache.get(key)
+        except Exception as e:
+            # logger.warning(e)
+            results = None
+        if results is not None:
+            logger.debug(f"cache hit: {key} size:{len(results)}")
+        else:
+            results = self.execute_op(op_name, source_node)
+            self.rosetta.cache.set(key, results)
+            logger.debug(f"cache.set-> {key} length:{len(results)}")
+            logger.debug(f"    {[node for _, node in results]}")
+        return results
+
+    def select_results(self, link, results):
+        """Drop excluded nodes and edges that don't match the predicate of the link."""
+        selected = []
+        for edge, node in results:
+            if node.id in self.excluded_identifiers:
+                continue
+            edge_label = Text.snakify(edge.original_predicate.label)
+            if link['predicate'] is None or edge_label == link['predicate'] or (isinstance(link['predicate'], list) and (edge_label in link['predicate'])):
+                selected.append((edge, node))
+        return selected
+
+    def process_op(self, link, source_node, history):
+        key = self.get_op_key(link['op'], source_node)
+        try:
+            results = self.get_op_results(link['op'], source_node)
+            for edge, node in self.select_results(link, results):
+                self.process_node(node, history, edge)
 
         except pika.exceptions.ChannelClosed:
             traceback.print_exc()
@@ -182,13 +222,22 @@ class Program:
         to a particular concept in our query plan. We make sure that they're synonymized and then
         queue up their children
         """
+        if not self.visit_node(node, history, edge):
+            return
+        for link, next_history in self.get_transitions(node, history):
+            print("-"*len(history)+"Executing: ", link['op'])
+            self.process_op(link, node, next_history)
+
+    def visit_node(self, node, history, edge=None):
+        """Annotate the node and send it (and the edge that led to it) to the writer.
+        Returns False if the node is excluded and should not be explored."""
         logger.debug(f'process {node.id}')
         if edge is not None:
             is_source = node.id == edge.source_id
         #Our excluded ids are e.g. uberons, but we might have gotten something else like a CARO
         # so we need to synonymize and then cehck for identifiers
         if node.id in self.excluded_identifiers:
-            return
+            return False
         try:
             result = annotate_shortcut(node, self.rosetta)
             if type(result) == type(None):
@@ -202,33 +251,22 @@ class Program:
             else:
                 edge.target_id = node.id
 
-        # check the node cache, compare to the provided history
-        # to determine which ops are valid
-        key = node.id
-
-        # print(node.dump())
-        # if edge:
-        #     print(edge.dump())
-        #print("-"*len(history)+"History: ", history)
-
-        # only add a node if it wasn't cached
-        completed = self.cache.get(key) # set of nodes we've been from here
-        #print("-"*len(history)+"Completed: ", completed)
-        if completed is None:
-            completed = set()
-            self.cache.set(key, completed)
+        # track which question nodes we've been to from here,
+        # so get_transitions can tell which ops are still valid
+        self.visited.add(node.id)
 
         self.writer_delegator.write_node(node)
-        #logger.debug(f"Sent node {node.id}")
 
         # make sure the edge is queued for creation AFTER the node
         if edge:
             self.writer_delegator.write_edge(edge)
-            #logger.debug(f"Sent edge {edge.source_id}->{edge.target_id}")
+        return True
 
+    def get_transitions(self, node, history):
+        """Yield the (link, history) pairs still to be executed from this node.
+        Targets are marked completed as they are yielded."""
         # quit if we've closed a loop
         if history[-1] in history[:-1]:
-            #print("-"*len(history)+"Closed a loop!")
             return
 
         source_id = history[-1]
@@ -238,7 +276,6 @@ class Program:
             return
 
         destinations = self.transitions[source_id]
-        completed = self.cache.get(key)
         for target_id in destinations:
             if not self.transitions[source_id][target_id]:
                 continue
@@ -246,24 +283,103 @@ class Program:
             if len(history)>1 and target_id == history[-2]:
                 continue
             # don't repeat things
-            if target_id in completed:
+            if not self.visited.mark_completed(node.id, target_id):
                 continue
-            completed.add(target_id)
-            self.cache.set(key, completed)
             links = self.transitions[source_id][target_id]
-            #print("-"*len(history)+f"Destination: {target_id}")
             for link in links:
-                print("-"*len(history)+"Executing: ", link['op'])
-                self.process_op(link, node, history + [target_id])
+                yield link, history + [target_id]
+
+    def get_service_name(self, op_name):
+        """The service an operator talks to, e.g. caster.upcast(kegg~enzyme_get_chemicals,...) is kegg."""
+        if '~' in op_name:
+            return op_name.split('~')[0].split('(')[-1]
+        return op_name.split('.')[0]
+
+    def run_op(self, op_name, source_node):
+        """Worker side of the breadth first executor."""
+        with self.service_semaphores[self.get_service_name(op_name)]:
+            return self.execute_op(op_name, source_node)
+
+    def dispatch_ops(self, executor, calls):
+        """Run unique (op, source node) calls. Cached results are fetched in one batch, the rest run
+        concurrently and are cached in one batch. Returns a map of op key to results; failed calls map to None."""
+        keys = list(calls.keys())
+        try:
+            cached = self.rosetta.cache.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Cache lookup failed: {e}")
+            cached = [None] * len(keys)
+        results = {key: value for key, value in zip(keys, cached) if value is not None}
+        logger.debug(f"cache hits: {len(results)} of {len(keys)}")
+        for key in keys:
+            if key in results:
+                continue
+            service_name = self.get_service_name(calls[key][0])
+            if service_name not in self.service_semaphores:
+                self.service_semaphores[service_name] = threading.BoundedSemaphore(self.service_concurrency)
+        futures = {key: executor.submit(self.run_op, op_name, source_node)
+                   for key, (op_name, source_node) in calls.items() if key not in results}
+        new_results = {}
+        for key, future in futures.items():
+            try:
+                new_results[key] = future.result()
+            except Exception as e:
+                logger.warning(f"Error invoking>   -- {key}: {e}")
+                results[key] = None
+        if new_results:
+            self.rosetta.cache.set_many(new_results)
+            logger.debug(f"cache.set_many-> {len(new_results)} keys")
+        results.update(new_results)
+        return results
+
+    def process_frontier(self):
+        """Breadth first execution. Each hop visits every node in the frontier, collects the operators
+        to run from them, runs each distinct (op, source node) pair once through the worker pool and
+        builds the next frontier from the results. Writing and annotation stay on this thread.
+        Before each hop the visited index is checkpointed along with the frontier, if configured."""
+        if self.visited.has_checkpoint():
+            frontier, hop = self.visited.load()
+        else:
+            frontier = [(start_node, [qnode_id], None) for start_node, qnode_id in self.get_start_nodes()]
+            hop = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while frontier:
+                self.visited.checkpoint((frontier, hop))
+                calls = {}
+                pending = []
+                for node, history, edge in frontier:
+                    if not self.visit_node(node, history, edge):
+                        continue
+                    for link, next_history in self.get_transitions(node, history):
+                        key = self.get_op_key(link['op'], node)
+                        calls.setdefault(key, (link['op'], node))
+                        pending.append((key, link, next_history))
+                logger.debug(f'Program {self.program_number} hop {hop}: {len(frontier)} nodes, {len(calls)} calls')
+                results = self.dispatch_ops(executor, calls)
+                frontier = []
+                for key, link, history in pending:
+                    if results[key] is None:
+                        continue
+                    frontier.extend((node, history, edge) for edge, node in self.select_results(link, results[key]))
+                hop += 1
 
     #CAN I SOMEHOW CAPTURE PATHS HERE>>>>
 
-    def run_program(self):
+    def run_program(self, mode=None):
         """Loop over unused nodes, send them to the appropriate operator, and collect the results.
-        Keep going until there's no nodes left to process."""
-        logger.debug(f"Running program {self.program_number}")
-        self.initialize_instance_nodes()
+        Keep going until there's no nodes left to process.
+        mode is depth_first (recursive, one call at a time) or breadth_first (hop by hop, concurrent calls),
+        defaulting to the program.mode setting."""
+        mode = mode or self.mode
+        logger.debug(f"Running program {self.program_number} ({mode})")
+        if mode == BREADTH_FIRST:
+            self.process_frontier()
+        elif mode == DEPTH_FIRST:
+            self.initialize_instance_nodes()
+        else:
+            raise ValueError(f'Unknown program mode {mode}')
         self.writer_delegator.flush()
+        self.visited.clear()
         return
 
     def get_path_descriptor(self):
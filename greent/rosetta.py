@@ -16,6 +16,7 @@ from greent.identifiers import Identifiers
 from greent.program import Program
 from greent.program import QueryDefinition
 from greent.synonymization import Synonymizer
+from greent.normalization_cache import NormalizationCache
 #from greent.transreg import TranslatorRegistry
 from greent.util import LoggingUtil
 from greent.util import Text
@@ -63,6 +64,7 @@ class Rosetta:
         if use_graph:
             self.type_graph = TypeGraph(self.service_context, debug=debug)
         self.synonymizer = Synonymizer()
+        Synonymizer.configure_cache(NormalizationCache.from_config(self.service_context.config.get('normalization_cache')))
 
         """ Merge identifiers.org vocabulary into Rosetta vocab. """
         self.identifiers = Identifiers()
@@ -1,9 +1,242 @@
 import os
+from greent import http_client
+import threading
 from greent.graph_components import KEdge
 from greent.util import LoggingUtil
 from datetime import datetime as dt
 import time
-    
+
+logger = LoggingUtil.init_logging(__name__)
+
+
+class ServiceUnavailable(Exception):
+    """ Raised without calling out when a service's circuit breaker is open. """
+    pass
+
+
+class TokenBucket:
+    """ Allows rate calls per second on average, with bursts of up to capacity calls. """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """ Opens after failure_threshold consecutive failures. While open, calls are refused until
+    reset_timeout seconds have passed, then a single trial call is let through (half open).
+    A success closes the breaker again, a failure re-opens it. """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = CircuitBreaker.CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CircuitBreaker.OPEN:
+                    logger.warning(f"Circuit breaker opened after {self.failures} failures")
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ServicePolicy:
+    """ Shared call policy for one service: a cap on calls in flight, a token bucket rate limit,
+    a default timeout, retries with exponential backoff and a circuit breaker. Keeps counters
+    of calls, failures and latency.
+
+    Settings come from the service_policy section of the config, overridden by the policy
+    section of the service itself:
+
+      service_policy:
+        timeout: 120
+      translator:
+        services:
+          ctd:
+            url: ...
+            policy:
+              max_in_flight: 4
+              rate: 10
+
+    Policies are shared by every instance of a service in the process. """
+    KEYS = ['max_in_flight', 'rate', 'burst', 'timeout', 'retries', 'backoff', 'retry_statuses',
+            'failure_threshold', 'reset_timeout']
+    policies = {}
+    policies_lock = threading.Lock()
+
+    def __init__(self, name, max_in_flight=None, rate=None, burst=None, timeout=None, retries=0, backoff=1.0,
+                 retry_statuses=(429, 502, 503, 504), failure_threshold=None, reset_timeout=30):
+        self.name = name
+        self.semaphore = threading.BoundedSemaphore(int(max_in_flight)) if max_in_flight else None
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.timeout = float(timeout) if timeout else None
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.retry_statuses = set(int(s) for s in retry_statuses)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout) if failure_threshold else None
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'rejected': 0,
+            'total_latency': 0.0,
+            'max_latency': 0.0
+        }
+
+    @staticmethod
+    def get_policy(name, context):
+        """ Get the process wide policy for a service, creating it from the config the first time. """
+        with ServicePolicy.policies_lock:
+            if name not in ServicePolicy.policies:
+                ServicePolicy.policies[name] = ServicePolicy(name, **ServicePolicy.get_settings(name, context))
+            return ServicePolicy.policies[name]
+
+    @staticmethod
+    def get_settings(name, context):
+        settings = {}
+        config = context.config
+        sections = [config.get('service_policy')]
+        try:
+            sections.append(config['translator']['services'][name].get('policy'))
+        except (KeyError, TypeError):
+            pass
+        for section in sections:
+            if section is None:
+                continue
+            for key in ServicePolicy.KEYS:
+                value = section.get(key)
+                if value is not None:
+                    settings[key] = value
+        if isinstance(settings.get('retry_statuses'), str):
+            settings['retry_statuses'] = settings['retry_statuses'].split(',')
+        return settings
+
+    @staticmethod
+    def get_all_stats():
+        return {name: policy.get_stats() for name, policy in ServicePolicy.policies.items()}
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['mean_latency'] = stats['total_latency'] / stats['calls'] if stats['calls'] else 0.0
+        stats['breaker'] = self.breaker.state if self.breaker else None
+        return stats
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def request(self, method, url, **kwargs):
+        """ Make a request under this policy. A response with a retryable status is retried and, once
+        retries run out, returned as is. Exceptions are retried and then re-raised.
+        With stream=True the body is still to be read, so the response holds its max_in_flight slot
+        until it is closed: callers must close streamed responses. """
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        streaming = kwargs.get('stream', False)
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                self.count('rejected')
+                raise ServiceUnavailable(f'{self.name} is unavailable (circuit open), not calling {url}')
+            if self.bucket is not None:
+                self.bucket.acquire()
+            response = None
+            error = None
+            if self.semaphore is not None:
+                self.semaphore.acquire()
+            start = time.monotonic()
+            try:
+                response = http_client.request(method, url, **kwargs)
+            except Exception as e:
+                error = e
+            finally:
+                elapsed = time.monotonic() - start
+                if self.semaphore is not None:
+                    if streaming and response is not None:
+                        self.release_on_close(response)
+                    else:
+                        self.semaphore.release()
+            with self.stats_lock:
+                self.stats['calls'] += 1
+                self.stats['total_latency'] += elapsed
+                self.stats['max_latency'] = max(self.stats['max_latency'], elapsed)
+            failed = error is not None or response.status_code in self.retry_statuses
+            if not failed:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return response
+            self.count('failures')
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            if attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            self.count('retries')
+            wait = self.backoff * 2 ** (attempt - 1)
+            if response is not None and response.headers.get('Retry-After', '').isdigit():
+                wait = max(wait, int(response.headers['Retry-After']))
+            logger.debug(f"{self.name}: retrying {url} in {wait}s ({error or response.status_code})")
+            if response is not None:
+                # give the connection back to the pool, streamed bodies hold it until closed
+                response.close()
+            time.sleep(wait)
+
+    def release_on_close(self, response):
+        """ Release the max_in_flight slot of a streamed response once, when it is closed. """
+        close = response.close
+        released = threading.Event()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.semaphore.release()
+        response.close = close_and_release
+
+
 class Service:
     """ Basic characteristics of services. """
     def __init__(self, name, context):
@@ -15,6 +248,7 @@ class Service:
             self.concept_model = getattr(context, 'rosetta-graph').concept_model
         except:
             pass
+        self.policy = ServicePolicy.get_policy(self.name, context)
         setattr (self.context, self.name, self)
 
     def _type(self):
@@ -30,6 +264,14 @@ class Service:
             #traceback.print_exc ()
         return result
 
+    def http_get(self, url, **kwargs):
+        """ GET through this service's call policy. Takes the same arguments as requests.get. """
+        return self.policy.request('get', url, **kwargs)
+
+    def http_post(self, url, **kwargs):
+        """ POST through this service's call policy. Takes the same arguments as requests.post. """
+        return self.policy.request('post', url, **kwargs)
+
     def standardize_predicate(self, predicate, source=None, target=None):
         return self.concept_model.standardize_relationship(predicate)
 
@@ -47,4 +289,3 @@ class Service:
                      publications=publications,
                      url=url,
                      properties=properties)
-
@@ -1,7 +1,8 @@
 import os
-from greent.cache import Cache
+from greent.cache import Cache, TTLPolicy, serializers
 from greent.core import GreenT
 from greent.config import Config
+from greent.http_client import HttpClient
 from greent.util import LoggingUtil
 import socket
 
@@ -17,11 +18,28 @@ class ServiceContext:
         
         # Initiaize the cache.
         redis_conf = self.config["cache"]
+        serializer_name = redis_conf.get ("serializer", "pickle")
+        serializer_options = {}
+        if serializer_name == "msgpack":
+            serializer_options = {
+                "compress" : redis_conf.get ("compress", True),
+                "compression_level" : int (redis_conf.get ("compression_level", 3)) }
         self.cache = Cache (
+            serializer = serializers[serializer_name],
+            serializer_options = serializer_options,
             redis_host = redis_conf.get ("host"),
             redis_port = redis_conf.get ("port"),
             redis_db = redis_conf.get ("db"),
-            redis_password = redis_conf.get ("password"))
+            redis_password = redis_conf.get ("password"),
+            l1_size = int (redis_conf.get ("l1_size", 1000)),
+            l1_max_bytes = redis_conf.get ("l1_max_bytes"),
+            l1_policy = redis_conf.get ("l1_policy", "lru"),
+            ttl_policy = TTLPolicy.from_config (redis_conf.get ("ttl")))
+
+        # Size the shared HTTP connection pools.
+        http_conf = self.config.get ("http")
+        if http_conf is not None:
+            HttpClient.configure (**{key: http_conf.get (key) for key in HttpClient.settings})
         #redis_conf = self.config["redis"]
         #self.cache = Cache (
         #    redis_host = self.config.get ("RESULTS_HOST"),
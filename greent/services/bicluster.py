@@ -1,5 +1,4 @@
 import logging
-import requests
 from datetime import datetime as dt
 from greent.service import Service
 from greent.graph_components import KNode, LabeledID
@@ -32,7 +31,7 @@ class Bicluster(Service):
         identifiers = drug.get_synonyms_by_prefix('NCBIGENE')
         for identifier in identifiers:
             url=f"{self.url}/RNAseqDB_bicluster_gene_to_tissue_gene/ncbigene:{Text.un_curie(identifier)}/"
-            obj = requests.get(url).json ()
+            obj = self.http_get(url).json ()
             for r in obj:
                 anatomy_id = r['col_enrich_UBERON']
                 if anatomy_id == '':
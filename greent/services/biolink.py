@@ -1,4 +1,3 @@
-import requests
 import urllib
 from greent.service import Service
 from greent.ontologies.mondo2 import Mondo2
@@ -58,7 +57,7 @@ class Biolink(Service):
         wait_time = 5 # seconds
         while num_tries < max_tries:
             try:
-                r = requests.get(url)
+                r = self.http_get(url)
                 if r.status_code == 500 or r.status_code == 404:
                     return None
                 #Anything else, it's either good or we want to retry on exception.
@@ -1,5 +1,4 @@
 import json
-import requests
 import traceback
 from greent import node_types
 from builder.lookup_utils import lookup_drug_by_name
@@ -71,7 +70,7 @@ class BioNames(Service):
         try:
             owlsim_query = f"https://owlsim.monarchinitiative.org/api/search/entity/autocomplete/{q}?rows=20&start=0&category={concept}"
             logger.debug (f"owlsim query: {owlsim_query}")
-            response = requests.get (owlsim_query).json ()
+            response = self.http_get(owlsim_query).json ()
             logger.debug (f"owlsim response: {response}")
             if response and "docs" in response:
                 result = [ { "id" : d["id"], "label" : ", ".join (d["label"]), "type": concept } for d in response["docs"] ]
@@ -1,20 +1,31 @@
-import requests
 from greent import node_types
 from greent.graph_components import KNode, LabeledID
 from greent.service import Service
 from greent.util import Text, LoggingUtil
-from math import ceil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import closing
+from itertools import islice
 import logging,json
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 logger = LoggingUtil.init_logging(__name__, logging.DEBUG)
 
+# the most variants posted to the allele registry at once
+BATCH_SIZE = 2000
+# posts in flight at once in the concurrent mode, the service policy (max_in_flight) still applies
+DEFAULT_BATCH_WORKERS = 4
+
 class ClinGen(Service):
     def __init__(self, context):
         super(ClinGen, self).__init__("clingen", context)
         self.synon_fields_param = 'fields=none+@id+externalRecords.dbSNP+externalRecords.ClinVarVariations+externalRecords.MyVariantInfo_hg38+genomicAlleles-genomicAlleles.referenceSequence'
         self.synonym_buffer = {}
 
-    def get_batch_of_synonyms(self, variant_list, variant_format='hgvs'):
+    def get_batch_of_synonyms(self, variant_list, variant_format='hgvs', workers=1):
         # possible variant_format values not implemented yet
         # would only need to switch prefix for building synonym dictionary 
         # hgvs
@@ -23,21 +34,55 @@ class ClinGen(Service):
         # MyVariantInfo_hg38.id 
         # ExAC.id
         # gnomAD.id
-        if not variant_list: 
-            return {}
+        synonym_dictionary = {}
+        for batch_synonyms in self.stream_batches_of_synonyms(variant_list, variant_format, workers=workers):
+            synonym_dictionary.update(batch_synonyms)
+        return synonym_dictionary
+
+    def stream_batches_of_synonyms(self, variants, variant_format='hgvs', batch_size=BATCH_SIZE, workers=DEFAULT_BATCH_WORKERS):
+        """ Synonymize any number of variants (any iterable, consumed lazily) with the allele registry.
 
-        separator = '\n'
+        Variants are posted batch_size at a time with up to workers posts in flight. Responses are
+        parsed as they stream in (with ijson when it is installed). Yields one {HGVS curie: synonyms}
+        dictionary per batch, in the order the posts finish. Failed batches are logged and left out. """
+        query_url = f'{self.url}alleles?file={variant_format}&{self.synon_fields_param}'
+        pending = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            variants = iter(variants)
+            variant_subset = list(islice(variants, batch_size))
+            while variant_subset:
+                pending.add(executor.submit(self.post_batch_of_variants, query_url, variant_subset))
+                if len(pending) >= workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self.get_finished_batches(done)
+                variant_subset = list(islice(variants, batch_size))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from self.get_finished_batches(done)
+
+    def get_finished_batches(self, futures):
+        for future in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                logger.error(f'ClinGen batch synonymization failed: {e}')
+
+    def post_batch_of_variants(self, query_url, variant_subset):
+        """ {HGVS curie: synonyms} for one batch of variants, parsing the response while it is read. """
         synonym_dictionary = {}
-        batches = ceil(len(variant_list) / 2000)
-        for i in range(batches):
-            variant_subset = variant_list[i*2000:i*2000+2000]
-            hgvs_pseudo_file = separator.join(variant_subset)
-            query_url = f'{self.url}alleles?file={variant_format}&{self.synon_fields_param}'
-            all_alleles_json = self.query_service(query_url, data=hgvs_pseudo_file)
-            for index, allele_json in enumerate(all_alleles_json):
-                hgvs_id = f'HGVS:{variant_subset[index]}'
-                synonym_dictionary[hgvs_id] = self.parse_allele_json_for_synonyms(allele_json)
-        
+        with closing(self.http_post(query_url, data='\n'.join(variant_subset), stream=True)) as query_response:
+            if query_response.status_code != 200:
+                logger.warning(f'ClinGen returned a non-200 response({query_response.status_code}) calling ({query_url})')
+                return synonym_dictionary
+            if ijson is not None:
+                # let urllib3 undo any content encoding before ijson reads the body
+                query_response.raw.decode_content = True
+                all_alleles_json = ijson.items(query_response.raw, 'item', use_float=True)
+            else:
+                all_alleles_json = query_response.json()
+            # the registry answers in the order the variants were posted
+            for variant, allele_json in zip(variant_subset, all_alleles_json):
+                synonym_dictionary[f'HGVS:{variant}'] = self.parse_allele_json_for_synonyms(allele_json)
         return synonym_dictionary
         
     def get_synonyms_by_caid(self, caid):
@@ -214,9 +259,9 @@ class ClinGen(Service):
 
     def query_service(self, query_url, data=None):
         if data:
-            query_response = requests.post(query_url, data=data)
+            query_response = self.http_post(query_url, data=data)
         else:
-            query_response = requests.get(query_url)
+            query_response = self.http_get(query_url)
         if query_response.status_code != 200:
             logger.warning(f'ClinGen returned a non-200 response({query_response.status_code}) calling ({query_url})')
             return {}
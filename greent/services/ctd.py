@@ -1,5 +1,4 @@
 import logging
-import requests
 from datetime import datetime as dt
 from greent.service import Service
 from greent.graph_components import KNode, LabeledID
@@ -91,11 +90,11 @@ class CTD(Service):
 
     def drugname_string_to_drug_identifier(self,drugname):
         #First, check to see if the name is already an exact name of something
-        chemnamerows = requests.get (f"{self.url}CTD_chemicals_ChemicalName/{drugname}/").json ()
+        chemnamerows = self.http_get(f"{self.url}CTD_chemicals_ChemicalName/{drugname}/").json ()
         keepers = [ x for x in chemnamerows if x['ChemicalName'].upper() == drugname.upper()]
         if len(keepers) == 0:
             #Didn't find exact name match, so now see if there is an exact synonym
-            synonamerows = requests.get (f"{self.url}CTD_chemicals_Synonyms/{drugname}/").json ()
+            synonamerows = self.http_get(f"{self.url}CTD_chemicals_Synonyms/{drugname}/").json ()
             for row in synonamerows:
                 synonyms = [syn.upper() for syn in row['Synonyms'].split('|')]
                 if drugname.upper() in synonyms:
@@ -130,7 +129,7 @@ class CTD(Service):
         identifiers = drug.get_synonyms_by_prefix('MESH')
         for identifier in identifiers:
             url=f"{self.url}CTD_chem_gene_ixns_ChemicalID/{Text.un_curie(identifier)}/"
-            obj = requests.get(url).json ()
+            obj = self.http_get(url).json ()
             for r in obj:
                 good_row, predicate_label, props = self.check_gene_chemical_row(r)
                 if not good_row:
@@ -195,7 +194,7 @@ class CTD(Service):
         identifiers = drug.get_synonyms_by_prefix('MESH')
         for identifier in identifiers:
             url=f"{self.url}CTD_chem_gene_expanded_chemicalID/mesh:{Text.un_curie(identifier)}/"
-            result = requests.get(url)
+            result = self.http_get(url)
             obj=result.json()
             for r in obj:
                 good_row, predicate_label, props, pmids = self.check_expanded_gene_chemical_row(r)
@@ -223,7 +222,7 @@ class CTD(Service):
             unique = set()
             geneid = Text.un_curie(identifier)
             url = f"{self.url}/CTD_chem_gene_ixns_GeneID/{geneid}/"
-            obj = requests.get (url).json ()
+            obj = self.http_get(url).json ()
             for r in obj:
                 if r['GeneID'] != geneid:
                     continue
@@ -259,7 +258,7 @@ class CTD(Service):
             unique = set()
             geneid = Text.un_curie(identifier)
             url = f"{self.url}CTD_chem_gene_expanded_geneID/ncbigene:{geneid}/"
-            obj = requests.get (url).json ()
+            obj = self.http_get(url).json ()
             for r in obj:
                 good_row, predicate_label, props, pmids = self.check_expanded_gene_chemical_row(r)
                 if not good_row:
@@ -292,7 +291,7 @@ class CTD(Service):
         for identifier in identifiers:
             unique = set()
             url = f"{self.url}CTD_exposure_events_diseaseid/{Text.un_curie(identifier)}/"
-            obj = requests.get (url).json ()
+            obj = self.http_get(url).json ()
             logger.info(url)
             logger.info(len(obj))
             for r in obj:
@@ -320,7 +319,7 @@ class CTD(Service):
             unique = set()
             url = f"{self.url}CTD_chemicals_diseases_DiseaseID/{identifier}/"
             logger.info(url)
-            obj = requests.get (url).json ()
+            obj = self.http_get(url).json ()
             logger.info(len(obj))
             chemical_evidence_basket = {}
             for r in obj:
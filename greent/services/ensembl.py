@@ -1,13 +1,21 @@
-import requests
 from greent import node_types
 from greent.graph_components import KNode, LabeledID
 from greent.service import Service
 from greent.util import Text, LoggingUtil
 from collections import namedtuple
-import logging,json,sqlite3,os,requests,pickle
+import logging,json,sqlite3,os,pickle
+
+try:
+    from greent.gene_interval_index import GeneIntervalIndex, write_gene_index
+except ImportError:
+    # without numpy, genes are found with a range query per variant
+    GeneIntervalIndex = None
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
 
+# genes within this many bases of a variant are nearby
+FLANKING_REGION_SIZE = 500000
+
 EnsemblGene = namedtuple('EnsemblGene', ['ensembl_id', 'ensembl_name', 'chromosome', 'start_position', 'end_position', 'gene_biotype', 'description'])
 
 class Ensembl(Service):
@@ -22,6 +30,9 @@ class Ensembl(Service):
 
         self.gene_db_successfully_created = False
         self.gene_db_path = os.path.join(os.path.dirname(__file__), 'genes.sqlite3')
+        # the memory mapped interval index of the genes db, built from it the first time it is needed
+        self.gene_index_path = os.path.join(os.path.dirname(__file__), 'genes_index')
+        self.gene_index = None
 
         self.persistent_conn = None
         self.all_gene_annotations = None
@@ -68,6 +79,8 @@ class Ensembl(Service):
 
         self.gene_ensembl_id_select_sql = "SELECT * FROM genes WHERE ensembl_id = ?"
 
+        self.gene_locations_select_sql = "SELECT ensembl_id, chromosome, start_pos, end_pos FROM genes;"
+
     def create_or_connect_to_genes_db(self):
         
         if not self.gene_db_successfully_created:
@@ -108,7 +121,7 @@ class Ensembl(Service):
             logger.error(f'Ensembl had a database error: {e}')
 
     def retrieve_all_genes(self):
-        genes_response = requests.get(self.ensembl_genes_url)
+        genes_response = self.http_get(self.ensembl_genes_url)
         if genes_response.status_code == 200:
             genes_data = genes_response.text.splitlines()
             if len(genes_data) > 1:
@@ -144,16 +157,26 @@ class Ensembl(Service):
 
         return None
 
-    def sequence_variant_to_gene(self, variant_node):
-        
-        flanking_region_size = 500000
-        results = []
-
+    def get_gene_index(self):
+        """ The interval index of the genes db, None if numpy is not installed. """
+        if self.gene_index is None and GeneIntervalIndex is not None:
+            db_conn = self.create_or_connect_to_genes_db()
+            # the index is rebuilt whenever the genes db changes
+            db_stat = os.stat(self.gene_db_path)
+            source = [db_stat.st_size, db_stat.st_mtime_ns]
+            self.gene_index = GeneIntervalIndex.load(self.gene_index_path, source)
+            if self.gene_index is None:
+                write_gene_index(self.gene_index_path, db_conn.execute(self.gene_locations_select_sql).fetchall(), source)
+                self.gene_index = GeneIntervalIndex.load(self.gene_index_path, source)
+        return self.gene_index
+
+    def get_variant_location(self, variant_node):
+        """ (chromosome, start, end) on HG38 from the robokop variant key of a node, None if it does not have one. """
         found_valid_robokop_key = False
         robokop_ids = variant_node.get_synonyms_by_prefix('ROBO_VARIANT')
         if not robokop_ids:
             logger.debug(f'ensembl: robokop variant key not found for variant: {variant_node.id}')
-            return results
+            return None
         else:
             try:
                 for robokop_key in robokop_ids:
@@ -167,13 +190,51 @@ class Ensembl(Service):
                     start_position = int(robokop_data[2])
                     end_position = int(robokop_data[3])
             except IndexError as e:
-                logger.debug(f'ensembl: robokop variant key not set properly for variant: {variant_node.id} - {robokop_ids[0]}')
-                return results
+                logger.debug(f'ensembl: robokop variant key not set properly for variant: {variant_node.id} - {robokop_key}')
+                return None
 
         if not found_valid_robokop_key:
             logger.debug(f'ensembl: latest robokop variant key not found for variant: {variant_node.id}')
-            return results
+            return None
+
+        return chromosome, start_position, end_position
 
+    def sequence_variant_to_gene(self, variant_node):
+        return self.batch_sequence_variant_to_gene([variant_node])[variant_node.id]
+
+    def batch_sequence_variant_to_gene(self, variant_nodes, flanking_region_size=FLANKING_REGION_SIZE):
+        """ {variant node id: [(edge, gene node)]} for the genes near each variant, found for all of them at once in the gene index. """
+        located_nodes = []
+        locations = []
+        batch_results = {}
+        for variant_node in variant_nodes:
+            batch_results[variant_node.id] = []
+            location = self.get_variant_location(variant_node)
+            if location is not None:
+                located_nodes.append(variant_node)
+                locations.append(location)
+
+        gene_index = self.get_gene_index() if locations else None
+        if gene_index is not None:
+            nearby_genes = gene_index.get_nearby_genes(locations, flanking_region_size)
+        else:
+            nearby_genes = [self.get_nearby_genes_from_db(location, flanking_region_size) for location in locations]
+
+        for variant_node, genes in zip(located_nodes, nearby_genes):
+            results = batch_results[variant_node.id]
+            for gene_id, gene_start, gene_end, distance in genes:
+                gene_node = KNode(f'ENSEMBL:{gene_id}', name=f'{gene_id}', type=node_types.GENE)
+                props = {'distance' : distance}
+                edge = self.create_edge(variant_node, gene_node, 'ensembl.sequence_variant_to_gene', variant_node.id, self.var_to_gene_predicate, url=self.gene_batch_url, properties=props)
+                results.append((edge, gene_node))
+
+            logger.info(f'ensembl sequence_variant_to_gene found {len(results)} results for {variant_node.id}')
+
+        return batch_results
+
+    def get_nearby_genes_from_db(self, location, flanking_region_size):
+        """ get_nearby_genes of the gene index for one location, with a range query on the genes db. """
+        chromosome, start_position, end_position = location
         flanking_min = start_position - flanking_region_size
         if flanking_min < 0:
             flanking_min = 0
@@ -182,29 +243,20 @@ class Ensembl(Service):
         db_conn = self.create_or_connect_to_genes_db()
         db_cursor = db_conn.cursor()
 
-        #logger.info(f'looking for genes overlapping {flanking_min}-{flanking_max}')
-
         db_cursor.execute(self.gene_range_select_sql, (chromosome, flanking_min, flanking_min, flanking_max, flanking_max, flanking_min, flanking_max))
 
-        genes_in_region = db_cursor.fetchall()
-        for gene_id_text, gene_start, gene_end in genes_in_region:
+        nearby_genes = []
+        for gene_id_text, gene_start, gene_end in db_cursor.fetchall():
             #cast this to make neo4j happy
             gene_id = str(gene_id_text)
-            #logger.info(f'Found matching gene: {gene_id},{gene_start},{gene_end}')
-            gene_node = KNode(f'ENSEMBL:{gene_id}', name=f'{gene_id}', type=node_types.GENE)
             if start_position < gene_start:
                 distance = gene_start - start_position
             elif end_position > gene_end:
                 distance = end_position - gene_end
             else:
                 distance = 0
-            props = {'distance' : distance}
-            edge = self.create_edge(variant_node, gene_node, 'ensembl.sequence_variant_to_gene', variant_node.id, self.var_to_gene_predicate, url=self.gene_batch_url, properties=props)
-            results.append((edge, gene_node))
-
-        logger.info(f'ensembl sequence_variant_to_gene found {len(results)} results for {variant_node.id}')
-
-        return results
+            nearby_genes.append((gene_id, gene_start, gene_end, distance))
+        return nearby_genes
 
     def sequence_variant_to_sequence_variant(self, variant_node):
         ld_url = '/ld/human/'
@@ -217,7 +269,7 @@ class Ensembl(Service):
         for dbsnp_curie in dbsnp_curie_ids:
             variant_id = Text.un_curie(dbsnp_curie)
             query_url = f'{self.url}{ld_url}{variant_id}/{population}{options_url}'
-            query_response = requests.get(query_url, headers={"Content-Type" : "application/json"})
+            query_response = self.http_get(query_url, headers={"Content-Type" : "application/json"})
             if query_response.status_code == 200:
                 query_json = query_response.json()
                 variant_results = self.parse_ld_variants_from_ensembl(query_json)
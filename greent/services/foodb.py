@@ -5,7 +5,6 @@ from greent.graph_components import KNode, LabeledID, KEdge
 from greent.util import Text
 from csv import reader
 import logging
-import requests
 import traceback
 import os
 
@@ -48,7 +47,7 @@ class FooDB(Service):
         try:
             # get the contents records using the food id
             in_food_id = Text.un_curie(in_food_node.id)
-            contents: list = requests.get(f"{self.url}contents_food_id/{in_food_id}/").json()
+            contents: list = self.http_get(f"{self.url}contents_food_id/{in_food_id}/").json()
 
             # loop through the contents returned
             for content in contents:
@@ -62,13 +61,13 @@ class FooDB(Service):
                 # what type of chemical substance are we working
                 if content_type == 'Compound':
                     # use the source id in the contents record to get the compounds record
-                    compound: dict = requests.get(f"{self.url}compounds_id/{content['source_id']}/").json()[0]
+                    compound: dict = self.http_get(f"{self.url}compounds_id/{content['source_id']}/").json()[0]
 
                     # inspect the compound row and return the needed data
                     good_row, food_id, node_properties = self.check_compound_row(compound)
                 elif content_type == 'Nutrient':
                     # use the source id in the contents record to get the nutrient record
-                    nutrient: dict = requests.get(f"{self.url}nutrients_id/{content['source_id']}/").json()[0]
+                    nutrient: dict = self.http_get(f"{self.url}nutrients_id/{content['source_id']}/").json()[0]
 
                     # inspect the compound row
                     good_row, food_id, node_properties = self.check_nutrient_row(nutrient)
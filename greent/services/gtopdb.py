@@ -1,5 +1,4 @@
 import logging
-import requests
 from datetime import datetime as dt
 from greent.service import Service
 from greent.graph_components import KNode, LabeledID
@@ -23,7 +22,7 @@ class gtopdb(Service):
             url=f"{self.url}/ligands/{ligandId}/precursors"
             logger.debug(url)
             try:
-                obj = requests.get(url).json ()
+                obj = self.http_get(url).json ()
             except:
                 continue
             for r in obj:
@@ -46,7 +45,7 @@ class gtopdb(Service):
             ligandId = Text.un_curie(identifier)
             url=f"{self.url}/ligands/{ligandId}/interactions"
             try:
-                obj = requests.get(url).json ()
+                obj = self.http_get(url).json ()
             except:
                 continue
             for r in obj:
@@ -66,7 +65,7 @@ class gtopdb(Service):
             targetid = Text.un_curie(identifier)
             url=f"{self.url}/targets/{targetid}/interactions"
             try:
-                obj = requests.get(url).json ()
+                obj = self.http_get(url).json ()
             except:
                 continue
             for r in obj:
@@ -84,7 +83,7 @@ class gtopdb(Service):
             ligandid = Text.un_curie(identifier)
             url=f"{self.url}/ligands/{ligandid}"
             try:
-                obj = requests.get(url).json ()
+                obj = self.http_get(url).json ()
             except:
                 continue
             if obj['species'] != 'Human':
@@ -1,4 +1,3 @@
-import requests
 from ftplib import FTP
 from greent import node_types
 from greent.graph_components import KNode, LabeledID
@@ -345,7 +344,7 @@ class GWASCatalog(Service):
         return return_results
 
     def query_service(self, query_url):
-        query_response = requests.get(query_url)
+        query_response = self.http_get(query_url)
         if query_response.status_code == 200:
             query_json = query_response.json()
             return query_json
@@ -1,4 +1,3 @@
-import requests
 from greent import node_types
 from greent.graph_components import LabeledID, KNode, KEdge
 from greent.service import Service
@@ -45,7 +44,7 @@ class HGNC(Service):
         logger.debug(f'Try {url}')
         while num_tries < max_tries:
             try:
-                response = requests.get(url , headers= headers)
+                response = self.http_get(url , headers= headers)
                 return response.json()
             except Exception as e:
                 num_tries += 1
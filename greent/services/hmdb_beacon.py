@@ -1,4 +1,3 @@
-import requests
 import json
 from greent.service import Service
 from greent.util import LoggingUtil
@@ -43,7 +42,7 @@ class HMDB(Service):
             url = '{0}/concepts?keywords={1}&semanticGroups=DISO'.format (self.url, keyword)
         else:
             url = '{0}/concepts?keywords={1}'.format (self.url, keyword)
-        return requests.get (url).json ()
+        return self.http_get(url).json ()
 
     def normalize_smpdb_ids(self, curie):
         smp_id = Text.un_curie(curie)
@@ -74,7 +73,7 @@ class HMDB(Service):
 
     def request_statement(self,old_node,input_identifier,node_type,fname):
         url = f'{self.url}/statements?s={input_identifier}&categories={self.concepts_robo2hmdb[node_type]}'
-        raw_results = requests.get(url).json()
+        raw_results = self.http_get(url).json()
         results = []
         for triple in raw_results:
             subject_node = self.make_node(triple['subject'])
@@ -1,4 +1,3 @@
-import requests
 import json
 from greent.service import Service
 from greent.util import LoggingUtil
@@ -35,7 +34,7 @@ class KEGG(Service):
         results = []
         for cid in identifiers:
             url = f'{self.url}/link/reaction/{Text.un_curie(cid)}'
-            raw_results = requests.get(url)
+            raw_results = self.http_get(url)
             self.parse_raw_results(raw_results, results,'rn')
         return results
 
@@ -44,7 +43,7 @@ class KEGG(Service):
         results = []
         for cid in identifiers:
             url = f'{self.url}/link/reaction/{Text.un_curie(cid)}'
-            raw_results = requests.get(url)
+            raw_results = self.http_get(url)
             self.parse_raw_results(raw_results, results,'rn')
         return results
 
@@ -53,7 +52,7 @@ class KEGG(Service):
         results=[]
         rid = reaction_id.split(':')[1]
         url = f'{self.url}/link/cpd/{rid}'
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         self.parse_raw_results(raw_results, results, 'cpd')
         return results
 
@@ -61,7 +60,7 @@ class KEGG(Service):
     def get_rp_from_enzyme(self,enzyme_id):
         url = f'{self.url}/get/ec:{enzyme_id}'
         reaction = {}
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         substrates=set()
         products=set()
         mode = 'looking'
@@ -83,7 +82,7 @@ class KEGG(Service):
 
     def hsa2ncbi(self,hsaid):
         url = f'{self.url}/conv/ncbi-geneid/hsa:{hsaid}'
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         ncbis = []
         if raw_results.status_code == 200:
             for line in raw_results.text.split('\n'):
@@ -97,7 +96,7 @@ class KEGG(Service):
     def get_human_genes(self,ko):
         """Given a KEGG Orthology ID, get Human Genes that have an HGNC identifier"""
         url = f'{self.url}/get/{ko}'
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         for line in raw_results.text.split('\n'):
             if not line.startswith(' '):
                 if len(line.strip()) > 0:
@@ -122,7 +121,7 @@ class KEGG(Service):
         # For gene, we really have to use the orthology section, not the EC.  And it may return multiple values.
         url = f'{self.url}/get/{reaction_id}'
         reactions = []
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         #estring = None
         #elist = []
         ko2eclist = {}
@@ -270,7 +269,7 @@ class KEGG(Service):
     # As for crawling them and pulling the sequence, should we be going through the KEGG client? probably?
     def pull_sequences(self):
         kegg_sequences = defaultdict(set)
-        r=requests.get('https://www.genome.jp/kegg-bin/download_htext?htext=br08005.keg&format=json&filedir=')
+        r=self.http_get('https://www.genome.jp/kegg-bin/download_htext?htext=br08005.keg&format=json&filedir=')
         j = r.json()
         identifiers = []
         self.handle_kegg_list(j['children'],identifiers)
@@ -297,7 +296,7 @@ class KEGG(Service):
         #phosphoGlutamate?  This matches for
         aamap['Glp'] = 'Q'
         url = f'{self.url}/get/cpd:{compound_id}'
-        raw_results = requests.get(url)
+        raw_results = self.http_get(url)
         results = raw_results.text.split('\n')
         mode = 'looking'
         for line in results:
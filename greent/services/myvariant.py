@@ -2,10 +2,27 @@ from greent import node_types
 from greent.graph_components import KNode, LabeledID
 from greent.service import Service
 from greent.util import Text, LoggingUtil
-import requests,logging,json,os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import logging,json,os
 
 logger = LoggingUtil.init_logging(__name__, logging.INFO, logFilePath=f'{os.environ["ROBOKOP_HOME"]}/logs/')
 
+# the most ids MyVariant takes in one POST
+BATCH_SIZE = 1000
+# POSTs in flight at once when streaming, the service policy (max_in_flight) still applies
+DEFAULT_BATCH_WORKERS = 4
+
+
+def get_batches(items, batch_size):
+    """ Lists of up to batch_size items from any iterable. """
+    items = iter(items)
+    batch = list(islice(items, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(items, batch_size))
+
+
 class MyVariant(Service):
     
     def __init__(self, context, rosetta):
@@ -18,50 +35,94 @@ class MyVariant(Service):
         self.already_synonymized_gene_nodes = {}
 
     def batch_sequence_variant_to_gene(self, variant_nodes):
-        if len(variant_nodes) <= 1000:
-            annotation_dictionary = {}
-            post_params = {'fields' : self.url_fields, 'ids' : '', 'assembly': 'hg38'}
-            node_lookup = {}
-            for node in variant_nodes:
-                # default to empty result for invalid or missing IDs
-                annotation_dictionary[node.id] = []
-                # we could support hg19 as well, but calls need to be all one or the other
-                # for now we only do hg38
-                myvariant_curies = node.get_synonyms_by_prefix('MYVARIANT_HG38')
-                if not myvariant_curies:
-                    logger.info(f'No MYVARIANT_HG38 synonym found for: {node.id}')
-                else:
-                    for myvar_curie in myvariant_curies:
-                        myvar_id = Text.un_curie(myvar_curie)
-                        post_params['ids'] += f'{myvar_id},'
-                        node_lookup[myvar_id] = node
-
-            if not post_params['ids']:
+        if len(variant_nodes) <= BATCH_SIZE:
+            annotation_dictionary, node_lookup, post_params = self.get_batch_request(variant_nodes)
+            if post_params is None:
                 logger.warning('batch_sequence_variant_to_gene called but all nodes provided had no MyVariant IDs')
                 return annotation_dictionary
-
-            # remove that extra comma
-            post_params['ids'] = post_params['ids'][:-1]
-            query_url = f'{self.url}variant'
-            query_response = requests.post(query_url, data=post_params)
-            if query_response.status_code == 200:
-                query_json = query_response.json()
-                for annotation_json in query_json:
-                    try:
-                        myvar_id = annotation_json['_id']
-                        myvar_curie = f'MYVARIANT_HG38:{myvar_id}'
-                        variant_node = node_lookup[myvar_id]
-                        results = self.process_annotation(variant_node, annotation_json, myvar_curie, query_url)
-                        if results:
-                            annotation_dictionary[variant_node.id] = results
-                    except KeyError as e:
-                        logger.warning(f'MyVariant batch call failed for annotation: {annotation_json["query"]}')
-            else:
-                logger.error(f'MyVariant non-200 response on batch: {query_response.status_code})')
+            query_json = self.post_batch(post_params)
+            if query_json is not None:
+                self.process_batch(annotation_dictionary, node_lookup, query_json)
             return annotation_dictionary
         else:
             raise Exception('More than 1000 nodes attemped for MyVariant batch call - not supported.')
 
+    def stream_sequence_variant_to_gene(self, variant_nodes, batch_size=BATCH_SIZE, workers=DEFAULT_BATCH_WORKERS):
+        """ Like batch_sequence_variant_to_gene, for any number of variant nodes (any iterable, consumed lazily).
+
+        Nodes are posted batch_size at a time with up to workers posts in flight. Yields one
+        {variant node id: [(edge, gene node)]} dictionary per batch, in the order the posts finish.
+        Batches whose post fails are logged and not yielded, so callers that cache results will
+        retry them on their next run. Annotations are processed (and genes synonymized) on the
+        calling thread. """
+        pending = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in get_batches(variant_nodes, batch_size):
+                annotation_dictionary, node_lookup, post_params = self.get_batch_request(batch)
+                if post_params is None:
+                    yield annotation_dictionary
+                    continue
+                pending[executor.submit(self.post_batch, post_params)] = (annotation_dictionary, node_lookup)
+                if len(pending) >= workers:
+                    yield from self.get_finished_batches(pending)
+            while pending:
+                yield from self.get_finished_batches(pending)
+
+    def get_finished_batches(self, pending):
+        """ Waits for a post to finish and processes every finished one, removing them from pending. """
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            annotation_dictionary, node_lookup = pending.pop(future)
+            try:
+                query_json = future.result()
+            except Exception as e:
+                logger.error(f'MyVariant batch call failed: {e}')
+                continue
+            if query_json is not None:
+                yield self.process_batch(annotation_dictionary, node_lookup, query_json)
+
+    def get_batch_request(self, variant_nodes):
+        """ The empty results, {myvariant id: node} and post parameters (None if no node has a MyVariant id) of a batch. """
+        annotation_dictionary = {}
+        node_lookup = {}
+        for node in variant_nodes:
+            # default to empty result for invalid or missing IDs
+            annotation_dictionary[node.id] = []
+            # we could support hg19 as well, but calls need to be all one or the other
+            # for now we only do hg38
+            myvariant_curies = node.get_synonyms_by_prefix('MYVARIANT_HG38')
+            if not myvariant_curies:
+                logger.info(f'No MYVARIANT_HG38 synonym found for: {node.id}')
+            else:
+                for myvar_curie in myvariant_curies:
+                    node_lookup[Text.un_curie(myvar_curie)] = node
+        if not node_lookup:
+            return annotation_dictionary, node_lookup, None
+        post_params = {'fields': self.url_fields, 'ids': ','.join(node_lookup), 'assembly': 'hg38'}
+        return annotation_dictionary, node_lookup, post_params
+
+    def post_batch(self, post_params):
+        """ The annotations MyVariant returns for a batch, None if the call fails. """
+        query_response = self.http_post(f'{self.url}variant', data=post_params)
+        if query_response.status_code != 200:
+            logger.error(f'MyVariant non-200 response on batch: {query_response.status_code})')
+            return None
+        return query_response.json()
+
+    def process_batch(self, annotation_dictionary, node_lookup, query_json):
+        query_url = f'{self.url}variant'
+        for annotation_json in query_json:
+            try:
+                myvar_id = annotation_json['_id']
+                myvar_curie = f'MYVARIANT_HG38:{myvar_id}'
+                variant_node = node_lookup[myvar_id]
+                results = self.process_annotation(variant_node, annotation_json, myvar_curie, query_url)
+                if results:
+                    annotation_dictionary[variant_node.id] = results
+            except KeyError as e:
+                logger.warning(f'MyVariant batch call failed for annotation: {annotation_json["query"]}')
+        return annotation_dictionary
+
     def sequence_variant_to_gene(self, variant_node):
         return_results = []
         myvariant_ids = variant_node.get_synonyms_by_prefix('MYVARIANT_HG38')
@@ -75,7 +136,7 @@ class MyVariant(Service):
             for curie_myvariant_id in myvariant_ids:
                 myvariant_id = Text.un_curie(curie_myvariant_id)
                 query_url = f'{self.url}variant/{myvariant_id}?assembly={myvariant_assembly}&fields=snpeff'
-                query_response = requests.get(query_url)
+                query_response = self.http_get(query_url)
                 if query_response.status_code == 200:
                     query_json = query_response.json()
                     return_results.extend(self.process_annotation(variant_node, query_json, curie_myvariant_id, query_url))
@@ -2,6 +2,9 @@ from string import Template
 import json
 import os
 import logging
+import queue
+import threading
+from contextlib import contextmanager
 from greent.service import Service
 from greent.triplestore import TripleStore
 from greent.util import LoggingUtil
@@ -17,25 +20,135 @@ logger = LoggingUtil.init_logging(__name__, logging.INFO)
 
 """OMNICORP IS NO LONGER CALLED FROM INTERFACES"""
 
+
+class OmnicorpPool:
+    """ A fixed size pool of DB-API connections to the OmniCorp database.
+
+    Statements are named and, on postgres, PREPAREd once per connection and then only EXECUTEd, so the
+    server plans each query once. Lists of curies are passed as one array parameter (= ANY($n)).
+    Any other DB-API module (e.g. sqlite3 with the tables in an attached database called omnicorp) can
+    stand in with prepare=False; lists are then expanded into IN (...) with the module's placeholder. """
+
+    def __init__(self, connect, size=4, prepare=True, placeholder='%s'):
+        self.connect = connect
+        self.size = int(size)
+        self.prepare = prepare
+        self.placeholder = placeholder
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        # connection -> names of the statements prepared on it
+        self.prepared = {}
+
+    @staticmethod
+    def from_config(config):
+        def connect():
+            return psycopg2.connect(dbname=config['OMNICORP_DB'], user=config['OMNICORP_USER'],
+                                    host=config['OMNICORP_HOST'], port=config['OMNICORP_PORT'],
+                                    password=config['OMNICORP_PASSWORD'])
+        return OmnicorpPool(connect, config.get('OMNICORP_POOL_SIZE') or 4)
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection, waiting for one if size are in use. A connection whose commit or
+        rollback fails is closed and its slot freed, rather than handed to the next caller. """
+        while True:
+            with self.lock:
+                if self.idle.empty() and self.created < self.size:
+                    self.created += 1
+                    conn = None
+                    break
+            conn = self.idle.get()
+            # None means a slot was freed, try to take it
+            if conn is not None:
+                break
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                self.free_slot()
+                raise
+            self.prepared[conn] = set()
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f'Discarding an omnicorp connection that failed to roll back: {e}')
+                self.discard(conn)
+            else:
+                self.idle.put(conn)
+            raise
+        try:
+            conn.commit()
+        except Exception:
+            self.discard(conn)
+            raise
+        self.idle.put(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.free_slot(conn)
+
+    def free_slot(self, conn=None):
+        with self.lock:
+            self.created -= 1
+            self.prepared.pop(conn, None)
+        # wake a caller waiting for a connection, so it can connect in the freed slot
+        self.idle.put(None)
+
+    def execute(self, conn, name, statement, *args):
+        """ Run a named statement and return its rows. statement is a str.format template whose fields
+        are filled with the parameter markers, {0} for args[0] and so on. A list arg becomes a membership
+        test, so write e.g. "curie {0}" and pass a list of curies. """
+        cursor = conn.cursor()
+        try:
+            if self.prepare:
+                if name not in self.prepared[conn]:
+                    markers = [f'= ANY(${i + 1})' if isinstance(arg, list) else f'${i + 1}' for i, arg in enumerate(args)]
+                    cursor.execute(f'PREPARE {name} AS {statement.format(*markers)}')
+                    self.prepared[conn].add(name)
+                cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(args))})', args)
+            else:
+                markers = []
+                params = []
+                for arg in args:
+                    if isinstance(arg, list):
+                        markers.append(f'IN ({", ".join([self.placeholder] * len(arg))})')
+                        params.extend(arg)
+                    else:
+                        markers.append(self.placeholder)
+                        params.append(arg)
+                cursor.execute(statement.format(*markers), params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def close(self):
+        while not self.idle.empty():
+            conn = self.idle.get()
+            if conn is not None:
+                conn.close()
+        self.prepared = {}
+
+
 class OmniCorp(Service):
 
-    def __init__(self, context): #triplestore):
+    def __init__(self, context, pool=None): #triplestore):
         super(OmniCorp, self).__init__("omnicorp", context)
-        db = context.config['OMNICORP_DB']
-        user = context.config['OMNICORP_USER']
-        port = context.config['OMNICORP_PORT']
-        host = context.config['OMNICORP_HOST']
-        password = context.config['OMNICORP_PASSWORD']
         self.prefixes = set(['UBERON', 'BSPO', 'PATO', 'GO', 'MONDO', 'HP', 'ENVO', 'OBI', 'CL', 'SO', 'CHEBI', 'HGNC', 'MESH'])
-        #self.conn = psycopg2.connect(dbname=db, user=user, host=host, port=port, password=password)
-	self.conn = None
+        self.pool = OmnicorpPool.from_config(context.config) if pool is None else pool
         self.nsingle = 0
         self.total_single_call = datetime.timedelta()
         self.npair = 0
         self.total_pair_call = datetime.timedelta()
 
     def __del__(self):
-        self.conn.close()
+        self.pool.close()
 
     def get_omni_identifier(self,node):
         #Let's start with just the 'best' identifier
@@ -65,15 +178,14 @@ class OmniCorp(Service):
         prefix1 = Text.get_curie(id1)
         prefix2 = Text.get_curie(id2)
         start = datetime.datetime.now()
-        cur = self.conn.cursor()
-        statement = f'''SELECT a.pubmedid 
+        statement = f'''SELECT a.pubmedid
            FROM omnicorp.{prefix1} a
            JOIN omnicorp.{prefix2} b ON a.pubmedid = b.pubmedid
-           WHERE a.curie = %s
-           AND b.curie = %s '''
-        cur.execute(statement, (id1, id2))
-        pmids = [ x[0] for x in cur.fetchall() ]
-        cur.close()
+           WHERE a.curie = {{0}}
+           AND b.curie = {{1}} '''
+        with self.pool.connection() as conn:
+            rows = self.pool.execute(conn, f'shared_{prefix1}_{prefix2}', statement, id1, id2)
+        pmids = [ x[0] for x in rows ]
         end = datetime.datetime.now()
         self.total_pair_call += (end-start)
         logger.debug(f'Found {len(pmids)} shared ids in {end-start}. Total {self.total_pair_call}')
@@ -88,11 +200,9 @@ class OmniCorp(Service):
             return 0
         prefix = Text.get_curie(identifier)
         start = datetime.datetime.now()
-        cur = self.conn.cursor()
-        statement = f'SELECT COUNT(pubmedid) from omnicorp.{prefix} WHERE curie = %s'
-        cur.execute(statement, (identifier,))
-        n = cur.fetchall()[0][0]
-        cur.close()
+        statement = f'SELECT COUNT(pubmedid) from omnicorp.{prefix} WHERE curie = {{0}}'
+        with self.pool.connection() as conn:
+            n = self.pool.execute(conn, f'count_{prefix}', statement, identifier)[0][0]
         end = datetime.datetime.now()
         self.total_single_call += (end-start)
         logger.debug(f'Found {n} pmids in {end-start}. Total {self.total_single_call}')
@@ -101,6 +211,67 @@ class OmniCorp(Service):
             logger.info(f'NCalls: {self.nsingle} Total time: {self.total_single_call}  Avg Time: {self.total_single_call/self.nsingle}')
         return n
 
+    def get_curies_by_prefix(self, nodes):
+        """ {prefix: {curie: [positions of the nodes with that curie]}} for the nodes OmniCorp has a table for. """
+        by_prefix = defaultdict(lambda: defaultdict(list))
+        for i, node in enumerate(nodes):
+            identifier = self.get_omni_identifier(node)
+            if identifier is not None:
+                by_prefix[Text.get_curie(identifier)][identifier].append(i)
+        return by_prefix
+
+    def count_all_pmids(self, nodes):
+        """ {node: number of pmids} for every node, with one query per prefix table. """
+        counts = {node: 0 for node in nodes}
+        start = datetime.datetime.now()
+        with self.pool.connection() as conn:
+            for prefix, curies in self.get_curies_by_prefix(nodes).items():
+                statement = f'''SELECT curie, COUNT(pubmedid)
+                   FROM omnicorp.{prefix}
+                   WHERE curie {{0}}
+                   GROUP BY curie'''
+                for curie, n in self.pool.execute(conn, f'count_all_{prefix}', statement, sorted(curies)):
+                    for i in curies[curie]:
+                        counts[nodes[i]] = n
+        logger.debug(f'Counted pmids of {len(nodes)} nodes in {datetime.datetime.now()-start}')
+        return counts
+
+    def get_all_shared_pmids(self, nodes):
+        """ {(node_i, node_j): shared PubMed id curies} for every pair of nodes, i before j.
+
+        Rather than a query per pair, there is one join per pair of prefix tables, restricted to the
+        curies of the nodes, so N nodes take P(P+1)/2 queries for P distinct prefixes. """
+        shared = defaultdict(list)
+        by_prefix = self.get_curies_by_prefix(nodes)
+        prefixes = sorted(by_prefix)
+        start = datetime.datetime.now()
+        with self.pool.connection() as conn:
+            for n, prefix1 in enumerate(prefixes):
+                for prefix2 in prefixes[n:]:
+                    name = f'shared_all_{prefix1}_{prefix2}'
+                    statement = f'''SELECT a.curie, b.curie, a.pubmedid
+                       FROM omnicorp.{prefix1} a
+                       JOIN omnicorp.{prefix2} b ON a.pubmedid = b.pubmedid
+                       WHERE a.curie {{0}}
+                       AND b.curie {{1}}'''
+                    if prefix1 == prefix2:
+                        # each pair of curies once; a curie on more than one node shares all its pmids with itself
+                        repeated = any(len(positions) > 1 for positions in by_prefix[prefix1].values())
+                        statement += ' AND a.curie <= b.curie' if repeated else ' AND a.curie < b.curie'
+                        name += '_repeated' if repeated else ''
+                    rows = self.pool.execute(conn, name, statement, sorted(by_prefix[prefix1]), sorted(by_prefix[prefix2]))
+                    for curie1, curie2, pmid in rows:
+                        for i in by_prefix[prefix1][curie1]:
+                            for j in by_prefix[prefix2][curie2]:
+                                if i != j and (curie1 != curie2 or i < j):
+                                    shared[(min(i, j), max(i, j))].append(f'PMID:{pmid}')
+        pubmeds = {}
+        for i, node_i in enumerate(nodes):
+            for j in range(i + 1, len(nodes)):
+                pubmeds[(node_i, nodes[j])] = shared.get((i, j), [])
+        logger.debug(f'Found shared pmids of {len(nodes)} nodes in {datetime.datetime.now()-start}')
+        return pubmeds
+
 '''
     def query_omnicorp (self, query):
         """ Execute and return the result of a SPARQL query. """
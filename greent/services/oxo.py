@@ -1,5 +1,4 @@
 import json
-import requests
 from greent.service import Service
 from greent.graph_components import LabeledID
 import time
@@ -33,7 +32,7 @@ class OXO(Service):
         return cp != None and  (cp in self.curies or cp.upper() in self.curies)
 
     def request(self, url, obj):
-        return requests.post(self.url,
+        return self.http_post(self.url,
                              data=json.dumps(obj, indent=2),
                              headers={"Content-Type": "application/json"})
 
@@ -71,7 +70,7 @@ class OXO(Service):
         wait_time = 5 # seconds
         while num_tries < max_tries:
             try:
-                resp = requests.get(url)
+                resp = self.http_get(url)
                 if resp.status_code == 200:
                     return resp.json()
             except Exception as e:
@@ -7,7 +7,6 @@ import logging
 from greent.util import LoggingUtil, Text
 from greent import node_types
 from greent.graph_components import KEdge, KNode, LabeledID
-import requests 
 
 
 logger = LoggingUtil.init_logging(__name__, level=logging.DEBUG)
@@ -166,7 +165,7 @@ class Panther(Service):
         for gene_family_data in rows: 
             gene_data = gene_family_data['gene_identifier']
             gene_id = gene_data['gene_id'].replace('=',':')
-            gene_name = requests.get(f'https://bionames.renci.org/ID_to_label/{gene_id}/').json()[0]['label'] 
+            gene_name = self.http_get(f'https://bionames.renci.org/ID_to_label/{gene_id}/').json()[0]['label'] 
             gene_name = gene_name if gene_name else gene_id        
             gene_node = KNode(gene_id, type= node_types.GENE, name= gene_name)
             
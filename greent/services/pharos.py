@@ -1,6 +1,5 @@
 import asyncio
 import concurrent.futures
-import requests
 import json
 import logging
 import sys
@@ -26,7 +25,7 @@ class Pharos(Service):
     def request(self, url):
         response = None
         try:
-            response = requests.get(url).json()
+            response = self.http_get(url).json()
         except:
             traceback.print_exc()
         return response
@@ -59,7 +58,7 @@ class Pharos(Service):
         There are numerous other synonyms that we could also cache, but I don't see much benefit here. """
         result = None
         try:
-            r = requests.get('https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms' % target_id)
+            r = self.http_get('https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms' % target_id)
             result = r.json()
             for synonym in result:
                 if synonym['label'] == 'HGNC':
@@ -71,13 +70,13 @@ class Pharos(Service):
 
     def drugname_string_to_pharos_info(self, drugname):
         """Exposed for use in name lookups without KNodes"""
-        r = requests.get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname)).json()
+        r = self.http_get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname)).json()
         return_results = set()
         foundany = False
         for contents in r['content']:
             foundany=True
             synonym_href = contents['_synonyms']['href']
-            sres = requests.get(synonym_href).json()
+            sres = self.http_get(synonym_href).json()
             for syno in sres:
                 if syno['href'].startswith('https://www.ebi.ac.uk/chembl/compound/inspect/'):
                     term = syno['href'].split('/')[-1]
@@ -104,7 +103,7 @@ class Pharos(Service):
     def drugid_to_identifiers(self,refid):
         logger.debug(f'drugid_to_identifier {refid}')
         url = 'https://pharos.nih.gov/idg/api/v1/ligands(%s)/synonyms' % refid
-        result = requests.get(url).json()
+        result = self.http_get(url).json()
         logger.debug('back')
         chemblid = None
         label = None
@@ -126,7 +125,7 @@ class Pharos(Service):
                 pharosid = Text.un_curie(s)
                 original_edge_nodes = []
                 url = 'https://pharos.nih.gov/idg/api/v1/targets(%s)?view=full' % pharosid
-                r = requests.get(url)
+                r = self.http_get(url)
                 try:
                     result = r.json()
                     logger.debug('back')
@@ -160,7 +159,7 @@ class Pharos(Service):
             pharosid = Text.un_curie(s)
             original_edge_nodes = []
             url = 'https://pharos.nih.gov/idg/api/v1/ligands(%s)?view=full' % pharosid
-            r = requests.get(url)
+            r = self.http_get(url)
             try: 
                 result = r.json()
             except:
@@ -190,7 +189,7 @@ class Pharos(Service):
             original_edge_nodes = []
             url='https://pharos.nih.gov/idg/api/v1/diseases/%s?view=full' % pharosid
             logger.info(url)
-            r = requests.get(url)
+            r = self.http_get(url)
             result = r.json()
             predicate=LabeledID(identifier='PHAROS:gene_involved', label='gene_involved')
             for link in result['links']:
@@ -1,5 +1,4 @@
 import logging
-import requests
 from greent.service import Service
 from greent.util import Text,LoggingUtil
 from greent.graph_components import KNode,LabeledID
@@ -80,7 +79,7 @@ class QuickGo(Service):
         wait_time = 5 # seconds
         while num_tries < max_tries:
             try:
-                return requests.get(url).json()
+                return self.http_get(url).json()
             except Exception as e:
                 logger.warn(e)
                 num_tries += 1
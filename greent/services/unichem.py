@@ -1,4 +1,3 @@
-import requests
 import pprint
 from greent.service import Service
 from greent.util import Text,LoggingUtil
@@ -27,7 +26,7 @@ class UniChem(Service):
         wait_time = 5 # seconds
         while num_tries < max_tries:
             try:
-                return requests.get(url).json()
+                return self.http_get(url).json()
             except:
                 num_tries += 1
                 time.sleep(wait_time)
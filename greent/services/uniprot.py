@@ -1,4 +1,3 @@
-import requests
 from greent.service import Service
 import time
 
@@ -25,7 +24,7 @@ class UniProt(Service):
                 # verify=False flag.
                 #return requests.post(url , data =data, verify=False)
                 # The bad server has supposedly been removed.
-                return requests.post(url , data =data)
+                return self.http_post(url , data =data)
             except Exception as e:
                 print(e)
                 num_tries += 1
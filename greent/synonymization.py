@@ -3,8 +3,8 @@ from greent.graph_components import KNode, node_types
 from greent.util import  LoggingUtil
 from builder.question import LabeledID
 from greent.cache import Cache
-import requests
 import asyncio
+from greent import http_client
 from robokop_genetics.genetics_normalization import GeneticsNormalizer
 from greent.annotators.util.async_client import async_get_json
 
@@ -27,14 +27,20 @@ class Synonymizer:
     EDGE_CHUNK_SIZE = 1
     GENETICS_NORMALIZER = GeneticsNormalizer()
     SEQUENCE_VARIANT_BL_LABELS = None
+    # Local NormalizationCache consulted before the node normalization service, see configure_cache.
+    NODE_CACHE = None
+
+    @staticmethod
+    def configure_cache(node_cache):
+        """Use node_cache (a NormalizationCache, or None to turn caching off) for batch_normalize_nodes."""
+        Synonymizer.NODE_CACHE = node_cache
 
     @staticmethod
     def synonymize(node, retry=3):
         normalization_url = f'{Synonymizer.NODE_NORMALIZATION_URL}?curie={node.id}'
         response = None
         try:
-            with requests.Session() as session:
-                response = session.get(normalization_url)
+            response = http_client.get(normalization_url)
         except:
             logger.error(f"Failed to contact {normalization_url} retries left --- {retry}")
         if not response:
@@ -68,6 +74,14 @@ class Synonymizer:
             'curie_string': Knode()
         }
         """
+        results_dict = {}
+        node_cache = Synonymizer.NODE_CACHE
+        if node_cache is not None:
+            cached, node_curies = node_cache.get_many(node_curies)
+            results_dict.update({
+                curie: Synonymizer.parse_dict_to_knode(cached[curie])
+                for curie in cached if cached[curie]
+            })
         # Batch into 1000 per url
         chunk_size = Synonymizer.CHUNK_SIZE
         chunks = [node_curies[start: start + chunk_size] for start in range(0, len(node_curies), chunk_size)]
@@ -79,7 +93,6 @@ class Synonymizer:
                    chunks
                    )
         results_array = Synonymizer.async_get_json_wrapper(urls)
-        results_dict = {}
         for chunked_response in results_array:
             # Node normalization returns None with the key for some keys that were hit and missed.
             # Convert each result dict to a KNode Mixin.
@@ -88,6 +101,9 @@ class Synonymizer:
                 for curie in chunked_response if chunked_response[curie]
             }
             results_dict.update(parsed)
+            # a failed request comes back empty and is not cached, misses are cached as None
+            if node_cache is not None and chunked_response:
+                node_cache.set_many(chunked_response)
         return results_dict
 
     @staticmethod
@@ -147,12 +163,11 @@ class Synonymizer:
         """
         if not Synonymizer.SEQUENCE_VARIANT_BL_LABELS:
             bl_url = f"https://bl-lookup-sri.renci.org/bl/{node_types.SEQUENCE_VARIANT}/ancestors?version=latest"
-            with requests.session() as client:
-                response = client.get(bl_url)
-                if response.status_code == 200:
-                    Synonymizer.SEQUENCE_VARIANT_BL_LABELS =  set(response.json() + [node_types.SEQUENCE_VARIANT])
-                else:
-                    raise RuntimeError(f'Could not resolve export labels for type {node_types.SEQUENCE_VARIANT}')
+            response = http_client.get(bl_url)
+            if response.status_code == 200:
+                Synonymizer.SEQUENCE_VARIANT_BL_LABELS =  set(response.json() + [node_types.SEQUENCE_VARIANT])
+            else:
+                raise RuntimeError(f'Could not resolve export labels for type {node_types.SEQUENCE_VARIANT}')
         return Synonymizer.SEQUENCE_VARIANT_BL_LABELS
 
     @staticmethod
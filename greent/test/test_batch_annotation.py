@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from greent import node_types
+from greent.annotators import annotator_factory
+from greent.annotators.annotator import Annotator
+from greent.graph_components import KNode, LabeledID
+
+
+class FakeCache:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.gets = 0
+
+    def get_many(self, keys):
+        self.gets += 1
+        return [self.data.get(key) for key in keys]
+
+    def set_many(self, mapping):
+        self.data.update(mapping)
+
+
+class FakeRosetta:
+    def __init__(self, cache):
+        self.cache = cache
+
+
+class FakeAnnotator(Annotator):
+    def __init__(self, limit):
+        self.prefix_source_mapping = {'CHEBI': self.get_chebi, 'PUBCHEM': self.get_pubchem}
+        self.config = {'PUBCHEM': {'concurrency': limit}}
+        self.running = 0
+        self.most_running = 0
+        self.fetched = []
+
+    def __del__(self):
+        pass
+
+    async def get_pubchem(self, curie):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.fetched.append(curie)
+        return {'pubchem_id': curie}
+
+    async def get_chebi(self, curie):
+        if curie == 'CHEBI:666':
+            raise ValueError('chebi is down')
+        self.fetched.append(curie)
+        return {'chebi_id': curie}
+
+
+class FakeGenericAnnotator(FakeAnnotator):
+    def get_batch_curies(self, node):
+        return None
+
+
+@pytest.fixture()
+def annotator(monkeypatch):
+    chemical_annotator = FakeAnnotator(limit=2)
+    monkeypatch.setattr(annotator_factory, 'annotator_instances', {
+        node_types.NAMED_THING: FakeGenericAnnotator(1),
+        node_types.CHEMICAL_SUBSTANCE: chemical_annotator})
+    return chemical_annotator
+
+
+def make_node(i):
+    node = KNode(f'CHEBI:{i}', type=node_types.CHEMICAL_SUBSTANCE)
+    node.add_synonyms([LabeledID(identifier=f'CHEBI:{i}', label=''), LabeledID(identifier=f'PUBCHEM:{i}', label='')])
+    return node
+
+
+def test_annotate_nodes(annotator):
+    cache = FakeCache({'annotation(CHEBI:1)': {'chebi_id': 'cached'}})
+    nodes = [make_node(i) for i in range(1, 11)] + [make_node(666), KNode('MONDO:1', type=node_types.DISEASE)]
+    annotator_factory.annotate_nodes(nodes, FakeRosetta(cache))
+    # one lookup for the whole batch
+    assert cache.gets == 1
+    assert nodes[0].properties == {'chebi_id': 'cached', 'pubchem_id': 'PUBCHEM:1'}
+    assert nodes[4].properties == {'chebi_id': 'CHEBI:5', 'pubchem_id': 'PUBCHEM:5'}
+    assert nodes[10].properties == {'pubchem_id': 'PUBCHEM:666'}
+    assert 'CHEBI:1' not in annotator.fetched
+    assert annotator.most_running == 2
+    # failures are not cached, successes are
+    assert 'annotation(CHEBI:666)' not in cache.data
+    assert cache.data['annotation(PUBCHEM:3)'] == {'pubchem_id': 'PUBCHEM:3'}
+
+    annotator.fetched = []
+    again = [make_node(i) for i in range(1, 11)]
+    annotator_factory.annotate_nodes(again, FakeRosetta(cache))
+    assert annotator.fetched == []
+    assert again[4].properties == nodes[4].properties
@@ -1,5 +1,6 @@
 from greent.export import BufferedWriter, export_edge_chunk, export_node_chunk
 import pytest
+import time
 from unittest.mock import Mock
 from greent.graph_components import KNode, node_types, KEdge, LabeledID
 
@@ -10,6 +11,12 @@ rosetta_mock.service_context = Mock()
 rosetta_mock.service_context.config = {}
 
 
+@pytest.fixture(autouse=True)
+def in_tmpdir(tmpdir, monkeypatch):
+    # flushing writes missed_curies.lst to the working directory
+    monkeypatch.chdir(tmpdir)
+
+
 def test_can_initialize():
     assert BufferedWriter(rosetta_mock)
 
@@ -257,3 +264,166 @@ def test_edge_source_target_update_when_synmap_empty():
     assert bf.synonym_map == {}
     bf.flush_edges(session)
     # if succeeded this means its has converted the ids properly
+
+
+def recording_writer(monkeypatch, writer_class=BufferedWriter, **writer_conf):
+    """A writer whose neo4j session records transactions and whose normalization is a no-op."""
+    import greent.export
+    from unittest.mock import MagicMock
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_nodes', lambda curies: {})
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_sequence_variants', lambda curies: {})
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_edges', lambda predicates: {})
+    monkeypatch.setattr(greent.export.BufferedWriter, 'write_missed_curies_to_file', lambda self: None)
+    rosetta = Mock()
+    rosetta.service_context.config = {'writer': writer_conf}
+    transactions = []
+    session = MagicMock()
+    session.__enter__.return_value = session
+    session.write_transaction = lambda func, items, *args: transactions.append((func, list(items)))
+    rosetta.type_graph.driver.session.return_value = session
+    return writer_class(rosetta), transactions
+
+
+def make_edge(source, target):
+    return KEdge({'source_id': source, 'target_id': target, 'provided_by': 'test.op',
+                  'original_predicate': LabeledID(identifier='RO:1', label='related to'),
+                  'standard_predicate': None, 'publications': []})
+
+
+def test_nodes_flush_without_edges(monkeypatch):
+    bf, transactions = recording_writer(monkeypatch, node_batch_size=2, edge_batch_size=100, min_batch_size=1, adaptive=False)
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    bf.write_edge(make_edge('A:1', 'B:1'))
+    assert transactions == []
+    bf.write_node(KNode('B:1', type=node_types.NAMED_THING))
+    assert [func for func, _ in transactions] == [export_node_chunk]
+    assert len(bf.edge_queues) == 1
+
+
+def test_edges_flush_after_their_nodes(monkeypatch):
+    bf, transactions = recording_writer(monkeypatch, node_batch_size=100, edge_batch_size=1, min_batch_size=1, adaptive=False)
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    bf.write_node(KNode('B:1', type=node_types.NAMED_THING))
+    bf.write_edge(make_edge('A:1', 'B:1'))
+    assert [func for func, _ in transactions] == [export_node_chunk, export_edge_chunk]
+    assert bf.pending_nodes == 0 and bf.edge_queues == []
+
+
+def test_flush_by_age_and_bytes(monkeypatch):
+    bf, transactions = recording_writer(monkeypatch, max_age=0, min_batch_size=1)
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    assert len(transactions) == 1
+    bf, transactions = recording_writer(monkeypatch, max_bytes=1, min_batch_size=1)
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    assert len(transactions) == 1
+
+
+def test_adaptive_batch_size():
+    from greent.export import AdaptiveBatchSize
+    batch = AdaptiveBatchSize(size=100, minimum=10, maximum=200, target_latency=1.0)
+    batch.observe(0.1, 100)
+    assert batch.size == 150
+    batch.observe(0.1, 10)
+    assert batch.size == 150
+    batch.observe(0.1, 150)
+    assert batch.size == 200
+    batch.observe(5.0, 200)
+    assert batch.size == 100
+    for _ in range(10):
+        batch.observe(5.0, 10)
+    assert batch.size == 10
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_adaptive_batch_size_grows_across_predicates(monkeypatch, pipelined):
+    from greent.export import PipelinedBufferedWriter
+    bf, transactions = recording_writer(monkeypatch, PipelinedBufferedWriter if pipelined else BufferedWriter,
+                                        edge_batch_size=100, min_batch_size=10)
+    with bf:
+        for i in range(100):
+            edge = make_edge(f'A:{i}', 'B:1')
+            edge.standard_predicate = LabeledID(identifier=f'RO:{i % 4}', label='related to')
+            bf.write_edge(edge)
+        if pipelined:
+            bf.flush()
+    # one full flush in four transactions of 25 edges grows the batch about as much as one of 100 would
+    assert sorted(len(items) for func, items in transactions) == [25, 25, 25, 25]
+    assert 140 <= bf.edge_batch.size <= 170
+
+
+def test_pipelined_writer_orders_edges_after_nodes(monkeypatch):
+    import time
+    from greent.export import PipelinedBufferedWriter
+    bf, transactions = recording_writer(monkeypatch, PipelinedBufferedWriter, node_batch_size=1, edge_batch_size=1,
+                                        min_batch_size=1, adaptive=False, transaction_workers=4)
+    events = []
+
+    def slow_export(func, items, *args):
+        events.append(('start', func))
+        if func is export_node_chunk:
+            time.sleep(0.05)
+        events.append(('end', func))
+    bf.driver.session.return_value.write_transaction = slow_export
+    with bf:
+        bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+        bf.write_node(KNode('B:1', type=node_types.NAMED_THING))
+        bf.write_edge(make_edge('A:1', 'B:1'))
+        bf.flush()
+        assert len(events) == 6
+    last_node_end = max(i for i, event in enumerate(events) if event == ('end', export_node_chunk))
+    assert events.index(('start', export_edge_chunk)) > last_node_end
+    assert not bf.thread.is_alive()
+
+
+def test_pipelined_writer_reports_errors(monkeypatch):
+    from greent.export import PipelinedBufferedWriter
+    bf, transactions = recording_writer(monkeypatch, PipelinedBufferedWriter, node_batch_size=1,
+                                        min_batch_size=1, adaptive=False)
+
+    def failing_export(func, items, *args):
+        raise ValueError('neo4j is down')
+    bf.driver.session.return_value.write_transaction = failing_export
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    with pytest.raises(ValueError):
+        bf.flush()
+    bf.close()
+    # leaving the context closes the writer even when the flush fails
+    bf, transactions = recording_writer(monkeypatch, PipelinedBufferedWriter, node_batch_size=1,
+                                        min_batch_size=1, adaptive=False)
+    bf.driver.session.return_value.write_transaction = failing_export
+    with pytest.raises(ValueError):
+        with bf:
+            bf.write_node(KNode('A:1', type=node_types.NAMED_THING))
+    assert bf.closed
+
+
+def test_pipelined_writer_waits_for_every_transaction():
+    from concurrent.futures import ThreadPoolExecutor
+    from greent.export import PipelinedBufferedWriter
+    finished = []
+
+    def fail():
+        raise ValueError('neo4j is down')
+
+    def slow():
+        time.sleep(0.05)
+        finished.append(True)
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(fail), executor.submit(slow)]
+        with pytest.raises(ValueError):
+            PipelinedBufferedWriter.wait_for(None, futures)
+        assert finished == [True] and futures == []
+
+
+def test_nodes_annotated_in_one_batch(monkeypatch):
+    import greent.export
+    batches = []
+    monkeypatch.setattr(greent.export, 'annotate_nodes', lambda nodes, rosetta: batches.append([n.id for n in nodes]))
+    bf, transactions = recording_writer(monkeypatch, node_batch_size=3, min_batch_size=1, adaptive=False)
+    bf.write_node(KNode('A:1', type=node_types.NAMED_THING), annotate=True)
+    bf.write_node(KNode('B:1', type=node_types.NAMED_THING))
+    assert batches == []
+    bf.write_node(KNode('C:1', type=node_types.NAMED_THING), annotate=True)
+    # annotated together, before the nodes are written
+    assert batches == [['A:1', 'C:1']]
+    assert [func for func, _ in transactions] == [export_node_chunk]
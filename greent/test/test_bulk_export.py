@@ -0,0 +1,92 @@
+import csv
+import glob
+import gzip
+import hashlib
+import os
+from unittest.mock import Mock
+import pytest
+import greent.export
+from greent.bulk_export import BulkImportWriter, finalize, get_column_type
+from greent.graph_components import KNode, KEdge, LabeledID, node_types
+
+
+@pytest.fixture(autouse=True)
+def no_normalization(monkeypatch):
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_nodes', lambda curies: {})
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_sequence_variants', lambda curies: {})
+    monkeypatch.setattr(greent.export.Synonymizer, 'batch_normalize_edges',
+                        lambda predicates: {p: LabeledID(identifier='biolink:treats', label='treats') for p in predicates})
+    monkeypatch.setattr(greent.export.BufferedWriter, 'write_missed_curies_to_file', lambda self: None)
+
+
+def make_writer(directory, merge_edges):
+    rosetta = Mock()
+    rosetta.service_context.config = {'writer': {'bulk_import_dir': directory, 'bulk_import_shards': 2}}
+    if merge_edges:
+        rosetta.service_context.config['MERGE_EDGES'] = 'true'
+    return BulkImportWriter(rosetta)
+
+
+def make_edge(provided_by, publications):
+    return KEdge({'source_id': 'CHEBI:1', 'target_id': 'MONDO:1', 'provided_by': provided_by,
+                  'original_predicate': LabeledID(identifier='RO:1', label='treats'), 'standard_predicate': None,
+                  'publications': publications, 'ctime': 1.0, 'properties': {'score': 2}})
+
+
+def read_csv(directory, kind):
+    rows = []
+    for header_path in sorted(glob.glob(os.path.join(directory, 'import', f'{kind}-*.header.csv'))):
+        with open(header_path) as stream:
+            header = next(csv.reader(stream))
+        with gzip.open(header_path.replace('.header.csv', '.csv.gz'), 'rt') as stream:
+            rows.extend(dict(zip(header, row)) for row in csv.reader(stream))
+    return rows
+
+
+def write_graph(writer, provided_by, publications):
+    chemical = KNode('CHEBI:1', type=node_types.CHEMICAL_SUBSTANCE, name='chem')
+    chemical.add_export_labels([node_types.CHEMICAL_SUBSTANCE])
+    writer.write_node(chemical)
+    writer.write_node(KNode('MONDO:1', type=node_types.DISEASE, name='disease'))
+    writer.write_edge(make_edge(provided_by, publications))
+    writer.flush()
+
+
+def test_merged_edges(tmpdir):
+    directory = str(tmpdir)
+    with make_writer(directory, merge_edges=True) as writer:
+        write_graph(writer, 'ctd.drug_to_disease', ['PMID:1'])
+    # a second writer, e.g. in another process, adds to the same directory
+    with make_writer(directory, merge_edges=True) as writer:
+        write_graph(writer, 'chembl.drug_to_disease', ['PMID:2'])
+    assert finalize(directory) == {'nodes': 2, 'edges': 1}
+
+    nodes = {row['id:ID']: row for row in read_csv(directory, 'nodes')}
+    assert set(nodes['CHEBI:1'][':LABEL'].split(';')) == {node_types.ROOT_ENTITY, node_types.CHEMICAL_SUBSTANCE}
+    assert nodes['CHEBI:1']['name'] == 'chem'
+    edge, = read_csv(directory, 'edges')
+    assert edge['id'] == hashlib.md5('CHEBI:1MONDO:1biolink:treats'.encode()).hexdigest()
+    assert edge[':TYPE'] == 'biolink:treats'
+    assert edge['edge_source:string[]'] == 'ctd.drug_to_disease;chembl.drug_to_disease'
+    assert set(edge['publications:string[]'].split(';')) == {'PMID:1', 'PMID:2'}
+    assert edge['score:long'] == '2'
+    assert os.path.exists(os.path.join(directory, 'import.args'))
+
+
+def test_plain_edges_overwrite(tmpdir):
+    directory = str(tmpdir)
+    with make_writer(directory, merge_edges=False) as writer:
+        write_graph(writer, 'ctd.drug_to_disease', ['PMID:1'])
+        writer.write_edge(make_edge('chembl.drug_to_disease', ['PMID:2']), force_create=True)
+    finalize(directory)
+    edge, = read_csv(directory, 'edges')
+    assert edge['provided_by'] == 'chembl.drug_to_disease'
+    assert edge['publications:string[]'] == 'PMID:2'
+
+
+def test_column_types():
+    assert get_column_type([1, 2]) == 'long'
+    assert get_column_type([1, 2.5]) == 'double'
+    assert get_column_type([True]) == 'boolean'
+    assert get_column_type([['a'], []]) == 'string[]'
+    assert get_column_type([1, 'a']) == 'string'
@@ -0,0 +1,111 @@
+import pickle
+import pytest
+from greent.cache import Cache, L1Cache
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value))
+        if ex:
+            self.redis.ttls[key] = ex
+
+    def execute(self):
+        self.redis.pipelines_executed += 1
+        for key, value in self.commands:
+            self.redis.store[key] = value
+        self.commands = []
+
+
+class FakeRedis:
+    """ Just enough of redis to count round trips. """
+    def __init__(self):
+        self.store = {}
+        self.round_trips = 0
+        self.pipelines_executed = 0
+        self.ttls = {}
+
+    def get(self, key):
+        self.round_trips += 1
+        return self.store.get(key)
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.round_trips += 1
+        self.store[key] = value
+        if ex:
+            self.ttls[key] = ex
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    c = Cache(cache_path=str(tmpdir), redis_port=1, l1_size=10)
+    c.redis = FakeRedis()
+    return c
+
+
+def test_get_many_uses_one_round_trip(cache):
+    for i in range(5):
+        cache.redis.store[f'k{i}'] = pickle.dumps(i)
+    assert cache.get_many(['k0', 'k1', 'missing', 'k4']) == [0, 1, None, 4]
+    assert cache.redis.round_trips == 1
+    # now served from the in-process cache
+    assert cache.get_many(['k0', 'k4']) == [0, 4]
+    assert cache.redis.round_trips == 1
+
+
+def test_set_many_pipelines(cache):
+    cache.set_many({f'k{i}': i for i in range(25)}, batch_size=10)
+    assert cache.redis.round_trips == 0
+    assert cache.redis.pipelines_executed == 3
+    assert pickle.loads(cache.redis.store['k24']) == 24
+
+
+def test_l1_entry_bound():
+    l1 = L1Cache(max_entries=2)
+    l1['a'] = 1
+    l1['b'] = 2
+    assert l1['a'] == 1
+    l1['c'] = 3
+    assert 'b' not in l1
+    assert 'a' in l1 and 'c' in l1
+
+
+def test_l1_byte_bound():
+    l1 = L1Cache(max_entries=100, max_bytes=10)
+    l1.put('a', 1, 4)
+    l1.put('b', 2, 4)
+    l1.put('c', 3, 4)
+    assert 'a' not in l1
+    assert l1.bytes == 8
+    # too big to hold at all
+    l1.put('d', 4, 11)
+    assert 'd' not in l1
+    # and replacing a value with one too big drops the old value
+    l1.put('b', 5, 11)
+    assert 'b' not in l1
+    assert l1.bytes == 4
+
+
+def test_no_l1(tmpdir):
+    c = Cache(cache_path=str(tmpdir), redis_port=1, l1_policy='none')
+    c.redis = FakeRedis()
+    c.set('a', 1)
+    assert c.get('a') == 1
+    assert c.get('a') == 1
+    assert c.redis.round_trips == 3
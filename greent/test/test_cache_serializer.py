@@ -0,0 +1,132 @@
+import fnmatch
+import pickle
+import pytest
+from greent.cache import MsgPackCacheSerializer
+from greent.cache_tool import migrate, get_namespace
+from greent.graph_components import KNode, KEdge, LabeledID
+
+
+def op_result():
+    edge = KEdge(source_id='CHEBI:1', target_id='NCBIGene:2', provided_by='ctd.drug_to_gene',
+                 original_predicate=LabeledID(identifier='CTD:increases', label='increases'),
+                 publications=['PMID:1', 'PMID:2'], properties={'score': 0.5})
+    node = KNode('NCBIGene:2', type='gene', name='GENE2')
+    node.synonyms = {LabeledID(identifier='HGNC:2', label='GENE2')}
+    return [(edge, node)]
+
+
+@pytest.fixture
+def serializer():
+    return MsgPackCacheSerializer(compression_threshold=64)
+
+
+def test_round_trip(serializer):
+    result = serializer.loads(serializer.dumps(op_result()))
+    edge, node = result[0]
+    assert isinstance(result[0], tuple)
+    assert isinstance(edge, KEdge) and isinstance(node, KNode)
+    assert vars(edge) == vars(op_result()[0][0])
+    assert vars(node) == vars(op_result()[0][1])
+    assert isinstance(edge.original_predicate, LabeledID)
+    assert isinstance(node.synonyms, set)
+
+
+def test_header_and_compression(serializer):
+    record = serializer.dumps(op_result() * 10)
+    assert record[:2] == MsgPackCacheSerializer.MAGIC
+    assert record[2] == MsgPackCacheSerializer.VERSION
+    assert record[3] & MsgPackCacheSerializer.FLAG_ZSTD
+    assert len(record) < len(pickle.dumps(op_result() * 10))
+    small = serializer.dumps('x')
+    assert not small[3] & MsgPackCacheSerializer.FLAG_ZSTD
+    assert serializer.loads(small) == 'x'
+
+
+def test_reads_legacy_pickles(serializer):
+    assert serializer.loads(pickle.dumps({'a': 1})) == {'a': 1}
+
+
+def test_rejects_newer_versions(serializer):
+    record = bytearray(serializer.dumps(1))
+    record[2] = MsgPackCacheSerializer.VERSION + 1
+    with pytest.raises(ValueError):
+        serializer.loads(bytes(record))
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def pttl(self, key):
+        self.commands.append(lambda: self.redis.ttls.get(key, -1))
+
+    def set(self, key, value, px=None):
+        def command():
+            self.redis.store[key] = value
+            if px:
+                self.redis.ttls[key] = px
+        self.commands.append(command)
+
+    def execute(self):
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    def __init__(self, store):
+        self.store = store
+        self.ttls = {}
+
+    def scan_iter(self, match='*', count=None):
+        return [key for key in list(self.store) if fnmatch.fnmatch(key.decode(), match)]
+
+    def get(self, key):
+        return self.store.get(key.encode())
+
+    def set(self, key, value):
+        self.store[key.encode()] = value
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def test_migrate(serializer):
+    current = serializer.dumps(op_result())
+    store = {
+        b'ctd.drug_to_gene(CHEBI:1)': pickle.dumps(op_result()),
+        b'ctd.drug_to_gene(CHEBI:2)': current,
+        b'annotation(CHEBI:1)': pickle.dumps({'mass': 1.0}),
+    }
+    fake = FakeRedis(store)
+    fake.ttls[b'annotation(CHEBI:1)'] = 5000
+    stats = migrate(fake, serializer, batch_size=2)
+    assert stats['ctd.drug_to_gene']['keys'] == 2
+    assert stats['ctd.drug_to_gene']['migrated'] == 1
+    assert stats['ctd.drug_to_gene']['bytes_after'] < stats['ctd.drug_to_gene']['bytes_before']
+    assert store[b'ctd.drug_to_gene(CHEBI:2)'] is current
+    assert serializer.loads(store[b'annotation(CHEBI:1)']) == {'mass': 1.0}
+    assert fake.ttls[b'annotation(CHEBI:1)'] == 5000
+
+
+def test_omnicache_reads_migrated_prefixes(serializer):
+    omni = pytest.importorskip('crawler.omni')
+    fake = FakeRedis({b'OmnicorpPrefixes': pickle.dumps({('CHEBI', 'MONDO')})})
+    migrate(fake, serializer)
+    omni.update_prefixes('GO', 'HP', fake, serializer)
+    assert serializer.loads(fake.store[b'OmnicorpPrefixes']) == {('CHEBI', 'MONDO'), ('GO', 'HP')}
+
+
+def test_get_namespace():
+    assert get_namespace(b'OmnicorpSupport(CHEBI:1,MONDO:2)') == 'OmnicorpSupport'
+    assert get_namespace('caster.upcast(ctd~drug_to_gene,gene)(CHEBI:1)') == 'caster.upcast'
@@ -0,0 +1,128 @@
+import fnmatch
+import pytest
+from greent.cache import Cache, TTLPolicy, get_service, delete_matching
+from greent.cache_tool import evict, expire, collect_stats, get_service as tool_get_service
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        results = [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+
+    def scan_iter(self, match='*', count=None):
+        return [key for key in list(self.store) if fnmatch.fnmatch(key, match)]
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+        if ex:
+            self.ttls[key] = ex
+
+    def ttl(self, key):
+        return self.ttls.get(key, -1) if key in self.store else -2
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def memory_usage(self, key):
+        return len(self.store[key]) if key in self.store else None
+
+    def unlink(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+        return len(keys)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+ttls = {'default': 0, 'operators': 100, 'annotation': 200, 'kegg': 50}
+
+
+def test_ttl_policy():
+    policy = TTLPolicy(ttls)
+    assert policy.get_ttl('ctd.drug_to_gene(CHEBI:1)') == 100
+    assert policy.get_ttl('annotation(CHEBI:1)') == 200
+    assert policy.get_ttl('kegg.enzyme_get_chemicals(EC:1)') == 50
+    assert policy.get_ttl('caster.upcast(kegg~enzyme_get_chemicals,chemical_substance)(EC:1)') == 50
+    assert policy.get_ttl('OmnicorpSupport(CHEBI:1,MONDO:1)') is None
+    assert TTLPolicy().get_ttl('ctd.drug_to_gene(CHEBI:1)') is None
+
+
+def test_get_service():
+    assert get_service('ctd.drug_to_gene(CHEBI:1)') == 'ctd'
+    assert get_service(b'annotation(CHEBI:1.2)') == 'annotation'
+    assert tool_get_service('caster.output_filter(caster.upcast(kegg~x,y),z)(EC:1)') == 'kegg'
+
+
+def test_set_applies_ttl(tmpdir):
+    cache = Cache(cache_path=str(tmpdir), redis_port=1, ttl_policy=ttls, prefix='p-')
+    cache.redis = FakeRedis()
+    cache.set('ctd.drug_to_gene(CHEBI:1)', [1])
+    cache.set('OmnicorpSupport(CHEBI:1,MONDO:1)', [2])
+    assert cache.redis.ttls == {'p-ctd.drug_to_gene(CHEBI:1)': 100}
+
+
+def test_flush_scans_prefix(tmpdir):
+    cache = Cache(cache_path=str(tmpdir), redis_port=1, prefix='p-')
+    cache.redis = FakeRedis()
+    cache.set('a(1)', 1)
+    cache.redis.store['other'] = b'x'
+    cache.flush()
+    assert list(cache.redis.store) == ['other']
+    assert cache.get('a(1)') is None
+    assert delete_matching(cache.redis, 'o*') == 1
+
+
+@pytest.fixture
+def populated():
+    redis = FakeRedis()
+    redis.set('ctd.drug_to_gene(CHEBI:1)', b'12345')
+    redis.set('ctd.gene_to_drug(NCBIGene:1)', b'123')
+    redis.set('annotation(CHEBI:1)', b'1', ex=10)
+    redis.set('OmnicorpSupport(CHEBI:1,MONDO:1)', b'12')
+    return redis
+
+
+def test_stats(populated):
+    by_service = collect_stats(populated, group_by=get_service, batch_size=2)
+    assert by_service['ctd'] == {'keys': 2, 'bytes': 8, 'persistent': 2}
+    assert collect_stats(populated)['annotation']['persistent'] == 0
+
+
+def test_evict(populated):
+    assert evict(populated, services=['ctd'], dry_run=True) == {'ctd.drug_to_gene': 1, 'ctd.gene_to_drug': 1}
+    assert len(populated.store) == 4
+    evict(populated, namespaces=['annotation'], services=['ctd'])
+    assert list(populated.store) == ['OmnicorpSupport(CHEBI:1,MONDO:1)']
+
+
+def test_expire(populated):
+    assert expire(populated, TTLPolicy(ttls)) == {'ctd.drug_to_gene': 1, 'ctd.gene_to_drug': 1}
+    assert populated.ttls['ctd.drug_to_gene(CHEBI:1)'] == 100
+    assert populated.ttls['annotation(CHEBI:1)'] == 10
+    assert 'OmnicorpSupport(CHEBI:1,MONDO:1)' not in populated.ttls
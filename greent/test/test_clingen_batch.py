@@ -0,0 +1,88 @@
+import io
+import json
+import threading
+import time
+import pytest
+from greent.services import clingen as clingen_module
+from greent.services.clingen import ClinGen
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.raw = io.BytesIO(body)
+        self.closed = False
+
+    def json(self):
+        return json.loads(self.raw.read())
+
+    def close(self):
+        self.closed = True
+
+
+def get_allele(hgvs):
+    position = hgvs.split('.')[-1][:-3]
+    return {'@id': f'http://reg.genome.network/allele/CA{position}',
+            'externalRecords': {'dbSNP': [{'rs': int(position)}]},
+            'genomicAlleles': [{'hgvs': [hgvs], 'referenceGenome': 'GRCh38', 'chromosome': '1',
+                                'coordinates': [{'allele': 'G', 'start': int(position) - 1, 'end': int(position)}]}]}
+
+
+class FakeClinGen(ClinGen):
+    """ Answers allele registry posts locally, counting how many are in flight at once. """
+    def __init__(self, failing=()):
+        self.url = 'http://clingen/'
+        self.synon_fields_param = 'fields=none'
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.posts = []
+        self.responses = []
+
+    def http_post(self, url, data=None, stream=False):
+        variants = data.split('\n')
+        with self.lock:
+            self.posts.append(variants)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if self.failing.intersection(variants):
+            response = FakeResponse(500, b'')
+        else:
+            response = FakeResponse(200, json.dumps([get_allele(hgvs) for hgvs in variants]).encode())
+        self.responses.append(response)
+        return response
+
+
+def make_variants(count):
+    return [f'NC_000001.11:g.{i + 1}A>G' for i in range(count)]
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_stream_batches_of_synonyms(monkeypatch, streaming):
+    if streaming:
+        pytest.importorskip('ijson')
+    else:
+        monkeypatch.setattr(clingen_module, 'ijson', None)
+    clingen = FakeClinGen(failing=['NC_000001.11:g.25A>G'])
+    batches = list(clingen.stream_batches_of_synonyms(iter(make_variants(95)), batch_size=10, workers=3))
+    # the batch with the failing variant is left out
+    assert len(clingen.posts) == 10 and len(batches) == 10
+    synonyms = {hgvs: s for batch in batches for hgvs, s in batch.items()}
+    assert len(synonyms) == 85 and 'HGVS:NC_000001.11:g.25A>G' not in synonyms
+    identifiers = {labeled_id.identifier for labeled_id in synonyms['HGVS:NC_000001.11:g.7A>G']}
+    assert identifiers == {'CAID:CA7', 'DBSNP:rs7', 'HGVS:NC_000001.11:g.7A>G', 'ROBO_VARIANT:HG38|1|6|7|G'}
+    assert 1 < clingen.most_running <= 3
+    assert all(response.closed for response in clingen.responses)
+
+
+def test_get_batch_of_synonyms():
+    clingen = FakeClinGen()
+    assert clingen.get_batch_of_synonyms([]) == {}
+    synonyms = clingen.get_batch_of_synonyms(make_variants(4500))
+    assert [len(variants) for variants in clingen.posts] == [2000, 2000, 500]
+    assert clingen.most_running == 1
+    assert len(synonyms) == 4500
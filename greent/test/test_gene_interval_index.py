@@ -0,0 +1,93 @@
+import random
+import sqlite3
+from greent import node_types
+from greent.graph_components import KNode
+from greent.gene_interval_index import GeneIntervalIndex, write_gene_index
+from greent.services.ensembl import Ensembl
+
+
+def make_genes(count):
+    rng = random.Random(0)
+    genes = []
+    for i in range(count):
+        start = rng.randrange(10000000)
+        # mostly short genes, and a few very long ones
+        length = rng.randrange(2000000) if i % 50 == 0 else rng.randrange(100000)
+        genes.append((f'ENSG{i:011}', rng.choice(['1', '2', 'X']), start, start + length))
+    return genes
+
+
+class FakeEnsembl(Ensembl):
+    """ An Ensembl service over a local genes db. """
+    def __init__(self, directory, genes):
+        self.gene_db_path = str(directory.join('genes.sqlite3'))
+        self.gene_index_path = str(directory.join('genes_index'))
+        self.gene_db_successfully_created = True
+        self.persistent_conn = None
+        self.gene_index = None
+        self.gene_batch_url = 'http://ensembl'
+        self.var_to_gene_predicate = None
+        self.gene_range_select_sql = """SELECT ensembl_id, start_pos, end_pos
+        FROM genes WHERE chromosome = ? AND ((? >= start_pos AND ? <= end_pos)
+        OR (? >= start_pos AND ? <= end_pos) OR (? <= start_pos AND ? >= end_pos));"""
+        self.gene_locations_select_sql = "SELECT ensembl_id, chromosome, start_pos, end_pos FROM genes;"
+        conn = sqlite3.connect(self.gene_db_path)
+        conn.execute("""CREATE TABLE genes (id INTEGER PRIMARY KEY AUTOINCREMENT, ensembl_id text, gene_name text,
+                        chromosome INTEGER, start_pos INTEGER, end_pos INTEGER, gene_type text, description text);""")
+        conn.executemany('INSERT INTO genes (ensembl_id, chromosome, start_pos, end_pos) VALUES (?,?,?,?)', genes)
+        conn.commit()
+        conn.close()
+
+
+def make_variant(i, chromosome, position):
+    node = KNode(f'CAID:CA{i}', type=node_types.SEQUENCE_VARIANT)
+    node.add_synonyms([f'ROBO_VARIANT:HG38|{chromosome}|{position}|{position + 1}|A'])
+    return node
+
+
+def test_find_overlaps(tmpdir):
+    genes = make_genes(2000)
+    write_gene_index(str(tmpdir), genes)
+    index = GeneIntervalIndex.load(str(tmpdir))
+    assert len(index) == 2000
+    assert GeneIntervalIndex.load(str(tmpdir.join('missing'))) is None
+    rng = random.Random(1)
+    starts = [rng.randrange(10000000) for _ in range(300)]
+    ends = [start + rng.randrange(1000000) for start in starts]
+    regions, rows = index.find_overlaps('2', starts, ends)
+    found = {(int(region), index.ids[row].decode()) for region, row in zip(regions, rows)}
+    expected = {(i, gene_id) for i, (start, end) in enumerate(zip(starts, ends))
+                for gene_id, chromosome, gene_start, gene_end in genes
+                if chromosome == '2' and gene_start <= end and gene_end >= start}
+    assert found == expected and len(found) == len(regions)
+    assert len(index.find_overlaps('MT', starts, ends)[0]) == 0
+
+
+def test_batch_sequence_variant_to_gene_matches_db(tmpdir):
+    ensembl = FakeEnsembl(tmpdir, make_genes(2000))
+    rng = random.Random(2)
+    variants = [make_variant(i, rng.choice(['1', 'X', 'MT']), rng.randrange(10000000)) for i in range(200)]
+    variants.append(KNode('CAID:CA_no_location', type=node_types.SEQUENCE_VARIANT))
+    results = ensembl.batch_sequence_variant_to_gene(variants)
+    assert results['CAID:CA_no_location'] == []
+    # the index is written once, and loaded by later services
+    assert GeneIntervalIndex.load(ensembl.gene_index_path) is not None
+    for variant in variants[:-1]:
+        location = ensembl.get_variant_location(variant)
+        expected = ensembl.get_nearby_genes_from_db(location, 500000)
+        found = [(edge.target_id, edge.properties['distance']) for edge, gene in results[variant.id]]
+        assert sorted(found) == sorted((f'ENSEMBL:{gene_id}', distance) for gene_id, _, _, distance in expected)
+    assert any(results[variant.id] for variant in variants)
+    assert ensembl.sequence_variant_to_gene(variants[0]) == results[variants[0].id]
+
+
+def test_index_is_rebuilt_when_the_db_changes(tmpdir):
+    ensembl = FakeEnsembl(tmpdir, make_genes(100))
+    assert len(ensembl.get_gene_index()) == 100
+    conn = sqlite3.connect(ensembl.gene_db_path)
+    conn.executemany('INSERT INTO genes (ensembl_id, chromosome, start_pos, end_pos) VALUES (?,?,?,?)', make_genes(2000))
+    conn.commit()
+    conn.close()
+    ensembl.gene_index = None
+    assert len(ensembl.get_gene_index()) == 2100
+    assert GeneIntervalIndex.load(ensembl.gene_index_path, source=['some other db']) is None
@@ -1,5 +1,5 @@
 import pytest
-from crawler.crawl_util import glom
+from crawler.crawl_util import glom, EquivalenceSets
 from greent.conftest import rosetta
 from greent.graph_components import LabeledID
 
@@ -39,6 +39,47 @@ def test_bigger_sets():
     glom(d,eqs)
     assert d[1]==d[2]==d[3]==d[4]==d[5]==d[6]==d[7]=={1,2,3,4,5,6,7}
 
+def test_unique_prefixes():
+    d = {}
+    glom(d, [('CHEBI:1', 'INCHIKEY:A'), ('CHEBI:2', 'INCHIKEY:B'), ('MESH:1', 'CHEBI:1')])
+    # would put two inchikeys in one set
+    glom(d, [('MESH:1', 'CHEBI:2'), ('MESH:2', 'INCHIKEY:C', 'INCHIKEY:D')])
+    assert d['MESH:1'] == {'CHEBI:1', 'INCHIKEY:A', 'MESH:1'}
+    assert d['CHEBI:2'] == {'CHEBI:2', 'INCHIKEY:B'}
+    assert 'MESH:2' not in d
+    glom(d, [('MESH:1', 'GTOPDB:1'), ('CHEBI:2', 'GTOPDB:2'), ('GTOPDB:1', 'UNII:1')], unique_prefixes=['GTOPDB', 'INCHI'])
+    glom(d, [('UNII:1', 'CHEBI:2')], unique_prefixes=['GTOPDB'])
+    assert d['CHEBI:2'] == {'CHEBI:2', 'INCHIKEY:B', 'GTOPDB:2'}
+    assert d['UNII:1'] is d['CHEBI:1']
+
+def test_labeled_ids():
+    d = {}
+    glom(d, [(LabeledID(identifier='INCHIKEY:A', label='a'), 'CHEBI:1'), ('CHEBI:1', 'INCHIKEY:B')])
+    assert d['CHEBI:1'] == {LabeledID(identifier='INCHIKEY:A', label='a'), 'CHEBI:1'}
+
+def test_equivalence_sets():
+    sets = EquivalenceSets()
+    assert sets.add_groups([range(i, i + 2) for i in range(0, 1000, 2)]) == 0
+    sets.add_groups([(i, i + 2) for i in range(0, 998, 2)])
+    assert len(sets) == 1000 and len(sets.components()) == 1
+    elements, labels = sets.export()
+    assert set(labels) == {0}
+    d = sets.to_dict()
+    assert d[0] is d[999] and len(d[0]) == 1000
+    glom(sets, [('a', 'b')])
+    assert sorted(map(len, sets.components())) == [2, 1000]
+
+def test_dict_glom_is_incremental():
+    d = {}
+    glom(d, [(i, i + 1) for i in range(0, 1000, 2)])
+    untouched = d[10]
+    glom(d, [(0, 2), (2, 'a')])
+    # sets the groups do not touch are left alone
+    assert d[10] is untouched and d[11] is untouched
+    assert d[0] is d['a'] and d[0] == {0, 1, 2, 3, 'a'}
+    sets = EquivalenceSets.from_dict(d)
+    assert len(sets) == 1001 and len(sets.components()) == 499
+
 def test_load_diseases_and_phenotypes(rosetta):
     mondo_sets = build_sets(rosetta.core.mondo,['MONDO:0004979','MONDO:0004784','MONDO:0004765'])
     #hpo_sets = build_sets(rosetta.core.hpo,['HP:0002099'])
@@ -0,0 +1,111 @@
+import pickle
+import pytest
+from greent import node_types
+from greent.cache import MsgPackCacheSerializer
+from greent.graph_components import KNode, KEdge, LabeledID, SynonymSet, CompactKNode, CompactKEdge, get_labeled_id
+
+
+def make_node():
+    node = KNode('CHEBI:15365', type=node_types.CHEMICAL_SUBSTANCE, name='aspirin')
+    node.add_synonyms(['PUBCHEM:2244', 'CHEMBL.COMPOUND:CHEMBL25', LabeledID(identifier='MESH:D001241', label='Aspirin'),
+                       'chebi:1', 'NO_PREFIX'])
+    return node
+
+
+def test_synonyms_by_prefix():
+    node = make_node()
+    assert node.get_synonyms_by_prefix('CHEBI') == {'CHEBI:15365', 'chebi:1'}
+    assert node.get_synonyms_by_prefix('mesh') == {'MESH:D001241'}
+    assert node.get_labeled_ids_by_prefix('MESH') == {LabeledID(identifier='MESH:D001241', label='Aspirin')}
+    assert node.get_synonyms_by_prefix('HGNC') == set()
+    # the results are copies
+    node.get_synonyms_by_prefix('PUBCHEM').clear()
+    assert node.get_synonyms_by_prefix('PUBCHEM') == {'PUBCHEM:2244'}
+
+
+def test_index_follows_set_changes():
+    node = make_node()
+    pubchem = LabeledID(identifier='PUBCHEM:2244', label='')
+    node.synonyms.remove(pubchem)
+    assert node.get_synonyms_by_prefix('PUBCHEM') == set()
+    node.synonyms |= {pubchem, 'PUBCHEM:1'}
+    assert node.get_synonyms_by_prefix('PUBCHEM') == {'PUBCHEM:2244', 'PUBCHEM:1'}
+    node.synonyms -= {'PUBCHEM:1'}
+    node.synonyms.intersection_update({pubchem})
+    assert node.synonyms == {pubchem}
+    assert node.get_synonyms_by_prefix('CHEBI') == set()
+    # a plain set put in its place is indexed on first use
+    node.synonyms = {LabeledID(identifier='HGNC:1', label='')}
+    assert node.get_synonyms_by_prefix('HGNC') == {'HGNC:1'}
+    assert type(node.synonyms) is SynonymSet
+
+
+def test_serialized_nodes_keep_synonyms():
+    node = make_node()
+    for copy in [pickle.loads(pickle.dumps(node)), MsgPackCacheSerializer().loads(MsgPackCacheSerializer().dumps(node))]:
+        assert copy.synonyms == node.synonyms
+        assert copy.get_synonyms_by_prefix('CHEBI') == {'CHEBI:15365', 'chebi:1'}
+    assert type(pickle.loads(pickle.dumps(node)).synonyms) is SynonymSet
+
+
+def make_edge(cls):
+    return cls(source_id='CHEBI:15365', target_id='MONDO:1', provided_by='ctd.drug_to_disease', ctime=1.5,
+               original_predicate=LabeledID(identifier='RO:0002606', label='treats'),
+               standard_predicate={'identifier': 'RO:0002606', 'label': 'treats'}, input_id='CHEBI:15365',
+               publications=['PMID:1'], properties={'score': 2})
+
+
+def test_compact_node_matches_knode():
+    node = make_node()
+    compact = CompactKNode('CHEBI:15365', type=node_types.CHEMICAL_SUBSTANCE, name='aspirin')
+    # nothing is stored outside the slots, and synonyms are only built when they are used
+    assert vars(compact) == {} and compact._synonyms is None and compact._properties is None
+    assert compact.get_synonyms_by_prefix('chebi') == {'CHEBI:15365'}
+    assert compact.get_labeled_ids_by_prefix('MESH') == set()
+    compact.add_synonyms(['PUBCHEM:2244', 'CHEMBL.COMPOUND:CHEMBL25',
+                          LabeledID(identifier='MESH:D001241', label='Aspirin'), 'chebi:1', 'NO_PREFIX'])
+    assert compact.synonyms == node.synonyms
+    assert compact.get_synonyms_by_prefix('CHEBI') == {'CHEBI:15365', 'chebi:1'}
+    assert compact == node and hash(compact) == hash(node)
+    assert compact.dump() == node.dump()
+    assert compact.id is CompactKNode('CHEBI:15365').id
+
+
+def test_compact_edge_matches_kedge():
+    edge = make_edge(KEdge)
+    compact = make_edge(CompactKEdge)
+    assert vars(compact) == {}
+    assert compact == edge and hash(compact) == hash(edge)
+    assert compact.dump() == edge.dump()
+    # predicates are shared between edges
+    assert compact.original_predicate is make_edge(CompactKEdge).standard_predicate
+    assert CompactKEdge('A:1', 'B:1', 'x').publications == []
+    with pytest.raises(Exception):
+        CompactKEdge('A:1', 'B:1', 'x', publications=['PMC:1'])
+    with pytest.raises(Exception):
+        CompactKEdge('A:1', 'B:1', None)
+
+
+def test_shared_predicates_are_bounded():
+    assert get_labeled_id.cache_info().maxsize is not None
+    for i in range(get_labeled_id.cache_info().maxsize + 1):
+        CompactKEdge('A:1', 'B:1', 'x', original_predicate={'identifier': f'RO:{i}', 'label': 'x'})
+    assert get_labeled_id.cache_info().currsize == get_labeled_id.cache_info().maxsize
+
+
+def test_compact_pickles_as_knode_and_kedge():
+    node = make_node()
+    compact = CompactKNode('CHEBI:15365', type=node_types.CHEMICAL_SUBSTANCE, name='aspirin',
+                           synonyms=[s for s in node.synonyms if s.identifier != 'CHEBI:15365'])
+    compact.note = 'kept'
+    node.note = 'kept'
+    serializer = MsgPackCacheSerializer()
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(compact, protocol))
+        assert type(copy) is KNode and vars(copy) == vars(node)
+        edge = pickle.loads(pickle.dumps(make_edge(CompactKEdge), protocol))
+        assert type(edge) is KEdge and vars(edge) == vars(make_edge(KEdge))
+    copy = serializer.loads(serializer.dumps(compact))
+    assert type(copy) is KNode and copy.synonyms == node.synonyms and copy.note == 'kept'
+    edge = serializer.loads(serializer.dumps(make_edge(CompactKEdge)))
+    assert type(edge) is KEdge and vars(edge) == vars(make_edge(KEdge))
@@ -0,0 +1,130 @@
+import gzip
+import io
+import tarfile
+from unittest.mock import Mock
+import pytest
+from builder.gtex_utils import GTExUtils, merge_processed_parts, read_processed_batches, get_hgvs_value
+
+HEADER = 'variant_id\tgene_id\ttss_distance\tma_samples\tma_count\tmaf\tpval_nominal\tslope\tslope_se\tpval_nominal_threshold\tmin_pval_nominal\tpval_beta\n'
+
+
+def make_tar(tissues):
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar:
+        for tissue_name, lines in tissues.items():
+            for kind in ['signif_variant_gene_pairs', 'egenes']:
+                data = gzip.compress((HEADER + ''.join(lines)).encode())
+                info = tarfile.TarInfo(f'GTEx_Analysis_v8_eQTL/{tissue_name}.v8.{kind}.txt.gz')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    tar_data.seek(0)
+    return tar_data
+
+
+def line(variant_id, gene_id, pval, slope):
+    return f'{variant_id}\t{gene_id}\t1\t2\t3\t0.1\t{pval}\t{slope}\t0.1\t0.1\t0.1\t0.1\n'
+
+
+@pytest.mark.parametrize('extension', ['csv', 'parquet'])
+def test_parse_tissue_files(tmpdir, extension):
+    # tissue files are parsed with pyarrow whatever the output format
+    pytest.importorskip('pyarrow')
+    gtu = GTExUtils(Mock())
+    tar_stream = make_tar({
+        'Liver': [line('chr1_100_A_G_b38', 'ENSG00000001.5', '1e-5', '0.5'),
+                  line('chr1_100_A_G_b38', 'ENSG00000002.1', '2e-5', '-0.5'),
+                  'short\tline\n'],
+        'Lung': [line('chrX_200_AT_A_b38', 'ENSG00000003.2', '3e-5', 'NA')],
+        'Not_A_Tissue': [line('chr2_300_C_T_b38', 'ENSG00000004.1', '4e-5', '1.0')],
+    })
+    part_paths = gtu.parse_tissue_files(tar_stream, str(tmpdir.join('parts')), extension == 'parquet', workers=2)
+    assert sorted(part_paths) == ['Liver', 'Lung']
+    out_path = str(tmpdir.join(f'eqtl.{extension}'))
+    merge_processed_parts([part_paths[tissue] for tissue in sorted(part_paths)], out_path)
+    batches = list(read_processed_batches(out_path, batch_size=1))
+    assert len(batches) == 2
+    assert batches[0]['tissue_name'] == ['Liver']
+    assert batches[0]['tissue_uberon'] == ['0002107']
+    assert batches[0]['HGVS'] == ['NC_000001.11:g.100A>G']
+    assert batches[1]['gene_id'] == ['ENSG00000002']
+    assert float(batches[1]['slope'][0]) == -0.5
+
+
+def test_get_hgvs_value():
+    assert get_hgvs_value('1_100_A_G_b38') == 'NC_000001.11:g.100A>G'
+    assert get_hgvs_value('X_200_AT_A_b37') == 'NC_000023.10:g.201del'
+    assert get_hgvs_value('2_300_A_AGG_b38') == 'NC_000002.12:g.300_301insGG'
+    assert get_hgvs_value('MT_300_A_G_b38') == ''
+
+
+class FakeWriter:
+    def __init__(self, rosetta):
+        self.nodes = []
+        self.edges = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write_node(self, node):
+        self.nodes.append(node)
+
+    def write_edge(self, edge, force_create=False):
+        self.edges.append(edge)
+
+    def get_graph(self):
+        # edges with the same endpoints and predicate are merged into one, the last write winning
+        edges = {(e.source_id, e.target_id, e.original_predicate.identifier): (e.hyper_edge_id, e.properties) for e in self.edges}
+        return {node.id for node in self.nodes}, edges
+
+
+@pytest.mark.parametrize('is_sqtl', [False, True])
+def test_batch_mode_writes_the_same_graph(tmpdir, monkeypatch, is_sqtl):
+    import builder.gtex_builder
+    writers = []
+    monkeypatch.setattr(builder.gtex_builder, 'WriterDelegator', lambda rosetta: writers.append(FakeWriter(rosetta)) or writers[-1])
+    with open(str(tmpdir.join('eqtl.csv')), 'w') as stream:
+        stream.write('tissue_name,tissue_uberon,HGVS,gene_id,variant_id,pval_nominal,slope\n')
+        for tissue_name, uberon in [('Liver', '0002107'), ('Lung', '0002048')]:
+            for variant in range(5):
+                for gene in range(3):
+                    slope = 'NA' if variant == 4 and gene == 2 and not is_sqtl else (gene - 1) * 0.5 + variant
+                    stream.write(f'{tissue_name},{uberon},NC_000001.11:g.{variant}A>G,ENSG{gene}.1,chr1_{variant}_A_G_b38,1e-5,{slope}\n')
+    for batch_mode in [False, True]:
+        gtb = builder.gtex_builder.GTExBuilder(Mock())
+        assert gtb.create_gtex_graph(f'{tmpdir}/', 'eqtl.csv', 'GTEx.v8', is_sqtl=is_sqtl, batch_mode=batch_mode) is None
+    row_writer, batch_writer = writers
+    assert row_writer.get_graph() == batch_writer.get_graph()
+    assert len(batch_writer.nodes) == len(set(node.id for node in batch_writer.nodes)) == 5 + 3 + 2
+    assert len(batch_writer.edges) < len(row_writer.edges)
+
+
+def test_get_hyper_edge_ids():
+    assert GTExUtils.get_hyper_edge_ids(['0002107', None], ['ENSG1', 'ENSG1'], ['HGVS1', 'HGVS1']) == \
+        [GTExUtils.get_hyper_edge_id('0002107', 'ENSG1', 'HGVS1'), 0]
+
+
+@pytest.mark.parametrize('extension', ['csv', 'parquet'])
+def test_prepopulate_variant_synonymization_cache(tmpdir, extension):
+    gtu = GTExUtils(Mock())
+    if extension == 'parquet':
+        pyarrow = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        pq.write_table(pyarrow.table({'tissue_name': ['Liver'] * 25, 'HGVS': [f'NC_000001.11:g.{i}A>G' for i in range(25)]}),
+                       str(tmpdir.join('eqtl.parquet')))
+    else:
+        with open(str(tmpdir.join('eqtl.csv')), 'w') as stream:
+            stream.write('tissue_name,HGVS\n' + ''.join(f'Liver,NC_000001.11:g.{i}A>G\n' for i in range(25)))
+    cached = {f'synonymize(HGVS:NC_000001.11:g.{i}A>G)' for i in range(0, 25, 5)}
+    gtu.cache.get_many = Mock(side_effect=lambda keys: [set() if key in cached else None for key in keys])
+    gtu.clingen.stream_batches_of_synonyms = Mock(side_effect=lambda variants, workers: [{f'HGVS:{hgvs}': set()} for hgvs in variants])
+    written = []
+    gtu.write_variant_synonymization_cache = written.append
+    assert gtu.prepopulate_variant_synonymization_cache(f'{tmpdir}/', f'eqtl.{extension}', workers=2) is None
+    # one cache probe for the whole (small) file
+    assert gtu.cache.get_many.call_count == 1
+    assert len(written) == 20
+    assert {'HGVS:NC_000001.11:g.0A>G', 'HGVS:NC_000001.11:g.1A>G'} & {key for batch in written for key in batch} == \
+        {'HGVS:NC_000001.11:g.1A>G'}
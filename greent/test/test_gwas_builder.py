@@ -0,0 +1,76 @@
+import os
+from unittest.mock import Mock
+import pytest
+import builder.gwas_builder
+from builder.gwas_builder import GWASCatalog, get_trait_curie
+
+HEADER = 'DATE ADDED\tPUBMEDID\tSNPS\tP-VALUE\tMAPPED_TRAIT_URI\n'
+LINES = [
+    '2020\t111\trs1; rs2\t1E-8\thttp://www.ebi.ac.uk/efo/EFO_0000001, http://purl.obolibrary.org/obo/HP_0000002\n',
+    '2020\t222\trs2 x chr1:5\t0\thttp://purl.obolibrary.org/obo/GO_0000003\n',
+    '2020\t333\trs3\tNR\thttp://www.orpha.net/ORDO/Orphanet_4\n',
+    '2020\t444\trs3\t2E-9\thttp://www.orpha.net/ORDO/Orphanet_4\n',
+]
+
+
+class FakeWriter:
+    def __init__(self, rosetta):
+        self.nodes = []
+        self.edges = []
+
+    def write_node(self, node):
+        self.nodes.append(node)
+
+    def write_edge(self, edge):
+        self.edges.append(edge)
+
+
+@pytest.fixture
+def gwas(tmpdir, monkeypatch):
+    monkeypatch.setattr(builder.gwas_builder, 'WriterDelegator', FakeWriter)
+    monkeypatch.setattr(builder.gwas_builder, 'GeneticsNormalizer', Mock)
+    return GWASCatalog(Mock(), data_directory=str(tmpdir), batch_size=2)
+
+
+def test_get_trait_curie():
+    assert get_trait_curie('http://www.ebi.ac.uk/efo/EFO_0000001') == 'EFO:0000001'
+    assert get_trait_curie('http://www.orpha.net/ORDO/Orphanet_4') == 'ORPHANET:4'
+    assert get_trait_curie('http://purl.obolibrary.org/obo/MONDO_0000005') == 'MONDO:0000005'
+    assert get_trait_curie('http://purl.obolibrary.org/obo/GO_0000003') is None
+
+
+def test_parse_cached_release(gwas, monkeypatch):
+    # the release was downloaded before, so there is no ftp
+    monkeypatch.setattr(builder.gwas_builder, 'FTP', None)
+    gwas_path = os.path.join(gwas.data_directory, '2020-05-04', builder.gwas_builder.GWAS_FILE)
+    os.makedirs(os.path.dirname(gwas_path))
+    with open(gwas_path, 'w') as stream:
+        stream.write(HEADER + ''.join(LINES))
+    assert gwas.get_gwas_file() == gwas_path
+    stats = gwas.parse_gwas_file(gwas_path)
+    assert stats == {'lines': 4, 'corrupted_lines': 1, 'missing_variant_ids': 1, 'missing_phenotype_ids': 1}
+    edges = [(edge.source_id, edge.target_id, edge.publications, edge.properties['p_value']) for edge in gwas.writer.edges]
+    assert edges == [
+        ('DBSNP:rs1', 'EFO:0000001', ['PMID:111'], 1e-8),
+        ('DBSNP:rs1', 'HP:0000002', ['PMID:111'], 1e-8),
+        ('DBSNP:rs2', 'EFO:0000001', ['PMID:111'], 1e-8),
+        ('DBSNP:rs2', 'HP:0000002', ['PMID:111'], 1e-8),
+        ('DBSNP:rs3', 'ORPHANET:4', ['PMID:444'], 2e-9),
+    ]
+    # each node is written once per batch
+    assert [node.id for node in gwas.writer.nodes] == \
+        ['DBSNP:rs1', 'DBSNP:rs2', 'EFO:0000001', 'HP:0000002', 'DBSNP:rs3', 'ORPHANET:4']
+
+
+def test_parse_lines(gwas):
+    # lines as ftp.retrlines gives them
+    stats = gwas.parse_gwas_file(line.rstrip('\n') for line in [HEADER] + LINES[1:2])
+    # rs2 has only a GO trait, and chr1:5 is not a dbsnp id
+    assert stats['missing_phenotype_ids'] == 1 and stats['missing_variant_ids'] == 1
+    assert gwas.writer.edges == []
+
+
+def test_parse_missing_column(gwas):
+    stats = gwas.parse_gwas_file(['PUBMEDID\tSNPS'] + LINES[1:2])
+    assert stats == {'lines': 0, 'corrupted_lines': 0, 'missing_variant_ids': 0, 'missing_phenotype_ids': 0}
+    assert gwas.writer.edges == []
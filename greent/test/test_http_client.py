@@ -0,0 +1,38 @@
+import asyncio
+from greent.http_client import HttpClient, DNSCache, get_async_session
+
+
+def test_sync_session_is_shared():
+    assert HttpClient.get_session() is HttpClient.get_session()
+
+
+def test_configure_resizes_pools():
+    HttpClient.configure(pool_maxsize=4)
+    adapter = HttpClient.get_session().get_adapter('https://example.org')
+    assert adapter._pool_maxsize == 4
+    HttpClient.configure(pool_maxsize=32)
+
+
+def test_async_session_per_loop():
+    async def grab():
+        return get_async_session()
+    loop = asyncio.new_event_loop()
+    first = loop.run_until_complete(grab())
+    assert loop.run_until_complete(grab()) is first
+    other_loop = asyncio.new_event_loop()
+    assert other_loop.run_until_complete(grab()) is not first
+    HttpClient.close_async_session(loop)
+    HttpClient.close_async_session(other_loop)
+    assert first.closed
+    loop.close()
+    other_loop.close()
+
+
+def test_dns_cache():
+    calls = []
+    cache = DNSCache(ttl=60)
+    cache.getaddrinfo = lambda *args, **kwargs: calls.append(args) or [args]
+    assert cache('example.org', 443) == cache('example.org', 443)
+    assert len(calls) == 1
+    cache('example.com', 443)
+    assert len(calls) == 2
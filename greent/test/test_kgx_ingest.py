@@ -0,0 +1,106 @@
+import json
+import os
+import pytest
+from builder.kgx_ingest import split_file, parse_range, ingest, IngestProgress
+
+
+class FakeWriter:
+    def __init__(self, fail_after=None):
+        self.nodes = []
+        self.edges = []
+        self.flushes = 0
+        self.fail_after = fail_after
+
+    def write_node(self, node, annotate=True):
+        self.nodes.append(node)
+
+    def write_edge(self, edge, force_create=False):
+        self.edges.append(edge)
+
+    def flush(self):
+        self.flushes += 1
+        if self.fail_after is not None and self.flushes > self.fail_after:
+            raise RuntimeError('neo4j went away')
+
+
+def write_json_kgx(directory, count):
+    nodes_file = os.path.join(directory, 'nodes.json')
+    edges_file = os.path.join(directory, 'edges.json')
+    with open(nodes_file, 'w') as stream:
+        stream.write('{"nodes": [\n')
+        for i in range(count):
+            stream.write(json.dumps({'id': f'MONDO:{i}', 'name': f'disease {i}', 'category': ['disease', 'named_thing'],
+                                     'equivalent_identifiers': [f'MONDO:{i}', f'DOID:{i}'], 'size': i}) + ',\n')
+        stream.write(']}\n')
+    with open(edges_file, 'w') as stream:
+        for i in range(count):
+            stream.write(json.dumps({'subject': f'MONDO:{i}', 'object': 'MONDO:0', 'relation': 'RO:0002350',
+                                     'edge_label': 'biolink:subclass_of', 'source_database': 'mondo.owl',
+                                     'publications': [f'PMID:{i + 1}'], 'weight': 0.5}) + '\n')
+    return nodes_file, edges_file
+
+
+def test_split_file(tmpdir):
+    path = str(tmpdir.join('lines.tsv'))
+    with open(path, 'w') as stream:
+        stream.write('id\tname\n' + ''.join(f'X:{i}\tthing {i}\n' for i in range(1000)))
+    ranges = split_file(path, 100, skip_header=True)
+    assert ranges[0][0] == len('id\tname\n')
+    assert ranges[-1][1] == os.path.getsize(path)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    lines = []
+    with open(path, 'rb') as stream:
+        for start, end in ranges:
+            stream.seek(start)
+            chunk = stream.read(end - start)
+            assert chunk.endswith(b'\n')
+            lines.extend(chunk.splitlines())
+    assert len(lines) == 1000
+
+
+def test_parse_tsv_range(tmpdir):
+    path = str(tmpdir.join('edges.tsv'))
+    with open(path, 'w') as stream:
+        stream.write('subject\tedge_label\tobject\trelation\n')
+        stream.write('CHEBI:1\tbiolink:treats\tMONDO:1\tRO:0002606\n')
+        stream.write('broken line\n')
+    start, end = split_file(path, 1000, skip_header=True)[0]
+    result = parse_range((path, 'edges', start, end, ['subject', 'edge_label', 'object', 'relation'], '\t', 'kgx'))
+    assert result['batch']['subject'] == ['CHEBI:1']
+    assert result['batch']['relation'] == ['RO:0002606']
+    assert result['errors'] == 1
+
+
+def test_ingest_json(tmpdir):
+    nodes_file, edges_file = write_json_kgx(str(tmpdir), 200)
+    writer = FakeWriter()
+    stats = ingest(writer, nodes_file, edges_file, 'kgx', workers=2, chunk_bytes=1000)
+    assert stats['nodes']['items'] == 200 and stats['edges']['items'] == 200
+    # the lines opening and closing the json array
+    assert stats['nodes']['errors'] == 2
+    assert sorted(int(node.id.split(':')[1]) for node in writer.nodes) == list(range(200))
+    node = next(node for node in writer.nodes if node.id == 'MONDO:3')
+    assert node.export_labels == frozenset(['disease', 'named_thing'])
+    assert node.properties == {'size': 3}
+    assert 'DOID:3' in {synonym.identifier for synonym in node.synonyms}
+    edge = next(edge for edge in writer.edges if edge.source_id == 'MONDO:3')
+    assert edge.standard_predicate.identifier == 'biolink:subclass_of'
+    assert edge.original_predicate.label == '0002350'
+    assert edge.provided_by == 'mondo_owl'
+    assert edge.publications == ['PMID:4']
+    assert edge.properties == {'weight': 0.5}
+    assert not os.path.exists(f'{edges_file}.progress')
+
+
+def test_ingest_resumes(tmpdir):
+    nodes_file, _ = write_json_kgx(str(tmpdir), 200)
+    first = FakeWriter(fail_after=3)
+    with pytest.raises(RuntimeError):
+        ingest(first, nodes_file, workers=1, chunk_bytes=1000)
+    assert len(IngestProgress(f'{nodes_file}.progress', 1000).done) == 3
+    # only the ranges that were not flushed are read again
+    second = FakeWriter()
+    ingest(second, nodes_file, workers=1, chunk_bytes=1000)
+    assert len(second.nodes) < 200
+    assert {node.id for node in first.nodes + second.nodes} == {f'MONDO:{i}' for i in range(200)}
+    assert not os.path.exists(f'{nodes_file}.progress')
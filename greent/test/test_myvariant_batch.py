@@ -0,0 +1,104 @@
+import threading
+import time
+from greent import node_types
+from greent.graph_components import KNode
+from greent.services.myvariant import MyVariant, get_batches
+from crawler.sequence_variants import prepopulate_variant_annotation_cache, get_variant_annotation_key
+
+
+class FakeResponse:
+    def __init__(self, status_code, json):
+        self.status_code = status_code
+        self._json = json
+
+    def json(self):
+        return self._json
+
+
+class FakeMyVariant(MyVariant):
+    """ Answers batch posts locally, counting how many are in flight at once. """
+    def __init__(self, failing_ids=()):
+        self.url = 'http://myvariant/'
+        self.url_fields = 'snpeff'
+        self.failing_ids = set(failing_ids)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.posts = []
+        self.processing_threads = set()
+
+    def http_post(self, url, data=None):
+        ids = data['ids'].split(',')
+        with self.lock:
+            self.posts.append(ids)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if self.failing_ids.intersection(ids):
+            return FakeResponse(500, None)
+        return FakeResponse(200, [{'_id': myvar_id, 'query': myvar_id} for myvar_id in ids])
+
+    def process_annotation(self, variant_node, annotation_json, curie_id, query_url):
+        self.processing_threads.add(threading.get_ident())
+        return [('edge', curie_id)]
+
+
+class FakeCache:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.gets = 0
+        self.sets = 0
+
+    def get_many(self, keys):
+        self.gets += 1
+        return [self.data.get(key) for key in keys]
+
+    def set_many(self, mapping):
+        self.sets += 1
+        self.data.update(mapping)
+
+
+def make_variants(count):
+    for i in range(count):
+        node = KNode(f'CAID:CA{i}', type=node_types.SEQUENCE_VARIANT)
+        # every tenth variant has no myvariant id
+        if i % 10:
+            node.add_synonyms([f'MYVARIANT_HG38:chr1:g.{i}A>G'])
+        yield node
+
+
+def test_get_batches():
+    assert list(get_batches(iter(range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(get_batches([], 3)) == []
+
+
+def test_stream_posts_concurrently():
+    myvariant = FakeMyVariant()
+    results = {}
+    for batch in myvariant.stream_sequence_variant_to_gene(make_variants(95), batch_size=10, workers=3):
+        results.update(batch)
+    assert len(results) == 95
+    assert results['CAID:CA1'] == [('edge', 'MYVARIANT_HG38:chr1:g.1A>G')]
+    assert results['CAID:CA10'] == []
+    assert len(myvariant.posts) == 10 and all(len(ids) <= 10 for ids in myvariant.posts)
+    assert 1 < myvariant.most_running <= 3
+    # annotations are processed on the calling thread
+    assert myvariant.processing_threads == {threading.get_ident()}
+
+
+def test_failed_batches_are_not_cached():
+    myvariant = FakeMyVariant(failing_ids=['chr1:g.15A>G'])
+    cache = FakeCache({get_variant_annotation_key(f'CAID:CA{i}'): [] for i in range(5)})
+    cached, annotated = prepopulate_variant_annotation_cache(cache, myvariant, make_variants(30), workers=2)
+    assert cached == 5
+    # the 25 uncached variants go out in batches of up to 1000, so one failing post loses them all
+    assert annotated == 0 and cache.sets == 0
+    myvariant = FakeMyVariant()
+    cached, annotated = prepopulate_variant_annotation_cache(cache, myvariant, make_variants(3000), workers=2)
+    assert cached == 5 and annotated == 2995
+    assert cache.gets == 1 + 3
+    assert cache.data[get_variant_annotation_key('CAID:CA2999')] == [('edge', 'MYVARIANT_HG38:chr1:g.2999A>G')]
+    # variants without a myvariant id are cached as empty but not posted
+    assert sorted(len(ids) for ids in myvariant.posts) == [896, 900, 900]
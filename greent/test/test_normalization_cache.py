@@ -0,0 +1,65 @@
+import gzip
+import json
+import time
+import pytest
+from greent.normalization_cache import NormalizationCache
+from greent.synonymization import Synonymizer
+
+
+def response(curie, label, *others):
+    return {
+        'id': {'identifier': curie, 'label': label},
+        'equivalent_identifiers': [{'identifier': curie, 'label': label}] + [{'identifier': o} for o in others],
+        'type': ['disease', 'named_thing']
+    }
+
+
+@pytest.fixture
+def cache(tmpdir):
+    c = NormalizationCache(str(tmpdir.join('nn.sqlite')), ttl=100, negative_ttl=100)
+    yield c
+    c.close()
+
+
+def test_hits_misses_and_expiry(cache):
+    cache.set_many({'MONDO:1': response('MONDO:1', 'one'), 'FAKE:1': None})
+    found, missing = cache.get_many(['MONDO:1', 'FAKE:1', 'MONDO:2', 'MONDO:1'])
+    assert found == {'MONDO:1': response('MONDO:1', 'one'), 'FAKE:1': None}
+    assert missing == ['MONDO:2']
+    cache.negative_ttl = 0.01
+    cache.set_many({'FAKE:1': None})
+    time.sleep(0.02)
+    assert cache.get_many(['FAKE:1']) == ({}, ['FAKE:1'])
+    assert cache.get_stats() == {'entries': 2, 'misses': 1, 'expired': 1}
+    assert cache.purge_expired() == 1
+
+
+def test_prewarm(cache, tmpdir):
+    dump = str(tmpdir.join('dump.jsonl.gz'))
+    with gzip.open(dump, 'wt') as stream:
+        stream.write(json.dumps(response('MONDO:1', 'one', 'DOID:1')) + '\n')
+        stream.write(json.dumps({'MONDO:2': response('MONDO:2', 'two'), 'FAKE:2': None}) + '\n')
+    assert cache.prewarm(dump) == 3
+    found, missing = cache.get_many(['DOID:1', 'MONDO:2', 'FAKE:2'])
+    assert found['DOID:1']['id']['identifier'] == 'MONDO:1'
+    assert missing == ['FAKE:2']
+
+
+def test_batch_normalize_nodes_uses_cache(cache, monkeypatch):
+    requested = []
+
+    def fake_get(urls):
+        urls = list(urls)
+        requested.extend(urls)
+        return [{'MONDO:2': response('MONDO:2', 'two'), 'FAKE:1': None}] if urls else []
+    monkeypatch.setattr(Synonymizer, 'async_get_json_wrapper', staticmethod(fake_get))
+    monkeypatch.setattr(Synonymizer, 'NODE_CACHE', cache)
+    cache.set_many({'MONDO:1': response('MONDO:1', 'one')})
+    nodes = Synonymizer.batch_normalize_nodes(['MONDO:1', 'MONDO:2', 'FAKE:1'])
+    assert set(nodes) == {'MONDO:1', 'MONDO:2'}
+    assert nodes['MONDO:1'].name == 'one'
+    assert 'MONDO:1' not in requested[0]
+    # the second time nothing, not even the miss, goes to the service
+    requested.clear()
+    assert set(Synonymizer.batch_normalize_nodes(['MONDO:1', 'MONDO:2', 'FAKE:1'])) == {'MONDO:1', 'MONDO:2'}
+    assert requested == []
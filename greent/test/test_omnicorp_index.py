@@ -0,0 +1,78 @@
+from unittest.mock import Mock
+import pytest
+import greent.omnicorp_index
+from greent.omnicorp_index import OmnicorpIndex, write_prefix
+from greent.graph_components import KNode
+from builder.omnicorp import OmnicorpSupport
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def index(tmpdir, request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(greent.omnicorp_index, 'numpy', None)
+    directory = str(tmpdir)
+    write_prefix(directory, 'MONDO', [('MONDO:1', 5), ('MONDO:1', 3), ('MONDO:1', 3), ('MONDO:2', 4), ('MONDO:2', 5)])
+    write_prefix(directory, 'HP', [('HP:0000001', 3), ('HP:1', 3), ('HP:1', 9), ('HP:1', 5)])
+    write_prefix(directory, 'CL', [])
+    write_prefix(directory, 'NCBIGene', [('NCBIGene:1', 3), ('NCBIGene:1', 7)])
+    return OmnicorpIndex(directory)
+
+
+def test_postings(index):
+    assert list(index.get_pmids('MONDO:1')) == [3, 5]
+    assert index.count('HP:1') == 3
+    # too common to be indexed
+    assert index.count('HP:0000001') == 0
+    assert index.count('CL:1') == 0
+    assert index.count('UMLS:1') == 0
+    assert index.get_shared('MONDO:1', 'HP:1') == [3, 5]
+    assert index.get_shared('MONDO:2', 'HP:1') == [5]
+    assert index.get_shared('MONDO:2', 'CL:1') == []
+    # prefixes are matched whatever their case
+    assert index.count('NCBIGene:1') == 2
+    assert index.get_shared('NCBIGene:1', 'HP:1') == [3]
+    assert index.get_omni_identifier(KNode('NCBIGene:1')) == 'NCBIGene:1'
+
+
+def test_service_api(index):
+    mondo, hp, umls = KNode('MONDO:1'), KNode('HP:1'), KNode('UMLS:1')
+    assert index.get_omni_identifier(umls) is None
+    assert index.count_pmids(mondo) == 2
+    assert index.get_shared_pmids(mondo, hp) == ['PMID:3', 'PMID:5']
+    assert index.get_all_shared_pmids([mondo, hp, umls]) == {
+        (mondo, hp): ['PMID:3', 'PMID:5'], (mondo, umls): [], (hp, umls): []}
+
+
+def test_support_uses_index(index):
+    greent = Mock()
+    greent.service_context.config = {'omnicorp_index': {'path': index.directory}}
+    support = OmnicorpSupport(greent)
+    mondo, hp = KNode('MONDO:1'), KNode('HP:1')
+    mondo.properties.update(support.get_node_info(mondo))
+    hp.properties.update(support.get_node_info(hp))
+    assert support.term_to_term(mondo, hp) == ['PMID:3', 'PMID:5']
+    assert support.is_indexed(KNode('NCBIGene:1'))
+
+
+def test_support_falls_back_for_prefixes_not_indexed(index, monkeypatch):
+    import builder.omnicorp
+    monkeypatch.setattr(builder.omnicorp, 'KEdge', lambda source, target, *args, publications, **kwargs: (source.id, target.id, publications))
+    greent = Mock()
+    greent.service_context.config = {'omnicorp_index': {'path': index.directory}}
+    greent.omnicorp.count_pmids.return_value = 7
+    greent.omnicorp.get_shared_pmids.return_value = ['PMID:8']
+    support = OmnicorpSupport(greent)
+    mondo, hp, umls = KNode('MONDO:1'), KNode('HP:1'), KNode('UMLS:1')
+    for node in [mondo, hp, umls]:
+        node.properties.update(support.get_node_info(node))
+    assert umls.properties['omnicorp_article_count'] == 7
+    assert greent.omnicorp.count_pmids.call_count == 1
+    assert support.term_to_term(mondo, umls) == ['PMID:8']
+    greent.omnicorp.get_all_shared_pmids.return_value = {(mondo, umls): ['PMID:8'], (hp, umls): []}
+    edges = {(source, target): publications for source, target, publications in support.generate_all_edges([mondo, hp, umls])}
+    assert edges == {('MONDO:1', 'HP:1'): ['PMID:3', 'PMID:5'], ('MONDO:1', 'UMLS:1'): ['PMID:8'], ('HP:1', 'UMLS:1'): []}
+
+
+def test_unsorted_rows(tmpdir):
+    with pytest.raises(ValueError):
+        write_prefix(str(tmpdir), 'HP', [('HP:1', 1), ('HP:2', 1), ('HP:1', 2)])
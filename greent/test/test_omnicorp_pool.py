@@ -0,0 +1,152 @@
+import sqlite3
+import pytest
+from greent.graph_components import KNode
+from greent.services.omnicorp_postgres import OmniCorp, OmnicorpPool
+from greent import node_types
+
+ROWS = {
+    'MONDO': [('MONDO:1', 1), ('MONDO:1', 2), ('MONDO:1', 3), ('MONDO:2', 2), ('MONDO:2', 3), ('MONDO:3', 9)],
+    'CHEBI': [('CHEBI:1', 1), ('CHEBI:1', 3), ('CHEBI:2', 4)],
+    'HP': [('HP:1', 3)],
+}
+
+
+class FakeConfig(dict):
+    def get_service(self, service):
+        return {}
+
+
+class FakeContext:
+    config = FakeConfig()
+
+
+@pytest.fixture()
+def omnicorp(tmpdir):
+    """ An OmniCorp service over sqlite, with the tables in an attached database called omnicorp. """
+    path = str(tmpdir.join('omnicorp.db'))
+    conn = sqlite3.connect(path)
+    for prefix, rows in ROWS.items():
+        conn.execute(f'CREATE TABLE {prefix} (curie TEXT, pubmedid INTEGER)')
+        conn.executemany(f'INSERT INTO {prefix} VALUES (?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+    def connect():
+        conn = sqlite3.connect(str(tmpdir.join('main.db')), check_same_thread=False)
+        conn.execute(f"ATTACH DATABASE '{path}' AS omnicorp")
+        return conn
+    return OmniCorp(FakeContext(), OmnicorpPool(connect, size=2, prepare=False, placeholder='?'))
+
+
+def make_nodes():
+    return [KNode('MONDO:1', type=node_types.DISEASE), KNode('CHEBI:1', type=node_types.CHEMICAL_SUBSTANCE),
+            KNode('MONDO:2', type=node_types.DISEASE), KNode('HP:1', type=node_types.PHENOTYPIC_FEATURE),
+            KNode('NCBIGene:1', type=node_types.GENE), KNode('CHEBI:2', type=node_types.CHEMICAL_SUBSTANCE)]
+
+
+def test_all_shared_pmids_match_pairs(omnicorp):
+    nodes = make_nodes()
+    shared = omnicorp.get_all_shared_pmids(nodes)
+    assert len(shared) == 15
+    for (node1, node2), pmids in shared.items():
+        assert nodes.index(node1) < nodes.index(node2)
+        assert sorted(pmids) == sorted(omnicorp.get_shared_pmids(node1, node2))
+    assert sorted(shared[(nodes[0], nodes[2])]) == ['PMID:2', 'PMID:3']
+    assert shared[(nodes[1], nodes[3])] == ['PMID:3']
+    assert shared[(nodes[0], nodes[4])] == []
+
+
+def test_count_all_pmids(omnicorp):
+    nodes = make_nodes()
+    counts = omnicorp.count_all_pmids(nodes)
+    assert counts == {node: omnicorp.count_pmids(node) for node in nodes}
+    assert counts[nodes[0]] == 3 and counts[nodes[4]] == 0
+
+
+def test_pool_reuses_connections(tmpdir):
+    opened = []
+
+    def connect():
+        opened.append(sqlite3.connect(':memory:', check_same_thread=False))
+        return opened[-1]
+    pool = OmnicorpPool(connect, size=2, prepare=False, placeholder='?')
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+    for _ in range(3):
+        with pool.connection() as conn:
+            assert pool.execute(conn, 'one', 'SELECT {0}', 1) == [(1,)]
+    assert len(opened) == 2
+    pool.close()
+
+
+def test_pool_frees_slots_of_failed_connections():
+    failures = [True, True]
+
+    def connect():
+        if failures:
+            failures.pop()
+            raise sqlite3.OperationalError('omnicorp is down')
+        return sqlite3.connect(':memory:', check_same_thread=False)
+    pool = OmnicorpPool(connect, size=1, prepare=False, placeholder='?')
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            with pool.connection():
+                pass
+    # the failed connects did not use up the only slot
+    with pool.connection() as conn:
+        assert pool.execute(conn, 'one', 'SELECT {0}', 1) == [(1,)]
+    assert pool.created == 1
+    pool.close()
+
+
+class BrokenConnection:
+    def __init__(self):
+        self.closed = False
+
+    def commit(self):
+        raise sqlite3.OperationalError('connection lost')
+
+    def rollback(self):
+        raise sqlite3.OperationalError('connection lost')
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('fail_inside', [False, True])
+def test_pool_discards_broken_connections(fail_inside):
+    opened = []
+
+    def connect():
+        opened.append(BrokenConnection() if not opened else sqlite3.connect(':memory:', check_same_thread=False))
+        return opened[-1]
+    pool = OmnicorpPool(connect, size=1, prepare=False, placeholder='?')
+    with pytest.raises((sqlite3.OperationalError, ValueError)):
+        with pool.connection():
+            if fail_inside:
+                raise ValueError('bad query')
+    assert opened[0].closed
+    # the next caller gets a new connection instead of the broken one
+    with pool.connection() as conn:
+        assert conn is opened[1]
+    assert pool.created == 1
+    pool.close()
+
+
+def test_pool_wakes_waiters_when_a_slot_is_freed():
+    import threading
+    broken = BrokenConnection()
+    connections = [broken, sqlite3.connect(':memory:', check_same_thread=False)]
+    pool = OmnicorpPool(lambda: connections.pop(0), size=1, prepare=False, placeholder='?')
+    borrowed = []
+
+    def borrow():
+        with pool.connection():
+            borrowed.append(True)
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection():
+            waiter = threading.Thread(target=borrow)
+            waiter.start()
+    waiter.join(5)
+    assert borrowed == [True] and broken.closed
@@ -0,0 +1,153 @@
+from unittest.mock import Mock
+import pytest
+import greent.program
+from greent.program import Program, BREADTH_FIRST, DEPTH_FIRST
+from greent.graph_components import KNode, KEdge, LabeledID
+from greent.visited import VisitedIndex
+
+
+class DictCache:
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value):
+        self.store[key] = value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set_many(self, mapping):
+        self.store.update(mapping)
+
+
+def make_op(graph):
+    """ graph maps a curie to the curies it links to. """
+    def op(node):
+        results = []
+        for target in graph.get(node.id, []):
+            edge = KEdge(source_id=node.id, target_id=target, provided_by='test.op',
+                         original_predicate=LabeledID(identifier='RO:1', label='related to'))
+            results.append((edge, KNode(target, type='named_thing')))
+        return results
+    return op
+
+
+def make_program(graph, transitions, start_curie):
+    """ Build a program without touching redis, the broker or the node normalizer. """
+    program = Program.__new__(Program)
+    program.program_number = 0
+    program.transitions = transitions
+    program.excluded_identifiers = ['EXCLUDED:1']
+    program.visited = VisitedIndex()
+    program.rosetta = Mock()
+    program.rosetta.cache = DictCache()
+    program.rosetta.get_ops = lambda name: make_op(graph)
+    program.writer_delegator = Mock()
+    program.max_workers = 4
+    program.service_concurrency = 2
+    program.service_semaphores = {}
+    program.mode = DEPTH_FIRST
+    program.get_start_nodes = lambda: [(KNode(start_curie, type='named_thing'), 0)]
+    return program
+
+
+def written(program):
+    nodes = {c[0][0].id for c in program.writer_delegator.write_node.call_args_list}
+    edges = {(c[0][0].source_id, c[0][0].target_id) for c in program.writer_delegator.write_edge.call_args_list}
+    return nodes, edges
+
+
+@pytest.fixture(autouse=True)
+def no_annotation(monkeypatch):
+    monkeypatch.setattr(greent.program, 'annotate_shortcut', lambda node, rosetta: True)
+
+
+graph = {
+    'A:1': ['B:1', 'B:2', 'EXCLUDED:1'],
+    'B:1': ['C:1', 'A:1'],
+    'B:2': ['C:1', 'C:2'],
+    'C:1': ['B:1'],
+}
+link = {'op': 'test.op', 'predicate': None}
+transitions = {
+    0: {1: [link]},
+    1: {0: [link], 2: [link]},
+    2: {1: [link]},
+}
+
+
+def test_breadth_first_matches_depth_first():
+    depth = make_program(graph, transitions, 'A:1')
+    depth.run_program(mode=DEPTH_FIRST)
+    breadth = make_program(graph, transitions, 'A:1')
+    breadth.run_program(mode=BREADTH_FIRST)
+    assert written(depth) == written(breadth)
+    nodes, edges = written(breadth)
+    assert nodes == {'A:1', 'B:1', 'B:2', 'C:1', 'C:2'}
+    assert 'EXCLUDED:1' not in nodes
+
+
+def test_breadth_first_runs_each_call_once():
+    calls = []
+    program = make_program(graph, transitions, 'A:1')
+    op = make_op(graph)
+
+    def counting_op(node):
+        calls.append(node.id)
+        return op(node)
+    program.rosetta.get_ops = lambda name: counting_op
+    program.run_program(mode=BREADTH_FIRST)
+    assert len(calls) == len(set(calls))
+    # a second run is served from the cache
+    calls.clear()
+    program.visited = VisitedIndex()
+    program.run_program(mode=BREADTH_FIRST)
+    assert calls == []
+
+
+def test_get_service_name():
+    program = make_program(graph, transitions, 'A:1')
+    assert program.get_service_name('ctd.drug_to_gene') == 'ctd'
+    assert program.get_service_name('caster.upcast(kegg~enzyme_get_chemicals,chemical_substance)') == 'kegg'
+
+
+def test_breadth_first_resumes_from_checkpoint(tmpdir):
+    checkpoint_path = str(tmpdir.join('program.visited'))
+    interrupted = make_program(graph, transitions, 'A:1')
+    interrupted.visited = VisitedIndex(checkpoint_path)
+    dispatch_ops = interrupted.dispatch_ops
+    hops = []
+
+    def failing_dispatch(executor, calls):
+        hops.append(calls)
+        if len(hops) == 2:
+            raise KeyboardInterrupt()
+        return dispatch_ops(executor, calls)
+    interrupted.dispatch_ops = failing_dispatch
+    with pytest.raises(KeyboardInterrupt):
+        interrupted.run_program(mode=BREADTH_FIRST)
+
+    resumed = make_program(graph, transitions, 'A:1')
+    resumed.get_start_nodes = Mock(side_effect=AssertionError('should resume from the checkpoint'))
+    resumed.visited = VisitedIndex(checkpoint_path)
+    resumed.run_program(mode=BREADTH_FIRST)
+    complete = make_program(graph, transitions, 'A:1')
+    complete.run_program(mode=BREADTH_FIRST)
+    nodes, edges = written(interrupted)
+    resumed_nodes, resumed_edges = written(resumed)
+    assert (nodes | resumed_nodes, edges | resumed_edges) == written(complete)
+    assert not tmpdir.join('program.visited').exists()
+
+
+def test_visited_index():
+    visited = VisitedIndex()
+    visited.add('A:1')
+    assert 'A:1' in visited
+    assert visited.mark_completed('A:1', 'n1')
+    assert not visited.mark_completed('A:1', 'n1')
+    assert visited.mark_completed('A:1', 'n2')
+    assert visited.get_completed('A:1') == {'n1', 'n2'}
+    assert not visited.is_completed('B:1', 'n1')
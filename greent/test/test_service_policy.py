@@ -0,0 +1,106 @@
+from unittest.mock import Mock
+import pytest
+import requests
+from greent import http_client
+from greent.config import Config
+from greent.service import ServicePolicy, CircuitBreaker, TokenBucket, ServiceUnavailable
+
+
+def response(status):
+    r = Mock()
+    r.status_code = status
+    r.headers = {}
+    return r
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """ Replace the shared http client with a queue of canned responses/exceptions. """
+    queue = []
+
+    def fake_request(method, url, **kwargs):
+        item = queue.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+    monkeypatch.setattr(http_client, 'request', fake_request)
+    return queue
+
+
+def test_retry_then_succeed(responses):
+    policy = ServicePolicy('test', retries=2, backoff=0)
+    responses.extend([response(503), requests.ConnectionError('down'), response(200)])
+    assert policy.request('get', 'http://x').status_code == 200
+    stats = policy.get_stats()
+    assert stats['calls'] == 3
+    assert stats['failures'] == 2
+    assert stats['retries'] == 2
+
+
+def test_retries_exhausted_returns_last_response(responses):
+    policy = ServicePolicy('test', retries=1, backoff=0)
+    responses.extend([response(503), response(503)])
+    assert policy.request('get', 'http://x').status_code == 503
+
+
+def test_not_found_is_not_retried(responses):
+    policy = ServicePolicy('test', retries=3, backoff=0)
+    responses.extend([response(404)])
+    assert policy.request('get', 'http://x').status_code == 404
+    assert policy.get_stats()['failures'] == 0
+
+
+def test_circuit_breaker_fails_fast(responses):
+    policy = ServicePolicy('test', failure_threshold=2, reset_timeout=60)
+    responses.extend([requests.ConnectionError('down'), requests.ConnectionError('down')])
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            policy.request('get', 'http://x')
+    with pytest.raises(ServiceUnavailable):
+        policy.request('get', 'http://x')
+    assert policy.get_stats()['rejected'] == 1
+    assert policy.get_stats()['breaker'] == CircuitBreaker.OPEN
+
+
+def test_circuit_breaker_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    for _ in range(5):
+        bucket.acquire()
+    assert bucket.tokens < 1
+
+
+def test_settings_from_config():
+    context = Mock()
+    context.config = Config({
+        'service_policy': {'timeout': 10, 'retries': 1},
+        'translator': {'services': {'ctd': {'url': 'x', 'policy': {'retries': 3, 'max_in_flight': 2}}}}
+    })
+    assert ServicePolicy.get_settings('ctd', context) == {'timeout': 10, 'retries': 3, 'max_in_flight': 2}
+    assert ServicePolicy.get_settings('kegg', context) == {'timeout': 10, 'retries': 1}
+
+
+def test_streamed_responses_hold_their_slot_until_closed(responses):
+    policy = ServicePolicy('test', max_in_flight=1, retries=1, backoff=0)
+    retried, streamed = response(503), response(200)
+    closes = retried.close
+    responses.extend([retried, streamed])
+    result = policy.request('post', 'http://x', stream=True)
+    # the retried response was closed, giving its slot back
+    assert closes.call_count == 1
+    assert result is streamed
+    # the body is still being read
+    assert not policy.semaphore.acquire(blocking=False)
+    result.close()
+    result.close()
+    assert policy.semaphore.acquire(blocking=False)
+    policy.semaphore.release()
@@ -0,0 +1,40 @@
+import pandas
+from crawler.unichem import build_concordance, write_concordance, UnichemConcordance
+
+DATA_SOURCES = {1: 'CHEMBL', 7: 'CHEBI', 22: 'PUBCHEM'}
+
+
+def make_frames():
+    xrefs = pandas.DataFrame({'uci': [10, 10, 3, 3, 3, 7],
+                              'src_id': [1, 22, 7, 22, 1, 7],
+                              'src_compound_id': ['CHEMBL25', '2244', '15365', '1983', 'CHEMBL112', '9999']})
+    structures = pandas.DataFrame({'uci': [3, 10, 42], 'standardinchikey': ['RZVAJINKPMORJF', 'BSYNRYMUTXBXSQ', 'XX']})
+    return xrefs, structures
+
+
+def test_build_and_load(tmpdir):
+    curies, clusters = build_concordance(*make_frames(), DATA_SOURCES)
+    assert list(curies) == sorted(curies)
+    write_concordance(str(tmpdir), curies, clusters)
+    concordance = UnichemConcordance.load(str(tmpdir))
+    assert len(concordance) == 3
+    aspirin = concordance.get_cluster_id('PUBCHEM:2244')
+    assert aspirin == concordance.get_cluster_id('INCHIKEY:BSYNRYMUTXBXSQ')
+    assert sorted(concordance.get_cluster(aspirin)) == ['CHEMBL:CHEMBL25', 'INCHIKEY:BSYNRYMUTXBXSQ', 'PUBCHEM:2244']
+    assert concordance.get_cluster_id('CHEBI:1') is None
+    # uci 7 has no structure, so no inchikey either
+    assert concordance.get_cluster(concordance.get_cluster_id('CHEBI:9999')) == ['CHEBI:9999']
+
+
+def test_synonyms_match_grouping(tmpdir):
+    xrefs, structures = make_frames()
+    write_concordance(str(tmpdir), *build_concordance(xrefs, structures, DATA_SOURCES))
+    synonyms = UnichemConcordance.load(str(tmpdir)).get_synonyms()
+    # what the row by row version built
+    expected = {}
+    for uci, group in xrefs.groupby('uci'):
+        cluster = [f'{DATA_SOURCES[s]}:{c}' for s, c in zip(group.src_id, group.src_compound_id)]
+        cluster += ['INCHIKEY:' + k for k in structures[structures.uci == uci].standardinchikey]
+        expected.update(dict.fromkeys(cluster, set(cluster)))
+    assert synonyms == expected
+    assert synonyms['CHEBI:15365'] is synonyms['PUBCHEM:1983']
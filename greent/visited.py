@@ -0,0 +1,85 @@
+import logging
+import os
+import pickle
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__name__, level=logging.INFO)
+
+
+class VisitedIndex:
+    """ Records, for each curie a program has reached, which question nodes it has already been
+    expanded toward. Each curie maps to an int used as a bitset; question node ids are assigned
+    bits in the order they are first seen.
+
+    With a checkpoint_path the index can be saved to disk together with the work that is still
+    pending (see Program.process_frontier), so that an interrupted program can resume. """
+    def __init__(self, checkpoint_path=None):
+        self.checkpoint_path = checkpoint_path
+        self.bits = {}
+        self.completed = {}
+
+    def __contains__(self, curie):
+        return curie in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def get_bit(self, target_id):
+        bit = self.bits.get(target_id)
+        if bit is None:
+            bit = 1 << len(self.bits)
+            self.bits[target_id] = bit
+        return bit
+
+    def add(self, curie):
+        """ Start tracking a curie, with nothing completed. """
+        self.completed.setdefault(curie, 0)
+
+    def is_completed(self, curie, target_id):
+        return bool(self.completed.get(curie, 0) & self.get_bit(target_id))
+
+    def mark_completed(self, curie, target_id):
+        """ Record that curie has been expanded toward target_id. Returns False if it already was. """
+        bit = self.get_bit(target_id)
+        done = self.completed.get(curie, 0)
+        if done & bit:
+            return False
+        self.completed[curie] = done | bit
+        return True
+
+    def get_completed(self, curie):
+        """ The set of target ids completed for a curie. """
+        done = self.completed.get(curie, 0)
+        return {target_id for target_id, bit in self.bits.items() if done & bit}
+
+    def has_checkpoint(self):
+        return bool(self.checkpoint_path) and os.path.exists(self.checkpoint_path)
+
+    def checkpoint(self, pending=None):
+        """ Write the index and the pending work to checkpoint_path. The file is replaced atomically. """
+        if not self.checkpoint_path:
+            return
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'wb') as stream:
+            pickle.dump({'bits': self.bits, 'completed': self.completed, 'pending': pending},
+                        stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def load(self):
+        """ Restore the index from checkpoint_path and return the pending work saved with it. """
+        with open(self.checkpoint_path, 'rb') as stream:
+            state = pickle.load(stream)
+        self.bits = state['bits']
+        self.completed = state['completed']
+        logger.info(f'Resuming from {self.checkpoint_path}: {len(self.completed)} visited nodes')
+        return state['pending']
+
+    def clear(self):
+        """ Forget everything and remove the checkpoint. """
+        self.bits = {}
+        self.completed = {}
+        if self.has_checkpoint():
+            os.remove(self.checkpoint_path)
@@ -1,10 +1,10 @@
 import redis
-import pickle
 import os
 from collections import defaultdict
 from neo4j import GraphDatabase
 from functools import reduce
 import yaml
+from greent.cache import MsgPackCacheSerializer
 
 with open(f"{os.environ.get('ROBOKOP_HOME')}/robokop-interfaces/greent/greent.conf") as conf_file:
     bad_ids = yaml.load(conf_file, Loader = yaml.FullLoader)['bad_identifiers']
@@ -14,6 +14,8 @@ redis_credenticals = {
     'port': os.environ.get('CACHE_PORT', '6380'),
     'password': os.environ.get('CACHE_PASSWORD')
 }
+# reads both msgpack records and legacy pickles
+serializer = MsgPackCacheSerializer()
 neo4j_credentials = {
     'uri': f"bolt://{os.environ.get('NEO4J_HOST')}:{os.environ.get('NEO4J_BOLT_PORT')}",
     'auth': (
@@ -31,7 +33,7 @@ def get_service_cached_counts(service_name):
     for key_chunk in key_chunks:
         data = r.mget(key_chunk)
         for key, v in zip(key_chunk, data):
-            x = pickle.loads(v)
+            x = serializer.loads(v)
             for edge, node in x:
                 counts[key.decode('utf-8')] += 1
     return counts
@@ -103,7 +105,7 @@ def process_possible_caster_calls(service_name, missing_ops, restructured_neo4j,
     ## 4. compare against neo4j counts
     redis_structured_with_values = {}
     for key in responses:
-        value = pickle.loads(responses[key])
+        value = serializer.loads(responses[key])
         func, curie = get_real_function_and_curie(key)
         inner = redis_structured_with_values.get(func, {})
         inner_inner = inner.get(curie, set())
@@ -196,7 +198,7 @@ def inspect_errors(errors, service_name, prefix_map, size=0, chunk_size=1000):
         redis_results = pipeline.execute()
         for key, value in zip(chunk, redis_results):
             curie = mismatches[key]['curie']
-            value = pickle.loads(value)
+            value = serializer.loads(value)
             curie_prefix = curie.split(':')[0]
             actual_prefix = prefix_map[curie_prefix]
             curie = curie.replace(curie_prefix, actual_prefix)
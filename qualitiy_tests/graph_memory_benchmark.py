@@ -0,0 +1,72 @@
+"""Bytes per node and edge, and construction throughput, of KNode/KEdge against CompactKNode/CompactKEdge.
+
+    python -m qualitiy_tests.graph_memory_benchmark [--count 100000]
+
+Nodes and edges are built like GTExBuilder and the KGX loaders build them: a few predicates and
+sources shared by every edge, ids that arrive as fresh strings, and mostly empty properties.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from greent import node_types
+from greent.graph_components import KNode, KEdge, LabeledID, CompactKNode, CompactKEdge, get_labeled_id
+
+PREDICATES = [('GTEx:affects_expression_in', 'affects expression in'), ('RO:0002610', 'related to'),
+              ('SO:0001627', 'intron variant'), ('SO:0001583', 'missense variant')]
+
+
+def make_nodes(cls, count):
+    # ''.join gives each id its own string object, as a parser would
+    return [cls(''.join(['CAID:CA', str(i)]), type=node_types.SEQUENCE_VARIANT, name=''.join(['variant ', str(i)]))
+            for i in range(count)]
+
+
+def make_edges(cls, count):
+    return [cls(source_id=''.join(['CAID:CA', str(i)]),
+                target_id=''.join(['ENSEMBL:ENSG', str(i % 2000)]),
+                provided_by=''.join(['gtex.', 'sequence_variant_to_gene']),
+                ctime=1.0,
+                original_predicate=LabeledID(identifier=PREDICATES[i % 4][0], label=PREDICATES[i % 4][1]),
+                standard_predicate=LabeledID(identifier='RO:0002610', label='related to'),
+                input_id=''.join(['CAID:CA', str(i)]),
+                properties={'p-value': 0.01} if i % 10 == 0 else None)
+            for i in range(count)]
+
+
+def measure(make, cls, count):
+    """(bytes per item, items per second)"""
+    # start from an empty table of shared predicates, so the memory it takes is counted too
+    get_labeled_id.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    items = make(cls, count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # time construction without tracemalloc slowing it down
+    del items
+    gc.collect()
+    started = time.perf_counter()
+    items = make(cls, count)
+    seconds = time.perf_counter() - started
+    del items
+    return size / count, count / seconds
+
+
+def run(count):
+    print(f'{count} of each')
+    for kind, make, plain, compact in [('node', make_nodes, KNode, CompactKNode),
+                                       ('edge', make_edges, KEdge, CompactKEdge)]:
+        results = {}
+        for cls in [plain, compact]:
+            results[cls] = measure(make, cls, count)
+            print(f'  {cls.__name__:13}: {results[cls][0]:7.0f} bytes/{kind}, {results[cls][1]:9.0f} {kind}s/s')
+        print(f'  {kind}s: {results[plain][0] / results[compact][0]:.1f}x smaller, '
+              f'{results[compact][1] / results[plain][1]:.1f}x faster to build')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the memory and construction time of nodes and edges.')
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    run(args.count)
@@ -0,0 +1,65 @@
+"""Times KNode.get_synonyms_by_prefix against the full scan it replaced.
+
+    python -m qualitiy_tests.synonym_lookup_benchmark [--nodes 2000] [--synonyms 300]
+"""
+import argparse
+import random
+import timeit
+from greent import node_types
+from greent.graph_components import KNode, LabeledID
+from greent.util import Text
+
+# a chemical's synonyms are mostly pubchem substances and a tail of other sources
+PREFIX_WEIGHTS = {'PUBCHEM': 60, 'CHEMBL.COMPOUND': 5, 'MESH': 5, 'UNII': 3, 'DRUGBANK': 2, 'KEGG.COMPOUND': 2,
+                  'HMDB': 3, 'INCHIKEY': 2, 'CHEBI': 10, 'GTOPDB': 2, 'UMLS': 6}
+LOOKUPS = ['CHEBI', 'PUBCHEM', 'MESH', 'HGNC']
+
+
+def scan_synonyms_by_prefix(node, prefix):
+    return set(filter(lambda x: Text.get_curie(x).upper() == prefix.upper(), [s.identifier for s in node.synonyms]))
+
+
+def scan_labeled_ids_by_prefix(node, prefix):
+    return set(filter(lambda x: Text.get_curie(x.identifier).upper() == prefix.upper(), node.synonyms))
+
+
+def make_nodes(count, synonyms):
+    rng = random.Random(0)
+    prefixes = rng.choices(list(PREFIX_WEIGHTS), weights=list(PREFIX_WEIGHTS.values()), k=count * synonyms)
+    nodes = []
+    for i in range(count):
+        node = KNode(f'CHEBI:{i}', type=node_types.CHEMICAL_SUBSTANCE, name=f'chemical {i}')
+        node.add_synonyms(LabeledID(identifier=f'{prefix}:{rng.randrange(10 ** 7)}', label='')
+                          for prefix in prefixes[i * synonyms: (i + 1) * synonyms])
+        nodes.append(node)
+    return nodes
+
+
+def run(count, synonyms, repeat):
+    nodes = make_nodes(count, synonyms)
+    # same answers first
+    for node in nodes[:50]:
+        for prefix in LOOKUPS:
+            assert node.get_synonyms_by_prefix(prefix) == scan_synonyms_by_prefix(node, prefix)
+            assert node.get_labeled_ids_by_prefix(prefix) == scan_labeled_ids_by_prefix(node, prefix)
+    lookups = count * len(LOOKUPS)
+    print(f'{count} nodes, {synonyms} synonyms each, {lookups} lookups per run')
+    for name, scan, indexed in [('get_synonyms_by_prefix', scan_synonyms_by_prefix, KNode.get_synonyms_by_prefix),
+                                ('get_labeled_ids_by_prefix', scan_labeled_ids_by_prefix, KNode.get_labeled_ids_by_prefix)]:
+        times = {}
+        for label, function in [('scan', scan), ('indexed', indexed)]:
+            times[label] = min(timeit.repeat(lambda: [function(node, prefix) for node in nodes for prefix in LOOKUPS],
+                                             number=1, repeat=repeat))
+            print(f'  {name} {label:8}: {times[label] / lookups * 1e6:8.2f} us/lookup')
+        print(f'  {name} speedup: {times["scan"] / times["indexed"]:.1f}x')
+    build = min(timeit.repeat(lambda: make_nodes(count // 10, synonyms), number=1, repeat=repeat))
+    print(f'  building {count // 10} nodes with synonyms: {build / (count // 10) * 1e6:.1f} us/node')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark prefix lookups of KNode synonyms.')
+    parser.add_argument('--nodes', type=int, default=2000)
+    parser.add_argument('--synonyms', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.nodes, args.synonyms, args.repeat)